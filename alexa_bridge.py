@@ -1,7 +1,12 @@
 # alexa_bridge.py
-from fastapi import FastAPI
+from typing import Optional
+from fastapi import FastAPI, Header
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from app_intent_mvp import classify_intent_rule, create_calendar_event, append_sheets
+from app_intent_mvp import (classify_intent_rule, create_calendar_event, append_sheets, begin_idempotent, idempotency,
+                            tenant_denied)
+import priority_scheduler
+import tenant_store
 
 app = FastAPI()
 
@@ -9,8 +14,29 @@ class Utterance(BaseModel):
     text: str
 
 @app.post("/alexa")
-def handle(u: Utterance):
-    res = classify_intent_rule(u.text)
+def handle(u: Utterance, idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+           tenant_id: Optional[str] = Header(None, alias="X-Tenant-Id"),
+           tenant_key: Optional[str] = Header(None, alias="X-Tenant-Key")):
+    denied = tenant_denied(tenant_id, tenant_key)
+    if denied is not None:
+        return denied
+    # Alexa / Lambda の再送は最初の実行結果を返す（予定や行を二重に作らない）
+    key, fut, owner = begin_idempotent("alexa", idempotency_key, u.text, tenant_id)
+    if not owner:
+        return JSONResponse(fut.result(), headers={"Idempotent-Replayed": "true"})
+    try:
+        # 音声は interactive クラス：一括処理が走っていても上流の枠を優先して取る
+        # X-Tenant-Id（と X-Tenant-Key）があればその利用者のトークン・カレンダー・シートに書く
+        with priority_scheduler.priority(priority_scheduler.INTERACTIVE), tenant_store.tenant(tenant_id):
+            out = _handle(u.text)
+    except BaseException as e:
+        if key: idempotency.fail(key, fut, exc=e)
+        raise
+    if key: idempotency.finish(key, fut, out)
+    return out
+
+def _handle(text: str) -> dict:
+    res = classify_intent_rule(text)
     payload = res.suggested_payload
     if res.intent == "calendar":
         out = create_calendar_event(payload)
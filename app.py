@@ -7,6 +7,13 @@ from fastapi.responses import JSONResponse
 # from app.services.google_sheets import append_rows    #◇不存在関数-append_rowsの機能が不足（外部モジュール依存）
 # from app.services.lineworks import send_message       #◇不存在関数-send_messageの機能が不足（外部モジュール依存）
 # from app.utils.env import DRY_RUN
+from app_intent_mvp import create_calendar_event_async, append_sheets_async
+from tools.send_text import send_text_to_lineworks
+from tools import lw_client
+import circuit_breaker
+import rate_limiter
+import retry_policy
+from contextlib import asynccontextmanager
 import logging
 from typing import List, Optional, Union
 from pydantic import BaseModel
@@ -31,96 +38,127 @@ class AppendSheetRequest(BaseModel):
 
 class NotifyRequest(BaseModel):
     text: str
-app = FastAPI(title="Google×LINE WORKS 効率化API", version="0.1.0")
+
+# 追加：未定義だった Google 呼び出し（app_intent_mvp の asyncio ネイティブ版に委譲）
+async def create_event(body: dict) -> dict:
+    return await create_calendar_event_async(body)
+
+async def append_rows(values) -> dict:
+    # 1行（List[str]）でも複数行（List[List[str]]）でも 2次元配列にそろえる
+    rows = values if values and isinstance(values[0], list) else [values]
+    return await append_sheets_async(rows)
+
+async def send_message(text: str) -> dict:
+    if not text or not text.strip():
+        raise ValueError("text が空です")
+    return {"sent": await send_text_to_lineworks(text)}
+
+# LINE WORKS 通知用の共有 HTTP クライアントを起動/終了時に開閉
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await lw_client.startup()
+    yield
+    await lw_client.shutdown()
+
+app = FastAPI(title="Google×LINE WORKS 効率化API", version="0.1.0", lifespan=lifespan)
 
 @app.get("/health")
 async def health():
-    return {"status": "ok", "dry_run": DRY_RUN}
+    return {"status": "ok", "dry_run": DRY_RUN, "circuits": circuit_breaker.states()}
 
 
 #Copilot提案～APIエンドポイントのエラーレスポンスを2段構え＆標準化
+# 429/5xx/通信エラーの再試行は create_event / append_rows の内側（retry_policy）で済んでいる。
+# ここに来た例外は「再試行しても駄目だった」か「再試行すべきでない」もの。
+# サーキットブレーカが open / クライアント側レート制限の予算切れの場合も同じく 503 ですぐ返す。
+def _upstream_unavailable(e: Exception) -> bool:
+    return (isinstance(e, (circuit_breaker.CircuitOpenError, rate_limiter.RateLimitedError))
+            or retry_policy.reason_of(e) is not None)
+
+
+def _unavailable_response(action: str, e: Exception) -> JSONResponse:
+    retry_after = getattr(e, "retry_after", None)
+    return JSONResponse({
+        "ok": False, "action": action,
+        "message": "外部サービスが混み合っています。しばらくしてから再度お試しください。",
+        "detail": str(e)
+    }, status_code=503, headers={"Retry-After": str(max(1, int(retry_after + 0.999)))} if retry_after is not None else None)
+
+
 @app.post("/calendar/events")
 async def post_calendar_event(req: CreateEventRequest):
     action = "Google Calendarへの予定登録"
-    #Copilot提案～HTTP 429/5xxは0.5秒リトライ＋Calendar 403は再同意ガイド
-    import asyncio
-    for attempt in range(2):
-        try:
-            created = await create_event({
-                "summary": req.summary,
-                "description": req.description,
-                "start": {"dateTime": req.start},
-                "end": {"dateTime": req.end},
-            })
-            logger.info("Google Calendar登録成功: %s", created)
-            return JSONResponse({"ok": True, "action": action, "created": created})
-        except Exception as e:
-            msg = str(e)
-            # HTTPエラー判定例（本来はAPIレスポンスのstatus_codeで判定）
-            if "403" in msg:
-                logger.warning("Google Calendar 403: %s", e)
-                return JSONResponse({
-                    "ok": False, "action": action,
-                    "message": "Google連携の有効期限が切れています。再度連携をやり直してください。",
-                    "detail": msg
-                }, status_code=403)
-            if ("429" in msg or "5" in msg) and attempt == 0:
-                logger.warning("Google Calendar 429/5xx: %s (リトライ)", e)
-                await asyncio.sleep(0.5)
-                continue
-            if "credentials" in msg or "認証" in msg:
-                message = "認証情報が設定されていません。管理者にご連絡ください。"
-            elif "権限" in msg or "permission" in msg:
-                message = "権限が不足しています。Googleの共有設定を確認してください。"
-            elif "日付" in msg or "時刻" in msg or "parse" in msg:
-                message = "日時の解釈に失敗しました。入力内容を見直してください。"
-            else:
-                message = "開始・終了の日時や必須項目を見直してください。"
-            logger.warning("Google Calendar登録失敗: %s", e)
+    try:
+        created = await create_event({
+            "summary": req.summary,
+            "description": req.description,
+            "start": {"dateTime": req.start},
+            "end": {"dateTime": req.end},
+        })
+        logger.info("Google Calendar登録成功: %s", created)
+        return JSONResponse({"ok": True, "action": action, "created": created})
+    except Exception as e:
+        msg = str(e)
+        #Copilot提案～Calendar 403は再同意ガイド
+        if retry_policy.status_of(e) == 403:
+            logger.warning("Google Calendar 403: %s", e)
             return JSONResponse({
                 "ok": False, "action": action,
-                "message": message,
+                "message": "Google連携の有効期限が切れています。再度連携をやり直してください。",
                 "detail": msg
-            }, status_code=400)
+            }, status_code=403)
+        if _upstream_unavailable(e):
+            logger.warning("Google Calendar 429/5xx（再試行打ち切り）: %s", e)
+            return _unavailable_response(action, e)
+        if "credentials" in msg or "認証" in msg:
+            message = "認証情報が設定されていません。管理者にご連絡ください。"
+        elif "権限" in msg or "permission" in msg:
+            message = "権限が不足しています。Googleの共有設定を確認してください。"
+        elif "日付" in msg or "時刻" in msg or "parse" in msg:
+            message = "日時の解釈に失敗しました。入力内容を見直してください。"
+        else:
+            message = "開始・終了の日時や必須項目を見直してください。"
+        logger.warning("Google Calendar登録失敗: %s", e)
+        return JSONResponse({
+            "ok": False, "action": action,
+            "message": message,
+            "detail": msg
+        }, status_code=400)
 
 
 #Copilot提案～Google Sheets APIエラーも2段構え＆標準化
 @app.post("/sheets/append")
 async def post_sheets_append(req: AppendSheetRequest):
     action = "Google Sheetsへのメモ追記"
-
-    #Copilot提案～Sheets 400 "Unable to parse range"はタブ名エラー文＋0.5秒リトライ
-    import asyncio
-    for attempt in range(2):
-        try:
-            result = await append_rows(req.values)
-            logger.info("Google Sheetsメモ追加成功: %s", result)
-            return JSONResponse({"ok": True, "action": action, "result": result})
-        except Exception as e:
-            msg = str(e)
-            if "Unable to parse range" in msg:
-                logger.warning("Sheetsタブ名不一致: %s", e)
-                return JSONResponse({
-                    "ok": False, "action": action,
-                    "message": f"指定したシート名が見つかりません: {msg}",
-                    "detail": msg
-                }, status_code=400)
-            if ("429" in msg or "5" in msg) and attempt == 0:
-                logger.warning("Google Sheets 429/5xx: %s (リトライ)", e)
-                await asyncio.sleep(0.5)
-                continue
-            if "credentials" in msg or "認証" in msg:
-                message = "認証情報が設定されていません。管理者にご連絡ください。"
-            elif "権限" in msg or "permission" in msg:
-                message = "権限が不足しています。Googleの共有設定を確認してください。"
-            else:
-                message = "values は 2次元配列（行の配列）で指定してください。"
-            logger.warning("Google Sheetsメモ追加失敗: %s", e)
+    try:
+        result = await append_rows(req.values)
+        logger.info("Google Sheetsメモ追加成功: %s", result)
+        return JSONResponse({"ok": True, "action": action, "result": result})
+    except Exception as e:
+        msg = str(e)
+        #Copilot提案～Sheets 400 "Unable to parse range"はタブ名エラー文
+        if "Unable to parse range" in msg:
+            logger.warning("Sheetsタブ名不一致: %s", e)
             return JSONResponse({
                 "ok": False, "action": action,
-                "message": message,
+                "message": f"指定したシート名が見つかりません: {msg}",
                 "detail": msg
             }, status_code=400)
+        if _upstream_unavailable(e):
+            logger.warning("Google Sheets 429/5xx（再試行打ち切り）: %s", e)
+            return _unavailable_response(action, e)
+        if "credentials" in msg or "認証" in msg:
+            message = "認証情報が設定されていません。管理者にご連絡ください。"
+        elif "権限" in msg or "permission" in msg:
+            message = "権限が不足しています。Googleの共有設定を確認してください。"
+        else:
+            message = "values は 2次元配列（行の配列）で指定してください。"
+        logger.warning("Google Sheetsメモ追加失敗: %s", e)
+        return JSONResponse({
+            "ok": False, "action": action,
+            "message": message,
+            "detail": msg
+        }, status_code=400)
 
 
 #Copilot提案～LINE WORKS通知APIも2段構え＆標準化
@@ -159,6 +197,9 @@ async def post_notify(req: NotifyRequest):
 from fastapi import Body
 import re
 from datetime import datetime, timedelta
+import intent_engine
+
+_TITLE_STRIP_RE = re.compile(r'\d+時|\d+分|明日|今日|あした|来週|再来週|に|から')
 
 def _parse_relative_date(text: str) -> datetime:
     """超簡易：明日/今日 のみ対応。なければ今日を返す。"""
@@ -174,19 +215,12 @@ def _parse_relative_date(text: str) -> datetime:
 
 def _extract_time(text: str) -> tuple[int,int]:
     """'10時30分' '14時' のような時刻を拾う。見つからなければ(10,0)。"""
-    m = re.search(r'(\d{1,2})\s*時\s*(\d{1,2})?\s*分?', text)
-    if m:
-        h = int(m.group(1))
-        mi = int(m.group(2)) if m.group(2) else 0
-        return h, mi
-    return 10, 0
+    return intent_engine.scan(text).kanji_time or (10, 0)
 
 def _extract_duration(text: str) -> int:
     """'30分' があれば分で返す。なければ30分。"""
-    m = re.search(r'(\d{1,3})\s*分', text)
-    if m:
-        return int(m.group(1))
-    return 30
+    dur = intent_engine.scan(text).duration
+    return 30 if dur is None else dur
 
 def classify_intent(text: str) -> dict:
     """
@@ -213,13 +247,14 @@ def classify_intent(text: str) -> dict:
    # app.py の classify_intent() の calendar 分岐だけ差し替え / 修正
     if "時" in t:
         base = _parse_relative_date(t)
-        hh, mm = _extract_time(t)
-        dur = _extract_duration(t)
+        tok = intent_engine.scan(t)  # 時刻と所要時間は1回の走査で拾う
+        hh, mm = tok.kanji_time or (10, 0)
+        dur = 30 if tok.duration is None else tok.duration
         start = base.replace(hour=hh, minute=mm)
         end = start + timedelta(minutes=dur)
 
     # タイトルを簡易抽出（数字や助詞を除去しつつ末尾寄り）
-    title = re.sub(r'\d+時|\d+分|明日|今日|あした|来週|再来週|に|から', '', t).strip() or "無題の予定"
+    title = _TITLE_STRIP_RE.sub('', t).strip() or "無題の予定"
 
     return {
         "intent": "calendar",
@@ -1,14 +1,37 @@
 # app_intent_mvp.py
-from fastapi import FastAPI, Body
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi import FastAPI, Body, Header, Request
+from fastapi.responses import JSONResponse, RedirectResponse, Response
 import os, re, json
 from datetime import datetime, timedelta, timezone
 from typing import Literal, Optional, Dict, Any, Tuple
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 from dotenv import load_dotenv
 from loguru import logger
 from pathlib import Path
-import httpx, asyncio
+import asyncio, atexit, threading, time
+from concurrent.futures import Future
+from contextlib import AsyncExitStack, ExitStack, asynccontextmanager, contextmanager
+from creds_cache import CredsCache, atomic_write_text
+from tenant_store import TenantCreds
+from google_services import calendar_service, insert_event, new_event_id, sheets_service
+from sheets_buffer import SheetsAppendBuffer
+from google_async import GoogleAsyncClient
+from llm_cache import LLMCache, cache_key
+from idempotency import IdempotencyStore, key_for as idempotency_key_for
+from circuit_breaker import CircuitOpenError
+from rate_limiter import RateLimitedError
+from outbox import Outbox, OutboxWorker, is_retryable_unsent
+from single_flight import SingleFlight
+from tools import lw_client, notify_queue
+import cache_backend
+import circuit_breaker
+import intent_engine
+import intent_model
+import metrics
+import priority_scheduler
+import rate_limiter
+import retry_policy
+import tenant_store
 
 
 # === 基本設定 ===
@@ -73,37 +96,32 @@ def _materialize_if_content(value: str|None, fname: str) -> Path|None:
     return p
 
 # 👇 共通の資格情報取得：Calendar/Sheets の両方が必ず同じ token を使う
-def get_google_creds():
+def _token_path() -> Path:
+    return _resolve_path(os.getenv("GOOGLE_OAUTH_TOKEN_PATH", ".env.variables/google_token.json"))
+
+def _load_google_creds():
+    """トークン/クライアントJSONをディスクから読んで Credentials を組み立てる（refresh はしない）。"""
+    token_file = _token_path()
+    if not token_file.exists():
+        raise RuntimeError("OAuth トークンがありません。先に `python token_setup.py` を実行して同意コードで発行してください。")
+    return _build_google_creds(json.loads(token_file.read_text(encoding="utf-8")))
+
+def _build_google_creds(raw: dict):
+    """トークン JSON（ファイル / テナントの保存先どちらでも同じ形）から Credentials を組み立てる。"""
     from google.oauth2.credentials import Credentials
-    from google.auth.transport.requests import Request
 
     client_json = _materialize_if_content(
         os.getenv("GOOGLE_OAUTH_CLIENT_JSON"), "google_oauth_client.json")
-    token_file  = _resolve_path(os.getenv("GOOGLE_OAUTH_TOKEN_PATH", ".env.variables/google_token.json"))
-
     if not client_json or not client_json.exists():
         raise RuntimeError("GOOGLE_OAUTH_CLIENT_JSON が見つかりません")
-    if not token_file.exists():
-        raise RuntimeError("OAuth トークンがありません。先に `python token_setup.py` を実行して同意コードで発行してください。")
 
-    import json
-    raw = json.loads(token_file.read_text(encoding="utf-8"))
     cfg = json.loads(client_json.read_text(encoding="utf-8")).get("web", {})
     client_id = cfg.get("client_id"); client_secret = cfg.get("client_secret")
-    token_uri = cfg.get("token_uri", "https://oauth2.googleapis.com/token")
+    # GOOGLE_TOKEN_URI があれば優先（負荷試験でローカルのスタブに向ける時など）
+    token_uri = os.getenv("GOOGLE_TOKEN_URI") or cfg.get("token_uri", "https://oauth2.googleapis.com/token")
     if not client_id or not client_secret:
         raise RuntimeError("client_secret.json が Webクライアント形式ではありません。『ウェブアプリ』で作り直してください。")
 
-    # ←← ここがポイント：expires_at(秒) があれば ISO8601 にして expiry に入れる 0815GPT提案上手くいかないからコメントアウト
-    # expiry_iso = None
-    # try:
-    #     ea = raw.get("expires_at")
-    #     if isinstance(ea, (int, float)) and ea > 0:
-    #         from datetime import datetime, timezone
-    #         expiry_iso = datetime.fromtimestamp(ea, tz=timezone.utc).isoformat()
-    # except Exception:
-    #     pass
-
         # ←← ここがポイント：expires_at(秒) があれば RFC3339 "Z" 形式に
     expiry_iso = None
     try:
@@ -112,6 +130,9 @@ def get_google_creds():
             from datetime import datetime, timezone
             # 例: 2025-08-15T09:12:34Z  ← コロン付きオフセットを避ける
             expiry_iso = datetime.fromtimestamp(ea, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        elif raw.get("expiry"):
+            # refresh 後に creds.to_json() で保存した形式（token / expiry）
+            expiry_iso = raw["expiry"]
     except Exception:
         pass
 
@@ -123,7 +144,7 @@ def get_google_creds():
         "client_id": client_id,
         "client_secret": client_secret,
         "refresh_token": raw.get("refresh_token"),
-        "token": raw.get("access_token"),
+        "token": raw.get("access_token") or raw.get("token"),
         "scopes": scopes or SCOPES,
         "token_uri": token_uri,
         # ここを追加：有効期限が未来なら creds.valid になり refresh を走らせない
@@ -131,62 +152,97 @@ def get_google_creds():
         "type": "authorized_user",
     }
     creds = Credentials.from_authorized_user_info(authorized_user, SCOPES)
-
-    # ネット不通で refresh 失敗させないための安全弁：
-    # expiry が設定され有効ならそのまま使い、期限切れ時だけ refresh を試みる
-    if not creds.valid:
-        if creds.expired and creds.refresh_token:
-            # ここでネット疎通が必要になる点に注意（長期運用はネット修復が必須）
-            creds.refresh(Request())
-            token_file.parent.mkdir(parents=True, exist_ok=True)
-            token_file.write_text(creds.to_json(), encoding="utf-8")
-        else:
-            raise RuntimeError("OAuth トークンを更新できません。再同意が必要です。")
-
+    if os.getenv("GOOGLE_TOKEN_URI"):
+        # from_authorized_user_info は token_uri を Google の既定値で上書きするので付け直す
+        # （with_token_uri のコピーは expiry を引き継がないので戻す）
+        expiry = creds.expiry
+        creds = creds.with_token_uri(token_uri)
+        creds.expiry = expiry
     _assert_token_has_scopes(creds)
     return creds
 
+def _save_google_creds(creds) -> None:
+    # refresh した時だけ呼ばれる。途中で落ちても壊れたトークンを残さないよう原子的に書く
+    atomic_write_text(_token_path(), creds.to_json())
+
+# ネット不通で refresh 失敗させないための安全弁：
+# 有効な間はメモリ上の Credentials を使い回し、期限前にバックグラウンドで refresh する
+_CREDS_CACHE = CredsCache(_load_google_creds, _save_google_creds)
+
+# 複数テナント：トークンは SQLite に置き、最近使ったテナントの Credentials だけメモリに持つ
+token_store = tenant_store.from_env()
+_TENANT_CREDS = TenantCreds(token_store, _build_google_creds,
+                            maxsize=int(os.getenv("GOOGLE_TENANT_CACHE_SIZE", "256")),
+                            settings_ttl=float(os.getenv("GOOGLE_TENANT_SETTINGS_TTL_SEC", "60")))
+
+def tenant_denied(tenant_id: Optional[str], tenant_key: Optional[str]) -> Optional[JSONResponse]:
+    """
+    X-Tenant-Id を指定した依頼は、そのテナントの API キー（X-Tenant-Key）が合わなければ 401 を返す。
+    ヘッダで名乗るだけで他の利用者のカレンダー・シートに書けないように。テナント未指定は従来どおり。
+    """
+    if not tenant_id or _TENANT_CREDS.verify(tenant_id, tenant_key):
+        return None
+    metrics.inc("tenant_auth_failed")
+    logger.warning(f"tenant auth failed: {tenant_id}")
+    return JSONResponse({"ok": False, "hint": "X-Tenant-Key が正しくありません。"}, status_code=401)
+
+def get_google_creds():
+    """今のテナント（X-Tenant-Id）の Credentials。テナント未指定なら GOOGLE_OAUTH_TOKEN_PATH のもの。"""
+    t = tenant_store.current()
+    return _TENANT_CREDS.get(t) if t else _CREDS_CACHE.get()
+
+def peek_google_creds():
+    """メモリにある有効な Credentials だけを返す（無ければ None）。非同期クライアントの高速路用。"""
+    t = tenant_store.current()
+    return _TENANT_CREDS.peek(t) if t else _CREDS_CACHE.peek()
+
+def google_settings() -> Dict[str, Any]:
+    """今のテナントの書き込み先。テナントの設定に無い項目は環境変数の値。"""
+    t = tenant_store.current()
+    conf = _TENANT_CREDS.settings(t) if t else {}  # LRU のエントリに持っている（settings_ttl ごとに読み直す）
+    return {
+        "calendar_id": conf.get("calendar_id") or os.getenv("GOOGLE_CALENDAR_ID", "primary"),
+        "sheets_id": conf.get("sheets_id") or os.getenv("SHEETS_ID"),
+        "sheets_range": conf.get("sheets_range") or os.getenv("GOOGLE_SHEETS_RANGE", "Sheet1!A:C"),
+    }
+
 
 # === イントント判定 ===
 class IntentResult(BaseModel):
     intent: Literal["calendar","memo","unknown"]
     suggested_payload: Optional[Dict[str, Any]] = None
+    # LLM に聞けなかった（締切・同時実行数・エラー・ブレーカー）unknown。応答には出さない
+    _degraded: bool = PrivateAttr(default=False)
 
-def _parse_relative_date(text: str) -> datetime:
+def _parse_relative_date(text: str, tokens: Optional[intent_engine.Tokens] = None) -> datetime:
+    tokens = tokens or intent_engine.scan(text)
     now = datetime.now(JST)
-    if any(k in text for k in ["明日","あした","tomorrow"]):
+    if tokens.tomorrow:
         return (now+timedelta(days=1)).replace(hour=0,minute=0,second=0,microsecond=0)
-    if any(k in text for k in ["今日","きょう","today"]):
-        return now.replace(hour=0,minute=0,second=0,microsecond=0)
+    # 「今日」もキーワード無しも当日扱い
     return now.replace(hour=0,minute=0,second=0,microsecond=0)
 
 def _extract_time(text: str) -> Tuple[int,int]:
-    m = re.search(r'(\d{1,2})\s*時\s*(\d{1,2})?\s*分?', text)
-    if m: return int(m.group(1)), int(m.group(2) or 0)
-    m2 = re.search(r'(\d{1,2}):(\d{2})', text)
-    if m2: return int(m2.group(1)), int(m2.group(2))
-    return 10,0
+    return intent_engine.scan(text).time or (10,0)
 
 def _extract_duration(text: str) -> int:
-    m = re.search(r'(\d{1,3})\s*分', text)
-    return int(m.group(1)) if m else 30
+    dur = intent_engine.scan(text).duration
+    return 30 if dur is None else dur
 
 def classify_intent_rule(text: str) -> IntentResult:
     t = (text or "").strip()
     if not t:
         return IntentResult(intent="unknown")
 
+    # 本文は1回だけ走査（キーワード・時刻・所要時間をまとめて拾う）
+    tok = intent_engine.scan(t)
+
     # ① メモ → Sheets
-    if any(k in t for k in ["メモ","日報","memo"]):
-        ts = datetime.now(JST).strftime("%Y-%m-%d %H:%M:%S")
-        body = re.sub(r'^(メモ[:：]?)', '', t).strip()
-        return IntentResult(
-            intent="memo",
-            suggested_payload={"values": [[ts, "memo", body]]}
-        )
+    if tok.memo:
+        return _memo_result(t)
 
-    # ② 「来週(◯)曜 … 終日 … 有休/休暇」→ カレンダー終日
-    m = re.search(r"(来週)?(?P<wd>[月火水木金土日])曜.*?(終日|全日).*(有休|休暇)", t)
+    # ② 「来週(◯)曜 … 終日 … 有休/休暇」→ カレンダー終日（必要なキーワードが揃った時だけ正規表現を評価）
+    m = intent_engine.ALLDAY_RE.search(t) if tok.allday_candidate else None
     if m:
         # ヘルパーはファイル上部で宣言済み：
         # _JP_WD, _next_week_same_weekday, _all_day_payload
@@ -204,65 +260,508 @@ def classify_intent_rule(text: str) -> IntentResult:
         )
 
     # ③ 時刻あり → カレンダー（デフォ30分）
-    if "時" in t or re.search(r'\d{1,2}:\d{2}', t):
-        base = _parse_relative_date(t)
-        hh, mm = _extract_time(t)
-        dur = _extract_duration(t)
-        start = base.replace(hour=hh, minute=mm)
-        end = start + timedelta(minutes=dur)
-        title = re.sub(r'\d+時|\d+分|\d{1,2}:\d{2}|明日|今日|あした|に|から', '', t).strip() or "無題の予定"
-        return IntentResult(
-            intent="calendar",
-            suggested_payload={
-                "summary": title,
-                "start": start.strftime("%Y-%m-%dT%H:%M:%S+09:00"),
-                "end":   end.strftime("%Y-%m-%dT%H:%M:%S+09:00"),
-                "description": ""
-            }
-        )
+    if tok.has_time:
+        return _calendar_result(t, tok)
 
     return IntentResult(intent="unknown")
 
+def _memo_result(t: str) -> IntentResult:
+    # strftime("%Y-%m-%d %H:%M:%S") と同じ文字列（isoformat の方が速い）
+    ts = datetime.now(JST).replace(microsecond=0, tzinfo=None).isoformat(" ")
+    body = intent_engine.MEMO_PREFIX_RE.sub('', t).strip()
+    return IntentResult(
+        intent="memo",
+        suggested_payload={"values": [[ts, "memo", body]]}
+    )
+
+def _calendar_result(t: str, tok: intent_engine.Tokens, at: Optional[Tuple[int,int]] = None) -> IntentResult:
+    # 時刻が無ければ 10:00、所要時間が無ければ 30分（at はルールが拾わない時刻。件名からは外す）
+    base = _parse_relative_date(t, tok)
+    hh, mm = at or tok.time or (10,0)
+    dur = 30 if tok.duration is None else tok.duration
+    start = base.replace(hour=hh, minute=mm)
+    end = start + timedelta(minutes=dur)
+    src = intent_engine.LOOSE_TIME_RE.sub('', t) if at else t
+    title = intent_engine.TITLE_STRIP_RE.sub('', src).strip() or "無題の予定"
+    return IntentResult(
+        intent="calendar",
+        suggested_payload={
+            "summary": title,
+            # JST・秒以下0 なので isoformat は "%Y-%m-%dT%H:%M:%S+09:00" と同じ
+            "start": start.isoformat(),
+            "end":   end.isoformat(),
+            "description": ""
+        }
+    )
+
+
+# === ローカルモデル（LLM の前段・opt-in） ===
+# 文字 n-gram の軽量モデル。同梱の学習データは少なく確信度が当てにならないので、
+# 書き込みの根拠にするのは本文に裏付けがある判定だけ（ルールが拾わない表現。intent_engine 参照）：
+#   memo     … 「覚えておいて」「買い物リスト」など書き留める依頼の言い回しがある
+#   calendar … 「正午」「3pm」など「時」「HH:MM」を使わない時刻がある
+# それ以外は LLM に回し、/intent/route の応答に hint として付けるだけにする
+INTENT_MODEL_ENABLED = os.getenv("INTENT_MODEL_ENABLED", "false").lower() == "true"
+INTENT_MODEL_PATH = os.getenv("INTENT_MODEL_PATH", str(BASE_DIR / "intent_model.npz"))
+INTENT_MODEL_SAMPLES = os.getenv("INTENT_MODEL_SAMPLES", str(BASE_DIR / "intent_samples.jsonl"))
+INTENT_MODEL_MIN_CONFIDENCE = float(os.getenv("INTENT_MODEL_MIN_CONFIDENCE", "0.8"))
+_intent_model: Optional[Any] = None
+_intent_model_loaded = False
+_intent_model_lock = threading.Lock()
+
+def get_intent_model():
+    """モデルを1回だけ読む。ファイルが無ければ同梱の学習データからその場で学習（数ms）。無効なら None。"""
+    global _intent_model, _intent_model_loaded
+    if _intent_model_loaded:
+        return _intent_model
+    with _intent_model_lock:
+        if not _intent_model_loaded and not INTENT_MODEL_ENABLED:
+            _intent_model_loaded = True
+        if not _intent_model_loaded:
+            try:
+                model = intent_model.load_model(INTENT_MODEL_PATH)
+                if model is None and intent_model.np is not None and Path(INTENT_MODEL_SAMPLES).exists():
+                    model = intent_model.train(intent_model.read_samples(INTENT_MODEL_SAMPLES))
+            except Exception as e:
+                logger.warning(f"intent model unavailable: {e}")
+                model = None
+            _intent_model, _intent_model_loaded = model, True
+    return _intent_model
+
+def _model_result(t: str, label: str, confidence: float) -> Optional[IntentResult]:
+    if confidence < INTENT_MODEL_MIN_CONFIDENCE or label == "unknown":
+        return None
+    if label == "memo":
+        if not intent_engine.MEMO_CUE_RE.search(t):
+            return None
+        res = _memo_result(t)
+    else:
+        at = intent_engine.loose_time(t)
+        if at is None:
+            return None  # 時刻が無いと 10:00・30分 をでっち上げることになる
+        res = _calendar_result(t, intent_engine.scan(t), at)
+    metrics.inc("intent_model_resolved", intent=label)
+    return res
+
+def classify_intent_model(text: str) -> Optional[IntentResult]:
+    """ローカルモデルで判定。検証できない / 確信度が足りない / モデルが無い場合は None（→ LLM へ）。"""
+    t = (text or "").strip()
+    model = get_intent_model()
+    if not t or model is None:
+        return None
+    with metrics.timer("model") as st:
+        res = _model_result(t, *model.predict(t))
+        st["intent"] = res.intent if res else "deferred"
+    return res
+
+def classify_intent_model_batch(texts: list) -> list:
+    """classify_intent_model のまとめ版（1回の行列積で判定）。"""
+    model = get_intent_model()
+    if model is None or not texts:
+        return [None] * len(texts)
+    ts = [(x or "").strip() for x in texts]
+    return [_model_result(t, label, conf) if t else None
+            for t, (label, conf) in zip(ts, model.predict_batch(ts))]
+
+def model_hints(texts: list) -> list:
+    """
+    ローカルモデルの推定（{"intent", "confidence"}、確信度が足りなければ None）。
+    書き込みには使わず、unknown になった /intent/route の応答に参考として付ける。
+    """
+    model = get_intent_model()
+    if model is None or not texts:
+        return [None] * len(texts)
+    ts = [(x or "").strip() for x in texts]
+    return [{"intent": label, "confidence": round(conf, 3)}
+            if t and label != "unknown" and conf >= INTENT_MODEL_MIN_CONFIDENCE else None
+            for t, (label, conf) in zip(ts, model.predict_batch(ts))]
+
+async def classify_intent_fallback(text: str) -> Optional[IntentResult]:
+    """ルールで unknown になった文面：ローカルモデル → （確信度が低ければ）LLM。"""
+    return classify_intent_model(text) or await classify_intent_llm_async(text)
+
+# 再送・複数デバイスから同時に来た同じ文面は、モデル / LLM の判定を1回だけ行って結果を共有する。
+# payload（予定の件名・メモの本文）は文面から作られるので、キーは前後の空白だけを落とした文面のまま
+# （normalize_text で揃えると、全角・大文字違いの依頼に他人の文面の payload を返してしまう）
+_classify_flight = SingleFlight("classify")
+
+async def classify_intent(text: str) -> IntentResult:
+    """ルール → unknown ならローカルモデル / LLM。/intent/route と /execute の判定段階。"""
+    with metrics.timer("rule") as st:
+        result = classify_intent_rule(text)  # 軽いのでまとめない（payload も各自の文面から）
+        st["intent"] = result.intent
+    if result.intent == "unknown":
+        llm = await _classify_flight.do(text.strip(), lambda: classify_intent_fallback(text))
+        if llm:
+            result = llm
+        elif os.getenv("OPENAI_API_KEY"):
+            # キーがあるのに None なのは判定できなかった時だけ（LLM が unknown と答えたなら IntentResult が返る）
+            result = IntentResult(intent="unknown")
+            result._degraded = True
+    return result
+
 
 # === LLMフォールバック（任意） ===
-def classify_intent_llm(text: str) -> Optional[IntentResult]:
+# 同じ言い回しの再判定を避けるキャッシュ（None=失敗はキャッシュしない）
+# CACHE_BACKEND=sqlite なら全ワーカーで共有（1ワーカーが LLM に聞いた結果を他のワーカーも使う）
+llm_cache = LLMCache(backend=cache_backend.from_env(
+    "llm",
+    maxsize=int(os.getenv("INTENT_LLM_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("INTENT_LLM_CACHE_TTL_SEC", "3600")),
+    path=os.getenv("INTENT_LLM_CACHE_PATH") or None,
+))
+
+def _llm_model() -> str:
+    return os.getenv("INTENT_LLM_MODEL","gpt-4o-mini")
+
+_LLM_SYSTEM = "日本語指示を calendar/memo/unknown に分類し、payloadをJSONで簡潔に返して。時間あいまいは+09:00で30分。"
+
+def _llm_result(content: str) -> IntentResult:
+    data = json.loads(content)
+    return IntentResult(intent=data.get("intent","unknown"),
+                        suggested_payload=data.get("suggested_payload"))
+
+# --- API 経路（/intent/route・/execute）：締切つき・同時実行数つき ---
+# 遅い応答1件でリクエスト全体が詰まらないよう、締切を過ぎたら unknown 扱いにする
+INTENT_LLM_TIMEOUT_SEC = float(os.getenv("INTENT_LLM_TIMEOUT_SEC", "3"))
+INTENT_LLM_MAX_CONCURRENCY = int(os.getenv("INTENT_LLM_MAX_CONCURRENCY", "8"))
+# 再試行も締切の内側で（既定は1回だけ再試行）
+LLM_RETRY = retry_policy.from_env("openai", max_attempts=2, budget=INTENT_LLM_TIMEOUT_SEC)
+
+# AsyncOpenAI / Semaphore はイベントループに紐づくので、ループごとに作り直す
+_llm_async: Dict[str, Any] = {"loop": None, "api_key": None, "client": None, "sem": None}
+
+def _new_async_llm_client(api_key: str):
+    from openai import AsyncOpenAI
+    # 締切はこちらで管理するので SDK 側の再試行は切る
+    return AsyncOpenAI(api_key=api_key, max_retries=0, timeout=INTENT_LLM_TIMEOUT_SEC)
+
+def _async_llm(api_key: str):
+    loop = asyncio.get_running_loop()
+    st = _llm_async
+    if st["loop"] is not loop or st["api_key"] != api_key:
+        st.update(loop=loop, api_key=api_key, client=_new_async_llm_client(api_key),
+                  sem=asyncio.Semaphore(INTENT_LLM_MAX_CONCURRENCY))
+    return st["client"], st["sem"]
+
+async def close_async_llm_client() -> None:
+    client = _llm_async["client"]
+    _llm_async.update(loop=None, api_key=None, client=None, sem=None)
+    if client is not None:
+        await client.close()
+
+async def classify_intent_llm_async(text: str) -> Optional[IntentResult]:
+    """
+    LLM で判定する。共有クライアントを使い、
+    同時実行数が上限なら待たずに、締切を過ぎたら打ち切って None（＝unknown のまま）を返す。
+    """
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         return None
-    try:
-        from openai import OpenAI
-        client = OpenAI(api_key=api_key)
-        sys = "日本語指示を calendar/memo/unknown に分類し、payloadをJSONで簡潔に返して。時間あいまいは+09:00で30分。"
-        r = client.chat.completions.create(
-            model=os.getenv("INTENT_LLM_MODEL","gpt-4o-mini"),
-            messages=[{"role":"system","content":sys},{"role":"user","content":text}],
-            temperature=0.1
-        )
-        data = json.loads(r.choices[0].message.content)
-        return IntentResult(intent=data.get("intent","unknown"),
-                            suggested_payload=data.get("suggested_payload"))
-    except Exception as e:
-        logger.warning(f"LLM fallback failed: {e}")
+    key = cache_key(text, _llm_model())
+    hit = await asyncio.to_thread(llm_cache.get, key)  # CACHE_BACKEND=sqlite なら I/O なのでループの外で
+    if hit is not None:
+        return IntentResult(**hit)
+    client, sem = _async_llm(api_key)
+    if sem.locked():
+        metrics.inc("llm_fallback_rejected")
+        logger.warning("LLM fallback rejected: concurrency limit reached")
         return None
+    with metrics.timer("llm") as st:
+        try:
+            async with sem:
+                r = await asyncio.wait_for(
+                    LLM_RETRY.acall(
+                        client.chat.completions.create,
+                        model=_llm_model(),
+                        messages=[{"role":"system","content":_LLM_SYSTEM},{"role":"user","content":text}],
+                        temperature=0.1,
+                    ),
+                    timeout=INTENT_LLM_TIMEOUT_SEC,
+                )
+            res = _llm_result(r.choices[0].message.content)
+        except asyncio.TimeoutError:
+            st["outcome"] = "timeout"
+            metrics.inc("llm_fallback_timeout")
+            logger.warning(f"LLM fallback timed out after {INTENT_LLM_TIMEOUT_SEC}s")
+            return None
+        except Exception as e:
+            st["outcome"] = "error"
+            metrics.inc("llm_fallback_error")
+            logger.warning(f"LLM fallback failed: {e}")
+            return None
+        st["intent"] = res.intent
+    await asyncio.to_thread(llm_cache.set, key, res.model_dump())
+    return res
+
+# === 一括判定（バックフィル・再分類用） ===
+INTENT_BATCH_MAX_TEXTS = int(os.getenv("INTENT_BATCH_MAX_TEXTS", "10000"))
+INTENT_LLM_BATCH_SIZE = int(os.getenv("INTENT_LLM_BATCH_SIZE", "50"))  # 1回の LLM 呼び出しに詰める件数
+INTENT_LLM_BATCH_TIMEOUT_SEC = float(os.getenv("INTENT_LLM_BATCH_TIMEOUT_SEC", "60"))  # 1回（1かたまり）の締切
+# 一括判定は /execute とは別の再試行・ブレーカ（openai_batch）を使う。50件の呼び出しは数秒〜数十秒かかるので、
+# 同じ openai ブレーカだと遅い呼び出しとして数えられ、対話的な判定まで止めてしまう。
+# 遅さは締切で打ち切り（タイムアウトは失敗として数える）、遅い呼び出しの判定はしない
+LLM_BATCH_RETRY = retry_policy.from_env(
+    "openai_batch", max_attempts=2, budget=INTENT_LLM_BATCH_TIMEOUT_SEC,
+    breaker=circuit_breaker.get("openai_batch", slow_call_sec=0))
+
+def classify_intent_rule_batch(texts: list) -> list:
+    """ルール判定をまとめて行う。同じ文面は1回だけ判定する。"""
+    seen: Dict[str, IntentResult] = {}
+    out = []
+    for t in texts:
+        r = seen.get(t)
+        if r is None:
+            r = seen[t] = classify_intent_rule(t)
+        out.append(r)
+    return out
+
+def _llm_classify_chunk(client, texts: list) -> list:
+    sys = ("日本語指示の配列を、それぞれ calendar/memo/unknown に分類し、payloadをJSONで簡潔に返して。"
+           "時間あいまいは+09:00で30分。"
+           '出力は {"results":[{"i":番号,"intent":...,"suggested_payload":...}, ...]} の形で、入力の i をそのまま返すこと。')
+    r = LLM_BATCH_RETRY.call(
+        client.chat.completions.create,
+        model=_llm_model(),
+        messages=[{"role":"system","content":sys},
+                  {"role":"user","content":json.dumps([{"i":i,"text":t} for i, t in enumerate(texts)], ensure_ascii=False)}],
+        temperature=0.1,
+        response_format={"type": "json_object"},
+    )
+    data = json.loads(r.choices[0].message.content)
+    out: list = [None] * len(texts)
+    for item in data.get("results", []):
+        i = item.get("i")
+        if isinstance(i, int) and 0 <= i < len(texts):
+            out[i] = IntentResult(intent=item.get("intent","unknown"),
+                                  suggested_payload=item.get("suggested_payload"))
+    return out
+
+def classify_intents_llm_batch(texts: list) -> list:
+    """
+    unknown になった文面を INTENT_LLM_BATCH_SIZE 件ずつ1回の LLM 呼び出しでまとめて判定する。
+    返り値は入力と同じ順番（判定できなかったものは None）。
+    """
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key or not texts:
+        return [None] * len(texts)
+    model = _llm_model()
+    keys = [cache_key(t, model) for t in texts]
+    out: list = []
+    misses: list = []  # キャッシュに無かったものの位置
+    for i, k in enumerate(keys):
+        hit = llm_cache.get(k)
+        out.append(IntentResult(**hit) if hit is not None else None)
+        if hit is None:
+            misses.append(i)
+    if not misses:
+        return out
+    from openai import OpenAI
+    # 再試行は LLM_BATCH_RETRY に任せる。締切は1回の呼び出しごと
+    client = OpenAI(api_key=api_key, max_retries=0, timeout=INTENT_LLM_BATCH_TIMEOUT_SEC)
+    for start in range(0, len(misses), INTENT_LLM_BATCH_SIZE):
+        idx = misses[start:start + INTENT_LLM_BATCH_SIZE]
+        try:
+            got = _llm_classify_chunk(client, [texts[i] for i in idx])
+        except Exception as e:
+            logger.warning(f"LLM batch fallback failed ({len(idx)} texts): {e}")
+            continue
+        for i, r in zip(idx, got):
+            if r is not None:
+                out[i] = r
+                llm_cache.set(keys[i], r.model_dump())
+    return out
+
+def route_intents_batch(texts: list) -> list:
+    """ルール判定 → unknown だけ（重複を除いて）ローカルモデル → LLM にまとめて投げる。入力順の IntentResult を返す。"""
+    results = classify_intent_rule_batch(texts)
+    unknown = list(dict.fromkeys(t for t, r in zip(texts, results) if r.intent == "unknown" and t.strip()))
+    if not unknown:
+        return results
+    # ローカルモデルで確信できたものは LLM に回さない
+    resolved = {t: r for t, r in zip(unknown, classify_intent_model_batch(unknown)) if r}
+    rest = [t for t in unknown if t not in resolved]
+    if rest:
+        resolved.update((t, r) for t, r in zip(rest, classify_intents_llm_batch(rest)) if r)
+    return [resolved.get(t, r) if r.intent == "unknown" else r for t, r in zip(texts, results)]
+
+def _parse_batch_texts(body: bytes, content_type: str) -> list:
+    """JSON 配列（文字列 or {"text":...}）/ {"texts":[...]} / NDJSON を受ける。"""
+    def text_of(item):
+        if isinstance(item, str):
+            return item
+        if isinstance(item, dict) and "text" in item:
+            return str(item["text"])
+        raise ValueError("各要素は文字列か {\"text\": ...} で指定してください")
+
+    if "ndjson" in content_type or "jsonl" in content_type:
+        items = [json.loads(line) for line in body.decode("utf-8").splitlines() if line.strip()]
+    else:
+        items = json.loads(body or b"null")
+        if isinstance(items, dict):
+            items = items.get("texts")
+        if not isinstance(items, list):
+            raise ValueError("テキストの配列を指定してください")
+    return [text_of(x) for x in items]
+
+# === 上流の再試行ポリシー（429/5xx/通信エラーだけ、指数バックオフ + jitter、合計時間の上限つき）===
+# 予定の登録はクライアント側の id で冪等なので 5xx・タイムアウトも送り直せる。
+# Sheets の append は冪等でないので、届いていないと分かる失敗（429・接続失敗）だけ送り直す
+CALENDAR_RETRY = retry_policy.from_env("calendar")
+SHEETS_RETRY = retry_policy.from_env("sheets")
+SHEETS_APPEND_RETRY = retry_policy.from_env("sheets", classify=retry_policy.reason_if_unsent)
+
+# === クライアント側レート制限（API × 認証情報ごと、全ワーカーで SQLite のバケットを共有）===
+google_rate_limiter = rate_limiter.from_env()
+
+def _google_credential() -> str:
+    # 同じトークン（ファイル or テナント）を使うワーカーは同じ予算を分け合う
+    t = tenant_store.current()
+    return rate_limiter.credential_key(f"tenant:{t}" if t else str(_token_path().resolve()))
+
+def _interactive() -> bool:
+    return priority_scheduler.current() == priority_scheduler.INTERACTIVE
+
+def google_quota(api: str, n: int = 1, max_wait: Optional[float] = None) -> None:
+    """
+    呼び出し1回ぶん（batch なら中身の件数ぶん）のトークンを取る。取れるまで待つか RateLimitedError。
+    interactive 以外は前借りせず、interactive 用の取り置きを残して取る。
+    """
+    if google_rate_limiter is not None:
+        google_rate_limiter.acquire(api, _google_credential(), n, max_wait, interactive=_interactive())
+
+async def google_quota_async(api: str) -> None:
+    if google_rate_limiter is not None:
+        await google_rate_limiter.aacquire(api, _google_credential(), interactive=_interactive())
+
+# 再試行の guard（試行ごとに、サーキットブレーカの外で待つ。ブレーカが測るのは HTTP 呼び出しだけ）
+# トークンを待ってから優先度つきの同時実行枠を取る（トークン待ちの間は枠を塞がない）
+# 段階名は上流ごと：待ちは upstream_wait_<api>、呼び出しは upstream_<api>（calendar と sheets を分けて見る）
+@contextmanager
+def upstream_guard(api: str, n: int = 1, max_wait: Optional[float] = None):
+    with ExitStack() as stack:
+        with metrics.timer(f"upstream_wait_{api}"):
+            google_quota(api, n, max_wait)
+            stack.enter_context(priority_scheduler.slot())
+        yield
+
+@asynccontextmanager
+async def upstream_guard_async(api: str):
+    async with AsyncExitStack() as stack:
+        with metrics.timer(f"upstream_wait_{api}"):
+            await google_quota_async(api)
+            await stack.enter_async_context(priority_scheduler.aslot())
+        yield
 
 # === Google Calendar（Calendar 登録（OAuthのみ） ===
 def create_calendar_event(payload: dict) -> dict:
     if DRY_RUN:
         return {"id":"dry_evt_123","link":"https://example.invalid","payload":payload,"dry_run":True}
 
-    from googleapiclient.discovery import build
     creds = get_google_creds()  # ← 共通化！
-    service = build("calendar", "v3", credentials=creds)
+    service = calendar_service(creds)  # build() は初回だけ
+
+    calendar_id = google_settings()["calendar_id"]
+    event = _event_body(payload)
+    event.setdefault("id", new_event_id())  # 再試行しても同じ id（二重登録にならない）
+
+    def insert():
+        with metrics.timer("upstream_calendar"):
+            return insert_event(service, calendar_id, event)
+    created = CALENDAR_RETRY.call_guarded(lambda: upstream_guard("calendar"), insert)
+    return {"id": created.get("id"), "link": created.get("htmlLink")}
 
-    calendar_id = os.getenv("GOOGLE_CALENDAR_ID", "primary")
-    event = {
+def _event_body(payload: dict) -> dict:
+    # start/end は "2025-08-16T10:00:00+09:00" か、終日の {"date": "..."} をそのまま受ける
+    def when(v):
+        return v if isinstance(v, dict) else {"dateTime": v}
+    body = {
         "summary": payload["summary"],
         "description": payload.get("description",""),
-        "start": {"dateTime": payload["start"]},
-        "end":   {"dateTime": payload["end"]},
+        "start": when(payload["start"]),
+        "end":   when(payload["end"]),
     }
-    created = service.events().insert(calendarId=calendar_id, body=event).execute()
-    return {"id": created.get("id"), "link": created.get("htmlLink")}
+    if payload.get("id"):
+        body["id"] = payload["id"]  # アウトボックスが積んだ時に決めた id（配送し直しても同じ予定）
+    return body
+
+# === Google Calendar 一括登録（batch HTTP リクエスト） ===
+CALENDAR_BATCH_SIZE = int(os.getenv("CALENDAR_BATCH_SIZE", "50"))  # 1バッチに詰める insert 数
+CALENDAR_BATCH_MAX_EVENTS = int(os.getenv("CALENDAR_BATCH_MAX_EVENTS", "1000"))
+
+def create_calendar_events_batch(payloads: list, batch_size: int = CALENDAR_BATCH_SIZE) -> list:
+    """
+    複数の予定を batch リクエストでまとめて登録する。
+    返り値は入力と同じ順番で、1件ずつ {"ok": True, "id", "link"} か {"ok": False, "error"}。
+    """
+    results: list = [None] * len(payloads)
+    bodies = []
+    for i, p in enumerate(payloads):
+        try:
+            body = _event_body(p)
+            body.setdefault("id", new_event_id())  # chunk を送り直しても、通っていた分は 409 になるだけ
+            bodies.append((i, body))
+        except (KeyError, TypeError) as e:
+            results[i] = {"ok": False, "error": f"必須項目がありません: {e}"}
+
+    if DRY_RUN:
+        for i, body in bodies:
+            results[i] = {"ok": True, "id": f"dry_evt_{i}", "link": "https://example.invalid", "dry_run": True}
+        return results
+
+    creds = get_google_creds()
+    service = calendar_service(creds)
+    calendar_id = google_settings()["calendar_id"]
+
+    retryable: Dict[int, Exception] = {}  # 429/5xx で落ちた分（次の試行で送り直す）
+    ids = {i: body["id"] for i, body in bodies}
+
+    def on_response(request_id, response, exception):
+        i = int(request_id)
+        if exception is not None and retry_policy.status_of(exception) == 409:
+            # 同じ id の予定がもうある＝前回の送信（応答を受け取れなかったもの）で登録済み
+            metrics.inc("calendar_insert_duplicate")
+            results[i] = {"ok": True, "id": ids[i], "link": None}
+            return
+        if exception is not None:
+            if retry_policy.reason_of(exception) is not None:
+                retryable[i] = exception
+                return
+            results[i] = {"ok": False, "error": str(exception), "status": retry_policy.status_of(exception)}
+        else:
+            results[i] = {"ok": True, "id": response.get("id"), "link": response.get("htmlLink")}
+
+    def pending(chunk):
+        return [(i, body) for i, body in chunk if results[i] is None]
+
+    def guard(chunk):
+        # batch の中身は1件ずつクォータに数えられる。一括登録は急がないので補充されるまで待つ
+        # （interactive 以外なら前借りせず少しずつ取るので、その間の対話的な呼び出しは待たされない）
+        return upstream_guard("calendar", len(pending(chunk)), max_wait=float("inf"))
+
+    def send(chunk):
+        # 結果が未確定のものだけ送る。再試行すべき失敗が残ればその例外で CALENDAR_RETRY に判断させる
+        retryable.clear()
+        batch = service.new_batch_http_request(callback=on_response)
+        for i, body in pending(chunk):
+            batch.add(service.events().insert(calendarId=calendar_id, body=body), request_id=str(i))
+        with metrics.timer("upstream_calendar"):
+            batch.execute()
+        if retryable:
+            raise next(iter(retryable.values()))
+
+    for start in range(0, len(bodies), batch_size):
+        chunk = bodies[start:start + batch_size]
+        try:
+            CALENDAR_RETRY.call_guarded(lambda: guard(chunk), send, chunk)
+        except Exception as e:
+            # 諦めた場合は、結果が未確定の分だけエラーにする
+            logger.warning(f"Calendar batch failed ({len(chunk)} events): {e}")
+            for i, _ in chunk:
+                if results[i] is None:
+                    err = retryable.get(i, e)
+                    results[i] = {"ok": False, "error": str(err), "status": retry_policy.status_of(err)}
+    return results
 
 
 
@@ -272,77 +771,380 @@ def create_calendar_event(payload: dict) -> dict:
 def append_sheets(values) -> dict:
     if DRY_RUN:
         return {"ok": True, "updated": len(values), "dry_run": True}
+    if SHEETS_BATCH_ENABLED and not tenant_store.current():
+        # 同時に来た行とまとめて1回の append にする（自分の行の結果だけ返る。書き込み先が1つの時だけ）
+        return submit_sheets_append(values).result()
+    return _append_sheets_now(values)
 
-    from googleapiclient.discovery import build
+def _append_sheets_now(values) -> dict:
     creds = get_google_creds()  # ← 共通化！
-    spreadsheet_id = os.getenv("SHEETS_ID")
-    rng = os.getenv("GOOGLE_SHEETS_RANGE", "Sheet1!A:C")
+    conf = google_settings()
+    spreadsheet_id, rng = conf["sheets_id"], conf["sheets_range"]
+    if not spreadsheet_id:
+        raise RuntimeError("SHEETS_ID が未設定です")
+
+    service = sheets_service(creds)  # build() は初回だけ
+
+    def append():
+        with metrics.timer("upstream_sheets"):
+            return service.spreadsheets().values().append(
+                spreadsheetId=spreadsheet_id,
+                range=rng,
+                valueInputOption="RAW",
+                body={"values": values}
+            ).execute()
+    res = SHEETS_APPEND_RETRY.call_guarded(lambda: upstream_guard("sheets"), append)
+    updates = res.get("updates", {})
+    return {"ok": True, "updated": updates.get("updatedCells", 0), "range": updates.get("updatedRange")}
+
+# --- Sheets 追記の write-behind バッファ（opt-in）---
+SHEETS_BATCH_ENABLED = os.getenv("SHEETS_BATCH_ENABLED", "false").lower() == "true"
+_sheets_buffer: Optional[SheetsAppendBuffer] = None
+_sheets_buffer_lock = threading.Lock()
+
+def submit_sheets_append(values) -> Future:
+    """行をバッファに積み、自分の行の追記結果を返す Future を受け取る。"""
+    global _sheets_buffer
+    if DRY_RUN:
+        fut: Future = Future()
+        fut.set_result({"ok": True, "updated": len(values), "dry_run": True})
+        return fut
+    with _sheets_buffer_lock:
+        if _sheets_buffer is None:
+            _sheets_buffer = SheetsAppendBuffer(
+                _append_sheets_now,
+                max_rows=int(os.getenv("SHEETS_BATCH_MAX_ROWS", "50")),
+                max_delay=int(os.getenv("SHEETS_BATCH_MAX_DELAY_MS", "200")) / 1000,
+            )
+            atexit.register(_sheets_buffer.close)
+        return _sheets_buffer.submit(values)
+
+def close_sheets_buffer() -> None:
+    """溜まっている行をフラッシュして停止（シャットダウン時）。"""
+    global _sheets_buffer
+    with _sheets_buffer_lock:
+        buf, _sheets_buffer = _sheets_buffer, None
+    if buf is not None:
+        buf.close()
+
+# === asyncio ネイティブ版（FastAPI の async エンドポイント用） ===
+# .execute() でスレッドプールを塞がないよう、共有 httpx.AsyncClient で直接叩く
+google_async = GoogleAsyncClient(get_google_creds, creds_peek=peek_google_creds)
+
+async def create_calendar_event_async(payload: dict) -> dict:
+    if DRY_RUN:
+        return {"id":"dry_evt_123","link":"https://example.invalid","payload":payload,"dry_run":True}
+    calendar_id = google_settings()["calendar_id"]
+    body = _event_body(payload)
+    body.setdefault("id", new_event_id())  # 再試行しても同じ id（二重登録にならない）
+
+    async def insert():
+        with metrics.timer("upstream_calendar"):
+            return await google_async.insert_event(calendar_id, body)
+    created = await CALENDAR_RETRY.acall_guarded(lambda: upstream_guard_async("calendar"), insert)
+    return {"id": created.get("id"), "link": created.get("htmlLink")}
+
+async def append_sheets_async(values) -> dict:
+    if DRY_RUN:
+        return {"ok": True, "updated": len(values), "dry_run": True}
+    if SHEETS_BATCH_ENABLED and not tenant_store.current():
+        with metrics.timer("upstream_sheets"):
+            return await asyncio.wrap_future(submit_sheets_append(values))
+    conf = google_settings()
+    spreadsheet_id, rng = conf["sheets_id"], conf["sheets_range"]
     if not spreadsheet_id:
         raise RuntimeError("SHEETS_ID が未設定です")
 
-    service = build("sheets", "v4", credentials=creds)
-    res = service.spreadsheets().values().append(
-        spreadsheetId=spreadsheet_id,
-        range=rng,
-        valueInputOption="RAW",
-        body={"values": values}
-    ).execute()
-    return {"ok": True, "updated": res.get("updates", {}).get("updatedCells", 0)}
+    async def append():
+        with metrics.timer("upstream_sheets"):
+            return await google_async.append_values(spreadsheet_id, rng, values)
+    res = await SHEETS_APPEND_RETRY.acall_guarded(lambda: upstream_guard_async("sheets"), append)
+    updates = res.get("updates", {})
+    return {"ok": True, "updated": updates.get("updatedCells", 0), "range": updates.get("updatedRange")}
+
+# === 永続アウトボックス（opt-in）===
+# 有効にすると /execute は判定結果を SQLite に確定させて 202 + job id を返し、配送はワーカーが行う
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "false").lower() == "true"
+outbox_store = Outbox(os.getenv("OUTBOX_PATH", str(BASE_DIR / "outbox.sqlite3")),
+                      lease_sec=float(os.getenv("OUTBOX_LEASE_SEC", "60")))
+
+async def _deliver_calendar(payload: dict) -> dict:
+    created = await create_calendar_event_async(payload)
+    await lw_notify(_execute_notice("calendar", payload))
+    return created
+
+async def _deliver_memo(payload: dict) -> dict:
+    updated = await append_sheets_async(payload["values"])
+    await lw_notify(_execute_notice("memo", payload))
+    return updated
+
+# 予定は積んだ時に決めた id で冪等なので何度でも送り直せる。Sheets の append は届いていない失敗だけ
+outbox_worker = OutboxWorker(outbox_store, {"calendar": _deliver_calendar, "memo": _deliver_memo},
+                             concurrency=int(os.getenv("OUTBOX_WORKERS", "4")),
+                             max_attempts=int(os.getenv("OUTBOX_MAX_ATTEMPTS", "20")),
+                             retryable={"memo": is_retryable_unsent})
 
 # === FastAPI ===
-app = FastAPI(title="Intent Router MVP")
+notifier = notify_queue.from_env()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await lw_client.startup()
+    await notifier.start()
+    if OUTBOX_ENABLED:
+        # 前回の起動で残ったジョブもここから配送される
+        await asyncio.to_thread(outbox_store.purge, float(os.getenv("OUTBOX_RETENTION_SEC", str(7 * 86400))))
+        await outbox_worker.start()
+    yield
+    await outbox_worker.stop()
+    await notifier.stop()
+    # シャットダウン時：未送信の Sheets 行を流してから終了
+    await asyncio.to_thread(close_sheets_buffer)
+    await google_async.aclose()
+    await close_async_llm_client()
+    await lw_client.shutdown()
+
+app = FastAPI(title="Intent Router MVP", lifespan=lifespan)
+
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    # 各段階（rule / llm / creds / upstream / notify ...）の所要時間を Server-Timing で返す
+    token = metrics.begin_request()
+    try:
+        response = await call_next(request)
+    finally:
+        timings = metrics.end_request(token)
+    if timings:
+        response.headers["Server-Timing"] = metrics.server_timing(timings)
+    return response
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+metrics.describe("execute_requests", "/execute requests by resolved intent and outcome.")
+metrics.describe("execute_seconds", "/execute end-to-end latency (seconds).")
+metrics.describe("singleflight_coalesced", "Requests that joined an identical in-flight classification instead of running it.")
 
 @app.get("/health")
 def health():
     # Pydanticモデルは返してないのでシリアライズ問題なし
-    return {"status":"ok","dry_run":DRY_RUN}
+    circuits = circuit_breaker.states()
+    status = "degraded" if any(c["state"] != circuit_breaker.CLOSED for c in circuits.values()) else "ok"
+    out = {"status":status,"dry_run":DRY_RUN,"llm_cache":llm_cache.stats(),"circuits":circuits,
+           "metrics":metrics.snapshot()}
+    if OUTBOX_ENABLED:
+        out["outbox"] = outbox_store.stats()
+    if priority_scheduler.scheduler is not None:
+        out["scheduler"] = priority_scheduler.stats()
+    out["tenants_cached"] = len(_TENANT_CREDS)
+    return out
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """アウトボックスに積んだ /execute の配送状況（pending / running / done / failed）。"""
+    job = outbox_store.get(job_id) if OUTBOX_ENABLED else None
+    if job is None:
+        return JSONResponse({"ok": False, "hint": "ジョブが見つかりません。"}, status_code=404)
+    return job
 
 @app.post("/intent/route")
-def route(payload: dict = Body(..., examples={"ex1":{"value":{"text":"明日12時に商談30分"}}})):
+async def route(payload: dict = Body(..., examples={"ex1":{"value":{"text":"明日12時に商談30分"}}})):
     text = str(payload.get("text",""))
-    res = classify_intent_rule(text)
+    res = await classify_intent(text)
+    out = {"ok":True,"text":text, **res.model_dump()}  # ここで .model_dump() にして返す（JSONシリアライズ対策）
     if res.intent == "unknown":
-        llm = classify_intent_llm(text)
-        if llm: res = llm
-    # ここで .model_dump() にして返す（JSONシリアライズ対策）
-    return JSONResponse({"ok":True,"text":text, **res.model_dump()})
+        hint = model_hints([text])[0]
+        if hint: out["hint"] = hint
+    return JSONResponse(out)
+
+@app.post("/intent/route:batch")
+async def route_batch(request: Request):
+    """
+    大量のテキストをまとめて判定（音声書き起こしのバックフィル・過去メモの再分類用）。
+    Content-Type: application/json（配列）か application/x-ndjson（1行1件）。
+    Accept: application/x-ndjson なら結果も1行1件で返す。
+    """
+    try:
+        texts = _parse_batch_texts(await request.body(), request.headers.get("content-type", ""))
+    except ValueError as e:  # json.JSONDecodeError も含む
+        return JSONResponse({"ok": False, "hint": f"入力を解釈できません: {e}"}, status_code=400)
+    if len(texts) > INTENT_BATCH_MAX_TEXTS:
+        return JSONResponse({"ok": False, "hint": f"一度に判定できるのは {INTENT_BATCH_MAX_TEXTS} 件までです。"},
+                            status_code=413)
+
+    # CPU 処理と LLM 呼び出しはイベントループを塞がないようスレッドで
+    results = await asyncio.to_thread(route_intents_batch, texts)
+    rows = [{"text": t, **r.model_dump()} for t, r in zip(texts, results)]
+    unknown = [i for i, r in enumerate(results) if r.intent == "unknown"]
+    hints = await asyncio.to_thread(model_hints, [texts[i] for i in unknown])
+    for i, hint in zip(unknown, hints):
+        if hint: rows[i]["hint"] = hint
+    if "ndjson" in request.headers.get("accept", ""):
+        body = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+        return Response(body, media_type="application/x-ndjson")
+    return JSONResponse({"ok": True, "count": len(rows), "results": rows})
+
+@app.post("/calendar/events:batch")
+def calendar_events_batch(payload: Any = Body(..., examples={"ex1":{"value":{"events":[
+        {"summary":"早番","start":"2025-09-01T09:00:00+09:00","end":"2025-09-01T17:00:00+09:00"}]}}}),
+                          tenant_id: Optional[str] = Header(None, alias="X-Tenant-Id"),
+                          tenant_key: Optional[str] = Header(None, alias="X-Tenant-Key")):
+    denied = tenant_denied(tenant_id, tenant_key)
+    if denied is not None:
+        return denied
+    events = payload.get("events") if isinstance(payload, dict) else payload
+    if not isinstance(events, list) or not events:
+        return JSONResponse({"ok": False, "hint": "events に予定の配列を指定してください。"}, status_code=400)
+    if len(events) > CALENDAR_BATCH_MAX_EVENTS:
+        return JSONResponse({"ok": False, "hint": f"一度に登録できるのは {CALENDAR_BATCH_MAX_EVENTS} 件までです。"},
+                            status_code=413)
+    try:
+        # 一括登録は bulk クラス：同時に来る音声・/execute の上流呼び出しを待たせない
+        with priority_scheduler.priority(priority_scheduler.BULK), tenant_store.tenant(tenant_id):
+            results = create_calendar_events_batch(events)
+    except Exception as e:
+        logger.exception("calendar batch failed")
+        return JSONResponse(
+            {"ok": False, "hint": "外部API呼び出しでエラー。ログを確認してください。", "detail": str(e)},
+            status_code=500
+        )
+    failed = sum(1 for r in results if not r["ok"])
+    return JSONResponse({"ok": failed == 0, "count": len(results), "failed": failed, "results": results})
 
 @app.get("/")
 def root():
     return RedirectResponse("/docs")
 
+# 冪等キー：Alexa / Lambda の再送で予定や行が二重にできないようにする
+IDEMPOTENCY_TTL_SEC = float(os.getenv("IDEMPOTENCY_TTL_SEC", "600"))
+IDEMPOTENCY_TEXT_WINDOW_SEC = float(os.getenv("IDEMPOTENCY_TEXT_WINDOW_SEC", "60"))  # 0 でヘッダ無しは冪等化しない
+# CACHE_BACKEND=sqlite なら、別のワーカーに来た再送も重複として扱える
+idempotency = IdempotencyStore(backend=cache_backend.from_env(
+    "idempotency", maxsize=int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000")), ttl=IDEMPOTENCY_TTL_SEC))
+
+def begin_idempotent(scope: str, header: Optional[str], text: str,
+                     tenant: Optional[str] = None) -> Tuple[Optional[str], Optional[Future], bool]:
+    """
+    (キー, Future, owner)。冪等化しない場合は (None, None, True)。scope はエンドポイント名（応答の形が違うので分ける）。
+    tenant があればキーに含める（別の利用者の同じ文面・同じヘッダ値を取り違えない）。
+    """
+    key = idempotency_key_for(header, text, IDEMPOTENCY_TEXT_WINDOW_SEC)
+    if key is None:
+        return None, None, True
+    ttl = IDEMPOTENCY_TTL_SEC if key.startswith("h:") else IDEMPOTENCY_TEXT_WINDOW_SEC
+    key = f"{scope}:{tenant}:{key}" if tenant else f"{scope}:{key}"
+    fut, owner = idempotency.begin(key, ttl)
+    if not owner:
+        metrics.inc("idempotency_replayed", scope=scope)
+    return key, fut, owner
+
 @app.post("/execute")
-def execute(payload: dict = Body(..., examples={"ex1":{"value":{"text":"明日10時に商談30分"}}})):
+async def execute(payload: dict = Body(..., examples={"ex1":{"value":{"text":"明日10時に商談30分"}}}),
+                  idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+                  tenant_id: Optional[str] = Header(None, alias="X-Tenant-Id"),
+                  tenant_key: Optional[str] = Header(None, alias="X-Tenant-Key")):
+    # 冪等キーの記録より先に（他のテナントの保存済みの結果を返さない）
+    denied = await asyncio.to_thread(tenant_denied, tenant_id, tenant_key)
+    if denied is not None:
+        return denied
+    text = str(payload.get("text",""))
+    # 冪等キーの記録は保存先の I/O（CACHE_BACKEND=sqlite ならファイルロック）なのでループの外で
+    key, fut, owner = await asyncio.to_thread(begin_idempotent, "execute", idempotency_key, text, tenant_id)
+    if not owner:
+        # 同じ依頼が実行中なら終わるのを待ち、完了済みなら保存済みの結果を返す
+        body, status = await asyncio.wrap_future(fut)
+        return JSONResponse(body, status_code=status, headers={"Idempotent-Replayed": "true"})
     try:
-        text = str(payload.get("text",""))
-        result = classify_intent_rule(text)
-        if result.intent == "unknown":
-            llm = classify_intent_llm(text)
-            if llm: result = llm
+        with priority_scheduler.priority(priority_scheduler.INTERACTIVE), tenant_store.tenant(tenant_id):
+            body, status = await _execute_text(text)
+    except BaseException as e:
+        # 切断でキャンセルされていても記録は最後まで書く（shield）
+        if key: await asyncio.shield(asyncio.to_thread(idempotency.fail, key, fut, exc=e))
+        raise
+    if key:
+        # 5xx と、LLM に聞けなかっただけの unknown は保存しない（再送で判定し直す）
+        if status >= 500 or body.get("degraded"):
+            await asyncio.to_thread(idempotency.fail, key, fut, result=(body, status))
+        else:
+            await asyncio.to_thread(idempotency.finish, key, fut, (body, status))
+    return JSONResponse(body, status_code=status, headers=_retry_after_header(body, status))
+
+def _retry_after_header(body: dict, status: int) -> Optional[Dict[str, str]]:
+    if status == 503 and body.get("retry_after") is not None:
+        return {"Retry-After": str(max(1, int(body["retry_after"] + 0.999)))}
+    return None
 
+async def _execute_text(text: str) -> Tuple[dict, int]:
+    started = time.perf_counter()
+    intent, outcome = "unknown", "error"
+    try:
+        result = await classify_intent(text)
+        intent = result.intent
+
+        if OUTBOX_ENABLED and result.intent in ("calendar", "memo"):
+            # まずローカルに確定させて即返す（上流の遅延・障害はワーカー側で吸収）
+            payload = result.suggested_payload
+            if intent == "calendar":
+                # 予定の id はここで決めて保存する（何度配送し直しても同じ予定＝409 で登録済みと分かる）
+                payload = {**payload, "id": new_event_id()}
+            job_id = await asyncio.to_thread(outbox_store.enqueue, result.intent, payload, tenant_store.current())
+            outbox_worker.notify()
+            outcome = "accepted"
+            return {"ok": True, "accepted": True, "tool": "calendar" if intent == "calendar" else "sheets",
+                    "job_id": job_id, "status_url": f"/jobs/{job_id}"}, 202
         if result.intent == "calendar":
-            created = create_calendar_event(result.suggested_payload)
-            return JSONResponse({"ok": True, "tool": "calendar", "result": created})
+            created = await create_calendar_event_async(result.suggested_payload)
+            with metrics.timer("notify", intent=intent):
+                await lw_notify(_execute_notice("calendar", result.suggested_payload))
+            outcome = "ok"
+            return {"ok": True, "tool": "calendar", "result": created}, 200
         elif result.intent == "memo":
-            updated = append_sheets(result.suggested_payload["values"])
-            return JSONResponse({"ok": True, "tool": "sheets", "result": updated})
+            updated = await append_sheets_async(result.suggested_payload["values"])
+            with metrics.timer("notify", intent=intent):
+                await lw_notify(_execute_notice("memo", result.suggested_payload))
+            outcome = "ok"
+            return {"ok": True, "tool": "sheets", "result": updated}, 200
+        elif result._degraded:
+            outcome = "unknown_degraded"
+            return {"ok": False, "hint": "意図が不明です。", "degraded": True}, 400
         else:
-            return JSONResponse({"ok": False, "hint": "意図が不明です。"}, status_code=400)
+            outcome = "unknown_intent"
+            return {"ok": False, "hint": "意図が不明です。"}, 400
 
+    except (CircuitOpenError, RateLimitedError) as e:
+        # 上流が落ちている / クォータを使い切りそうな間は、待たずにすぐ返す（Retry-After つき）
+        outcome = "circuit_open" if isinstance(e, CircuitOpenError) else "rate_limited"
+        logger.warning(f"execute rejected: {e}")
+        return {"ok": False, "hint": "外部サービスが一時的に利用できません。しばらくしてから再度お試しください。",
+                "detail": str(e), "retry_after": e.retry_after}, 503
     except Exception as e:
         logger.exception("execute failed")
         # 例外メッセージだけ返す（Pydanticオブジェクトは返さない）
-        return JSONResponse(
-            {"ok": False, "hint": "外部API呼び出しでエラー。ログを確認してください。", "detail": str(e)},
-            status_code=500
-        )
+        return {"ok": False, "hint": "外部API呼び出しでエラー。ログを確認してください。", "detail": str(e)}, 500
+    finally:
+        metrics.inc("execute_requests", intent=intent, outcome=outcome)
+        metrics.observe("execute_seconds", time.perf_counter() - started, intent=intent, outcome=outcome)
+
+def _execute_notice(tool: str, payload: dict) -> str:
+    # LLM 由来の payload は形が崩れていることがあるので、通知文の組み立てで落とさない
+    try:
+        if tool == "calendar":
+            return f"📅 予定を登録しました: {payload['summary']}"
+        return f"📝 メモを追記しました: {payload['values'][0][-1]}"
+    except (KeyError, IndexError, TypeError):
+        return f"✅ {tool} を実行しました"
 
 async def lw_notify(text: str) -> None:
+    """通知はキューに積むだけで即座に戻る（まとめ送信・レート制限・再送はバックグラウンド）。"""
     url = os.getenv("LINEWORKS_WEBHOOK_URL")
     if not url: return
+    if notifier.running:
+        notifier.enqueue(text, url)
+        return
+    # lifespan の外（スクリプト等）ではその場で送る
     try:
-        async with httpx.AsyncClient(timeout=3.0) as cli:
-            await cli.post(url, json={"text": text})
+        await notify_queue.post_webhook(url, text)
     except Exception as e:
         logger.warning(f"LINE WORKS notify failed: {e}")
 
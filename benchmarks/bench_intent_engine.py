@@ -0,0 +1,57 @@
+# benchmarks/bench_intent_engine.py
+"""
+classify_intent_rule のマイクロベンチ：旧実装（正規表現を都度 re.search）と
+コンパイル済み単一パス版（intent_engine）を同じ発話セットで比べる。
+
+使い方:
+  python benchmarks/bench_intent_engine.py            # 既定 20000 回
+  python benchmarks/bench_intent_engine.py -n 100000
+"""
+from __future__ import annotations
+import argparse, os, sys, timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import intent_engine
+from app_intent_mvp import classify_intent_rule
+from benchmarks import legacy_intent
+
+UTTERANCES = [
+    "明日10時に税理士さんと電話30分",
+    "今日18時に筋トレ風動作",
+    "来週水曜は終日 有休",
+    "8月20日の14時〜15時にプロジェクト定例",
+    "メモ: 8/17 提出課題ドラフト",
+    "明後日 13:15 打合せ 45分",
+    "明日報告書を提出",
+    "牛乳を買う",
+    "tomorrow 9:30 standup 15分",
+    "金曜 全日 休暇",
+    "日報 今日は見積もりを3件作成",
+    "明日の午後に歯医者",
+]
+
+
+def _bench(fn, n: int) -> float:
+    loops = max(n // len(UTTERANCES), 1)
+    t = timeit.timeit(lambda: [fn(u) for u in UTTERANCES], number=loops)
+    return t / (loops * len(UTTERANCES)) * 1e6  # µs / 件
+
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", type=int, default=20000, help="判定回数の目安")
+    args = ap.parse_args(argv)
+
+    rows = [
+        ("scan（字句のみ・新）", _bench(intent_engine.scan, args.n)),
+        ("classify_intent_rule（旧）", _bench(legacy_intent.classify_intent_rule, args.n)),
+        ("classify_intent_rule（新）", _bench(classify_intent_rule, args.n)),
+    ]
+    for name, us in rows:
+        print(f"{name:<28} {us:8.2f} µs/件")
+    print(f"speedup: x{rows[1][1] / rows[2][1]:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# benchmarks/bench_suite.py
+"""
+意図判定・日時抽出まわりのマイクロベンチ一式。
+
+生成コーパス（benchmarks/corpus.py）を各関数に流し、ops/sec と 1件あたりの p50/p99 を出す。
+結果は JSON に保存でき、保存済みベースラインと比べて throughput が閾値以上落ちたら終了コード 1。
+
+使い方:
+  python -m benchmarks.bench_suite                              # 計測して表を出す
+  python -m benchmarks.bench_suite --save benchmarks/baseline.json
+  python -m benchmarks.bench_suite --compare benchmarks/baseline.json --threshold 0.10
+  python -m benchmarks.bench_suite --only classify_intent_rule -n 20000
+"""
+from __future__ import annotations
+import argparse, json, math, os, platform, sys, time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Sequence
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("DRY_RUN", "true")
+
+from benchmarks import corpus
+
+
+def _app_classify_intent():
+    import app
+
+    def run(text: str):
+        try:
+            return app.classify_intent(text)
+        except (UnboundLocalError, ValueError):
+            # 「時」も「メモ」も無い文面は calendar 分岐の変数が未定義のまま落ちる（既知の挙動）。
+            # 25時 などは datetime.replace で ValueError。どちらも判定コストとしては計測に含める
+            return None
+    return run
+
+
+def targets() -> Dict[str, tuple]:
+    """名前 → (関数, コーパス種別)。import は必要になった時だけ。"""
+    import app_intent_mvp as mvp
+    import app
+    import intent_router
+
+    def safe(fn):
+        def run(text):
+            try:
+                return fn(text)
+            except ValueError:   # 25時 など（ルール判定側の既知の挙動）
+                return None
+        return run
+
+    return {
+        "classify_intent_rule": (safe(mvp.classify_intent_rule), "intent"),
+        "app.classify_intent": (_app_classify_intent(), "intent"),
+        "intent_router.route_intent": (intent_router.route_intent, "router"),
+        "mvp._extract_time": (mvp._extract_time, "intent"),
+        "mvp._extract_duration": (mvp._extract_duration, "intent"),
+        "mvp._parse_relative_date": (mvp._parse_relative_date, "intent"),
+        "app._extract_time": (app._extract_time, "intent"),
+        "app._extract_duration": (app._extract_duration, "intent"),
+        "app._parse_relative_date": (app._parse_relative_date, "intent"),
+    }
+
+
+def percentile(sorted_ns: Sequence[int], q: float) -> float:
+    """昇順に並んだ値の q パーセンタイル（最近傍順位法）。"""
+    if not sorted_ns:
+        return 0.0
+    k = max(0, min(len(sorted_ns) - 1, math.ceil(q / 100 * len(sorted_ns)) - 1))
+    return float(sorted_ns[k])
+
+
+def measure(fn: Callable[[str], object], texts: Sequence[str], rounds: int = 3, warmup: int = 200) -> dict:
+    for t in texts[:warmup]:
+        fn(t)
+    clock = time.perf_counter_ns
+    samples: List[int] = []
+    total = 0
+    for _ in range(rounds):
+        start_round = clock()
+        for t in texts:
+            s = clock()
+            fn(t)
+            samples.append(clock() - s)
+        total += clock() - start_round
+    samples.sort()
+    return {
+        "n": len(samples),
+        "ops_per_sec": round(len(samples) / (total / 1e9), 1),
+        "p50_us": round(percentile(samples, 50) / 1000, 3),
+        "p99_us": round(percentile(samples, 99) / 1000, 3),
+    }
+
+
+def run_suite(n: int = 5000, seed: int = 0, rounds: int = 3, only: Optional[List[str]] = None) -> dict:
+    texts = {"intent": corpus.generate(n, seed), "router": corpus.generate_router(n, seed)}
+    results = {}
+    for name, (fn, kind) in targets().items():
+        if only and name not in only:
+            continue
+        results[name] = measure(fn, texts[kind], rounds=rounds)
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "corpus_size": n, "seed": seed, "rounds": rounds,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> List[str]:
+    """ops/sec が baseline から threshold（0.10 = 10%）を超えて落ちたものを返す。"""
+    regressions = []
+    for name, cur in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base or not base.get("ops_per_sec"):
+            continue
+        change = cur["ops_per_sec"] / base["ops_per_sec"] - 1
+        if change < -threshold:
+            regressions.append(f"{name}: {base['ops_per_sec']:.0f} → {cur['ops_per_sec']:.0f} ops/s ({change:+.1%})")
+    return regressions
+
+
+def _print_table(report: dict, baseline: Optional[dict] = None) -> None:
+    print(f"{'target':<28} {'ops/sec':>12} {'p50 µs':>9} {'p99 µs':>9}" + ("   vs base" if baseline else ""))
+    for name, r in report["results"].items():
+        line = f"{name:<28} {r['ops_per_sec']:>12,.0f} {r['p50_us']:>9.2f} {r['p99_us']:>9.2f}"
+        base = (baseline or {}).get("results", {}).get(name)
+        if base and base.get("ops_per_sec"):
+            line += f"   {r['ops_per_sec'] / base['ops_per_sec'] - 1:+8.1%}"
+        print(line)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="意図判定まわりのマイクロベンチ")
+    ap.add_argument("-n", type=int, default=5000, help="コーパス件数")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--rounds", type=int, default=5, help="コーパスを何周するか")
+    ap.add_argument("--only", action="append", help="計測する対象名（複数指定可）")
+    ap.add_argument("--save", help="結果を JSON で保存するパス")
+    ap.add_argument("--compare", help="比較するベースライン JSON")
+    ap.add_argument("--threshold", type=float, default=0.10, help="許容する ops/sec の低下率（既定 10%%）")
+    args = ap.parse_args(argv)
+
+    report = run_suite(args.n, args.seed, args.rounds, args.only)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    _print_table(report, baseline)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"saved: {args.save}")
+
+    if baseline is not None:
+        regressions = compare(baseline, report, args.threshold)
+        if regressions:
+            print(f"\n性能低下（閾値 {args.threshold:.0%}）:")
+            for r in regressions:
+                print("  " + r)
+            return 1
+        print(f"\nOK: 閾値 {args.threshold:.0%} を超える低下なし")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
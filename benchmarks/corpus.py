@@ -0,0 +1,61 @@
+# benchmarks/corpus.py
+"""
+ベンチ用の発話コーパス生成（Alexa 経由で来る日本語の言い回しを組み合わせで作る）。
+
+seed を固定すれば毎回同じコーパスになるので、ベースラインとの比較に使える。
+"""
+from __future__ import annotations
+import random
+from typing import List
+
+_DAYS = ["", "今日", "明日", "あした", "明後日", "来週水曜", "金曜", "8月20日の", "tomorrow "]
+_WHATS = ["商談", "税理士さんと電話", "歯医者", "プロジェクト定例", "打合せ", "筋トレ", "1on1", "面談",
+          "レビュー会", "standup", "健康診断", "美容院"]
+_MEMO_PREFIX = ["メモ: ", "メモ：", "メモ ", "日報 ", "memo "]
+_MEMO_BODY = ["顧客Aに折返し", "提出課題ドラフト", "見積もりを3件作成", "牛乳と卵を買う", "サーバ証明書の期限を確認",
+              "新サービスの名前を考える", "経費精算を今週中に", "議事録の要点をまとめる"]
+_UNKNOWN = ["牛乳を買う", "こんにちは", "明日の午後に歯医者", "天気はどう", "音楽をかけて", "来週 実家に帰る",
+            "ありがとう", "電気を消して", "ニュースを教えて", "週末に映画"]
+_ROUTER = ["note: ", "event: ", "send: ", "NOTE：", ""]
+
+
+def _time(rnd: random.Random) -> str:
+    h = rnd.randint(7, 21)
+    return rnd.choice([f"{h}時", f"{h}時{rnd.choice([0, 15, 30, 45])}分", f"{h}:{rnd.choice(['00', '15', '30', '45'])}",
+                       f"{h}時半"])
+
+
+def _calendar(rnd: random.Random) -> str:
+    dur = rnd.choice(["", "30分", "45分", " 60分", "90分"])
+    return f"{rnd.choice(_DAYS)}{_time(rnd)}に{rnd.choice(_WHATS)}{dur}"
+
+
+def _allday(rnd: random.Random) -> str:
+    return f"{rnd.choice(['', '来週'])}{rnd.choice('月火水木金')}曜は{rnd.choice(['終日', '全日'])} {rnd.choice(['有休', '休暇'])}"
+
+
+def _memo(rnd: random.Random) -> str:
+    return rnd.choice(_MEMO_PREFIX) + rnd.choice(_MEMO_BODY)
+
+
+def _unknown(rnd: random.Random) -> str:
+    return rnd.choice(_UNKNOWN)
+
+
+# 種類名 → 生成関数（負荷試験の --mix で使う）
+KINDS = {"calendar": _calendar, "memo": _memo, "allday": _allday, "unknown": _unknown}
+
+# 実運用のおおよその比率（カレンダー多め、unknown は少数）
+MIX = ((_calendar, 45), (_memo, 30), (_allday, 5), (_unknown, 20))
+
+
+def generate(n: int = 5000, seed: int = 0) -> List[str]:
+    rnd = random.Random(seed)
+    gens, weights = zip(*MIX)
+    return [g(rnd) for g in rnd.choices(gens, weights=weights, k=n)]
+
+
+def generate_router(n: int = 5000, seed: int = 0) -> List[str]:
+    """intent_router.route_intent 用（note:/event:/send: の接頭辞つき）。"""
+    rnd = random.Random(seed)
+    return [rnd.choice(_ROUTER) + t for t in generate(n, seed)]
@@ -0,0 +1,263 @@
+# benchmarks/fake_upstream.py
+"""
+負荷試験用のローカル上流スタブ（Google Calendar / Sheets / OAuth token / LINE WORKS webhook）。
+
+DRY_RUN=true は I/O の手前で返してしまい、本物の Google に当てると上流の遅延が読めない。
+このサーバを立てて接続先を向けると、実際の I/O 経路（googleapiclient / httpx）を
+オフラインで、遅延・429/5xx・クォータを再現しながら負荷試験できる。
+
+  python -m benchmarks.fake_upstream --port 8099 --latency-ms 80 --sigma 0.5 --rate-429 0.01 \\
+      --write-credentials /tmp/fake_google
+
+  # アプリ側（DRY_RUN=false）
+  GOOGLE_CALENDAR_ROOT_URL=http://127.0.0.1:8099/
+  GOOGLE_SHEETS_ROOT_URL=http://127.0.0.1:8099/
+  GOOGLE_TOKEN_URI=http://127.0.0.1:8099/token
+  GOOGLE_OAUTH_CLIENT_JSON=/tmp/fake_google/google_oauth_client.json
+  GOOGLE_OAUTH_TOKEN_PATH=/tmp/fake_google/google_token.json
+  LINEWORKS_WEBHOOK_URL=http://127.0.0.1:8099/lineworks/webhook
+
+サービスごとの設定は --config で JSON を渡す（未指定の項目は共通設定）:
+  --config '{"sheets": {"latency_ms": 300, "quota_per_min": 60}, "oauth": {"rate_5xx": 0.2}}'
+実行中の変更は POST /_fake/config（同じ形式）、統計は GET /_fake/stats、初期化は POST /_fake/reset。
+"""
+from __future__ import annotations
+import argparse, asyncio, itertools, json, math, os, random, sys, time
+from collections import Counter, defaultdict, deque
+from dataclasses import asdict, dataclass, fields, replace
+from pathlib import Path
+from typing import Deque, Dict, Optional
+from urllib.parse import parse_qs
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+SERVICES = ("calendar", "sheets", "oauth", "lineworks")
+
+
+@dataclass
+class Fault:
+    latency_ms: float = 50.0       # 応答遅延の中央値
+    latency_sigma: float = 0.5     # 対数正規分布の σ（0 なら固定遅延）
+    max_latency_ms: float = 10_000
+    rate_429: float = 0.0          # 429 を返す確率
+    rate_5xx: float = 0.0          # 503 を返す確率
+    quota_per_min: int = 0         # 1分あたりの上限（0 = 無制限、超えたら 429）
+    retry_after_sec: int = 1       # 429 に付ける Retry-After
+
+    def sample_latency(self, rnd: random.Random) -> float:
+        if self.latency_ms <= 0:
+            return 0.0
+        ms = self.latency_ms if self.latency_sigma <= 0 else rnd.lognormvariate(math.log(self.latency_ms), self.latency_sigma)
+        return min(ms, self.max_latency_ms) / 1000
+
+
+class FakeUpstream:
+    """状態（登録済みの予定・シート・受信した webhook）と障害注入の設定を持つ。"""
+
+    def __init__(self, faults: Optional[Dict[str, Fault]] = None, seed: Optional[int] = None):
+        self.faults: Dict[str, Fault] = {s: Fault() for s in SERVICES}
+        self.faults.update(faults or {})
+        self.rnd = random.Random(seed)
+        self.reset()
+
+    def reset(self) -> None:
+        self.events: Dict[str, dict] = {}
+        self.sheets: Dict[str, list] = defaultdict(list)
+        self.webhooks: list = []
+        self.stats: Counter = Counter()
+        self._window: Dict[str, Deque[float]] = defaultdict(deque)
+        self._ids = itertools.count(1)
+
+    def configure(self, overrides: dict) -> None:
+        names = {f.name for f in fields(Fault)}
+        for service, cfg in overrides.items():
+            if service not in self.faults:
+                raise ValueError(f"unknown service: {service}")
+            self.faults[service] = replace(self.faults[service], **{k: v for k, v in cfg.items() if k in names})
+
+    async def gate(self, service: str) -> Optional[JSONResponse]:
+        """遅延を入れ、クォータ超過・障害注入なら返すべきエラー応答を返す（通すなら None）。"""
+        f = self.faults[service]
+        self.stats[f"{service}.requests"] += 1
+        delay = f.sample_latency(self.rnd)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if f.quota_per_min > 0:
+            now = time.monotonic()
+            window = self._window[service]
+            while window and now - window[0] >= 60:
+                window.popleft()
+            if len(window) >= f.quota_per_min:
+                self.stats[f"{service}.quota_exceeded"] += 1
+                return _google_error(429, "Quota exceeded for quota metric 'Requests per minute'",
+                                     "RESOURCE_EXHAUSTED", retry_after=f.retry_after_sec)
+            window.append(now)
+
+        roll = self.rnd.random()
+        if roll < f.rate_429:
+            self.stats[f"{service}.429"] += 1
+            return _google_error(429, "Rate Limit Exceeded", "RESOURCE_EXHAUSTED", retry_after=f.retry_after_sec)
+        if roll < f.rate_429 + f.rate_5xx:
+            self.stats[f"{service}.5xx"] += 1
+            return _google_error(503, "The service is currently unavailable.", "UNAVAILABLE")
+        self.stats[f"{service}.ok"] += 1
+        return None
+
+    def next_id(self, prefix: str) -> str:
+        return f"{prefix}{next(self._ids):08d}"
+
+
+def _google_error(code: int, message: str, status: Optional[str] = None, retry_after: Optional[int] = None,
+                  reason: Optional[str] = None) -> JSONResponse:
+    headers = {"Retry-After": str(retry_after)} if retry_after else None
+    error: dict = {"code": code, "message": message}
+    if status:
+        error["status"] = status
+    if reason:  # Calendar v3 の 409 などは status ではなく errors[].reason で理由を返す
+        error["errors"] = [{"domain": "global", "reason": reason, "message": message}]
+    return JSONResponse({"error": error}, status_code=code, headers=headers)
+
+
+def create_app(upstream: Optional[FakeUpstream] = None) -> FastAPI:
+    up = upstream or FakeUpstream()
+    app = FastAPI(title="Fake upstream (Google / LINE WORKS)")
+    app.state.upstream = up
+
+    # ---- Calendar v3 ----
+    @app.post("/calendar/v3/calendars/{calendar_id}/events")
+    async def events_insert(calendar_id: str, request: Request):
+        if (err := await up.gate("calendar")) is not None:
+            return err
+        body = await request.json()
+        if not isinstance(body, dict) or "start" not in body or "end" not in body:
+            return _google_error(400, "Missing time range.", "INVALID_ARGUMENT")
+        # クライアントが id を付けていればそれを使う（再送の二重登録を 409 で検出する経路を試せるように）
+        eid = body.get("id") or up.next_id("evt")
+        if f"{calendar_id}/{eid}" in up.events:
+            up.stats["calendar.duplicate"] += 1
+            return _google_error(409, "The requested identifier already exists.", reason="duplicate")
+        event = {**body, "id": eid, "status": "confirmed", "kind": "calendar#event",
+                 "htmlLink": f"https://calendar.fake/event?eid={eid}", "organizer": {"email": calendar_id}}
+        up.events[f"{calendar_id}/{eid}"] = event
+        return event
+
+    @app.get("/calendar/v3/calendars/{calendar_id}/events/{event_id}")
+    async def events_get(calendar_id: str, event_id: str):
+        if (err := await up.gate("calendar")) is not None:
+            return err
+        event = up.events.get(f"{calendar_id}/{event_id}")
+        if event is None:
+            return _google_error(404, "Not Found", "NOT_FOUND")
+        return event
+
+    # ---- Sheets v4 ----
+    @app.post("/v4/spreadsheets/{spreadsheet_id}/values/{rng}:append")
+    async def values_append(spreadsheet_id: str, rng: str, request: Request):
+        if (err := await up.gate("sheets")) is not None:
+            return err
+        rows = (await request.json()).get("values") or []
+        sheet = rng.split("!")[0] if "!" in rng else "Sheet1"
+        table = up.sheets[f"{spreadsheet_id}/{sheet}"]
+        first = len(table) + 1
+        table.extend(rows)
+        width = max((len(r) for r in rows), default=0)
+        last_col = chr(ord("A") + max(width, 1) - 1)
+        updated = f"{sheet}!A{first}:{last_col}{first + len(rows) - 1}"
+        return {"spreadsheetId": spreadsheet_id, "tableRange": f"{sheet}!A1:{last_col}{max(first - 1, 1)}",
+                "updates": {"spreadsheetId": spreadsheet_id, "updatedRange": updated, "updatedRows": len(rows),
+                            "updatedColumns": width, "updatedCells": sum(len(r) for r in rows)}}
+
+    @app.get("/v4/spreadsheets/{spreadsheet_id}/values/{rng}")
+    async def values_get(spreadsheet_id: str, rng: str):
+        if (err := await up.gate("sheets")) is not None:
+            return err
+        sheet = rng.split("!")[0] if "!" in rng else "Sheet1"
+        return {"range": rng, "majorDimension": "ROWS", "values": up.sheets.get(f"{spreadsheet_id}/{sheet}", [])}
+
+    # ---- OAuth ----
+    @app.post("/token")
+    async def token(request: Request):
+        if (err := await up.gate("oauth")) is not None:
+            return err
+        # python-multipart に依存しないよう urlencoded を自前で読む
+        form = {k: v[0] for k, v in parse_qs((await request.body()).decode()).items()}
+        if form.get("grant_type") != "refresh_token" or not form.get("refresh_token"):
+            return JSONResponse({"error": "invalid_grant"}, status_code=400)
+        return {"access_token": f"fake-{up.next_id('tok')}", "expires_in": 3600, "token_type": "Bearer"}
+
+    # ---- LINE WORKS ----
+    @app.post("/lineworks/webhook{path:path}")
+    async def webhook(path: str, request: Request):
+        if (err := await up.gate("lineworks")) is not None:
+            return err
+        up.webhooks.append(await request.json())
+        return {"ok": True}
+
+    # ---- 管理用 ----
+    @app.get("/_fake/stats")
+    async def stats():
+        return {"stats": dict(up.stats), "events": len(up.events),
+                "rows": sum(len(v) for v in up.sheets.values()), "webhooks": len(up.webhooks),
+                "faults": {k: asdict(v) for k, v in up.faults.items()}}
+
+    @app.post("/_fake/config")
+    async def configure(overrides: dict):
+        try:
+            up.configure(overrides)
+        except (ValueError, TypeError) as e:
+            return JSONResponse({"ok": False, "detail": str(e)}, status_code=400)
+        return {"ok": True, "faults": {k: asdict(v) for k, v in up.faults.items()}}
+
+    @app.post("/_fake/reset")
+    async def reset():
+        up.reset()
+        return {"ok": True}
+
+    return app
+
+
+def write_credentials(directory: str, base_url: str) -> None:
+    """スタブ向けの client JSON / token JSON を書き出す（アクセストークンは期限切れ → 起動直後に refresh が走る）。"""
+    d = Path(directory)
+    d.mkdir(parents=True, exist_ok=True)
+    (d / "google_oauth_client.json").write_text(json.dumps({"web": {
+        "client_id": "fake-client.apps.googleusercontent.com", "client_secret": "fake-secret",
+        "token_uri": base_url.rstrip("/") + "/token"}}), encoding="utf-8")
+    (d / "google_token.json").write_text(json.dumps({
+        "access_token": "expired", "refresh_token": "fake-refresh", "expires_at": 1,
+        "scope": "https://www.googleapis.com/auth/calendar.events https://www.googleapis.com/auth/spreadsheets"}),
+        encoding="utf-8")
+
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="Google / LINE WORKS の負荷試験用スタブ")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=int(os.getenv("FAKE_UPSTREAM_PORT", "8099")))
+    ap.add_argument("--latency-ms", type=float, default=50.0, help="遅延の中央値（全サービス共通）")
+    ap.add_argument("--sigma", type=float, default=0.5, help="遅延の対数正規 σ（0 で固定）")
+    ap.add_argument("--rate-429", type=float, default=0.0)
+    ap.add_argument("--rate-5xx", type=float, default=0.0)
+    ap.add_argument("--quota-per-min", type=int, default=0)
+    ap.add_argument("--config", help="サービス別の上書き（JSON 文字列か JSON ファイル）")
+    ap.add_argument("--seed", type=int)
+    ap.add_argument("--write-credentials", metavar="DIR", help="スタブ向けの OAuth client/token JSON を書き出す")
+    args = ap.parse_args(argv)
+
+    base = Fault(latency_ms=args.latency_ms, latency_sigma=args.sigma, rate_429=args.rate_429,
+                 rate_5xx=args.rate_5xx, quota_per_min=args.quota_per_min)
+    up = FakeUpstream({s: replace(base) for s in SERVICES}, seed=args.seed)
+    if args.config:
+        raw = Path(args.config).read_text(encoding="utf-8") if os.path.exists(args.config) else args.config
+        up.configure(json.loads(raw))
+    if args.write_credentials:
+        write_credentials(args.write_credentials, f"http://{args.host}:{args.port}")
+        print(f"credentials written: {args.write_credentials}", file=sys.stderr)
+
+    import uvicorn
+    uvicorn.run(create_app(up), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
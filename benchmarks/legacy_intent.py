@@ -0,0 +1,81 @@
+# benchmarks/legacy_intent.py
+"""
+コンパイル済みスキャナ（intent_engine）導入前の classify_intent_rule をそのまま残した参照実装。
+ベンチマークの比較対象と、出力が完全に一致することのテストに使う。本番コードからは使わない。
+"""
+import re
+from datetime import datetime, timedelta
+from typing import Tuple
+
+from app_intent_mvp import JST, IntentResult, _JP_WD, _next_week_same_weekday, _all_day_payload
+
+def _parse_relative_date(text: str) -> datetime:
+    now = datetime.now(JST)
+    if any(k in text for k in ["明日","あした","tomorrow"]):
+        return (now+timedelta(days=1)).replace(hour=0,minute=0,second=0,microsecond=0)
+    if any(k in text for k in ["今日","きょう","today"]):
+        return now.replace(hour=0,minute=0,second=0,microsecond=0)
+    return now.replace(hour=0,minute=0,second=0,microsecond=0)
+
+def _extract_time(text: str) -> Tuple[int,int]:
+    m = re.search(r'(\d{1,2})\s*時\s*(\d{1,2})?\s*分?', text)
+    if m: return int(m.group(1)), int(m.group(2) or 0)
+    m2 = re.search(r'(\d{1,2}):(\d{2})', text)
+    if m2: return int(m2.group(1)), int(m2.group(2))
+    return 10,0
+
+def _extract_duration(text: str) -> int:
+    m = re.search(r'(\d{1,3})\s*分', text)
+    return int(m.group(1)) if m else 30
+
+def classify_intent_rule(text: str) -> IntentResult:
+    t = (text or "").strip()
+    if not t:
+        return IntentResult(intent="unknown")
+
+    # ① メモ → Sheets
+    if any(k in t for k in ["メモ","日報","memo"]):
+        ts = datetime.now(JST).strftime("%Y-%m-%d %H:%M:%S")
+        body = re.sub(r'^(メモ[:：]?)', '', t).strip()
+        return IntentResult(
+            intent="memo",
+            suggested_payload={"values": [[ts, "memo", body]]}
+        )
+
+    # ② 「来週(◯)曜 … 終日 … 有休/休暇」→ カレンダー終日
+    m = re.search(r"(来週)?(?P<wd>[月火水木金土日])曜.*?(終日|全日).*(有休|休暇)", t)
+    if m:
+        # ヘルパーはファイル上部で宣言済み：
+        # _JP_WD, _next_week_same_weekday, _all_day_payload
+        wd = _JP_WD[m.group("wd")]
+        today = datetime.now(JST).date()
+        if m.group(1):  # 「来週」
+            target = _next_week_same_weekday(today, wd)
+        else:
+            # 今週のその曜日（過ぎていれば翌週）
+            days_ahead = (wd - today.weekday()) % 7
+            target = today + timedelta(days=days_ahead)
+        return IntentResult(
+            intent="calendar",
+            suggested_payload=_all_day_payload(target, "有休")
+        )
+
+    # ③ 時刻あり → カレンダー（デフォ30分）
+    if "時" in t or re.search(r'\d{1,2}:\d{2}', t):
+        base = _parse_relative_date(t)
+        hh, mm = _extract_time(t)
+        dur = _extract_duration(t)
+        start = base.replace(hour=hh, minute=mm)
+        end = start + timedelta(minutes=dur)
+        title = re.sub(r'\d+時|\d+分|\d{1,2}:\d{2}|明日|今日|あした|に|から', '', t).strip() or "無題の予定"
+        return IntentResult(
+            intent="calendar",
+            suggested_payload={
+                "summary": title,
+                "start": start.strftime("%Y-%m-%dT%H:%M:%S+09:00"),
+                "end":   end.strftime("%Y-%m-%dT%H:%M:%S+09:00"),
+                "description": ""
+            }
+        )
+
+    return IntentResult(intent="unknown")
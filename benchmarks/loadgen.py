@@ -0,0 +1,297 @@
+# benchmarks/loadgen.py
+"""
+asyncio + httpx の負荷生成ツール（/execute, /intent/route, /alexa, /notify）。
+
+- closed-loop: --concurrency 本のワーカーが応答を待っては次を投げる（既定）
+- open-loop  : --rate で到着率（ポアソン）を固定。応答が遅れても投げる間隔は変えない。
+               遅延は「本来送るはずだった時刻」から測る（coordinated omission を避ける）
+- 発話は memo / calendar / unknown などを --mix の重みで混ぜる（benchmarks/corpus.py）
+- 遅延は HDR 風の対数ヒストグラム（相対誤差 ~1.6%）に積んで p50/p90/p99/p99.9 を出す
+- --json / --csv で結果を保存して、ワーカー数やコード変更の前後を比べる
+
+例:
+  python -m benchmarks.loadgen --base-url http://127.0.0.1:8000 --endpoint execute -c 32 -d 30
+  python -m benchmarks.loadgen --endpoint execute=3,intent=1 --rate 200 -d 60 --mix memo=3,calendar=5,unknown=2 \\
+      --json out/run_w4.json --csv out/runs.csv --label workers=4
+  # /alexa は alexa_bridge、/notify は app.py 側のサーバなので --base-url を分けて流す
+"""
+from __future__ import annotations
+import argparse, asyncio, csv, json, os, random, sys, time, uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import httpx
+
+from benchmarks import corpus
+
+# 名前 → パス（どれも {"text": ...} を POST する）
+ENDPOINTS = {"execute": "/execute", "intent": "/intent/route", "alexa": "/alexa", "notify": "/notify"}
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+
+class Histogram:
+    """
+    HDR 風の遅延ヒストグラム（µs 単位の整数）。
+    128 未満は1刻み、それ以上は 2 の冪ごとに 64 分割するので相対誤差は 1/64 以下。
+    件数が増えてもメモリは桶の数（数百）で頭打ち。
+    """
+    _SUB_BITS = 6
+
+    def __init__(self):
+        self.counts: Counter = Counter()
+        self.total = 0
+        self.min: Optional[int] = None
+        self.max = 0
+        self._sum = 0
+
+    def record(self, us: float) -> None:
+        v = max(int(us), 0)
+        shift = max(v.bit_length() - self._SUB_BITS - 1, 0)
+        self.counts[(shift, v >> shift)] += 1
+        self.total += 1
+        self._sum += v
+        self.max = max(self.max, v)
+        self.min = v if self.min is None else min(self.min, v)
+
+    def merge(self, other: "Histogram") -> None:
+        self.counts.update(other.counts)
+        self.total += other.total
+        self._sum += other._sum
+        self.max = max(self.max, other.max)
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+
+    @property
+    def mean(self) -> float:
+        return self._sum / self.total if self.total else 0.0
+
+    def percentile(self, q: float) -> float:
+        """q パーセンタイル（桶の上端。max は超えない）。"""
+        if not self.total:
+            return 0.0
+        rank = max(1, int(q / 100 * self.total + 0.999999))
+        seen = 0
+        for (shift, m) in sorted(self.counts, key=lambda k: k[1] << k[0]):
+            seen += self.counts[(shift, m)]
+            if seen >= rank:
+                return float(min(((m + 1) << shift) - 1, self.max))
+        return float(self.max)
+
+
+@dataclass
+class Stats:
+    hist: Histogram = field(default_factory=Histogram)
+    ok: int = 0
+    errors: Counter = field(default_factory=Counter)  # "status:503" / "exc:ConnectTimeout" など
+
+    def summary(self, elapsed: float) -> dict:
+        n = self.hist.total
+        out = {
+            "requests": n, "ok": self.ok, "errors": sum(self.errors.values()),
+            "error_rate": round(sum(self.errors.values()) / n, 4) if n else 0.0,
+            "throughput_rps": round(n / elapsed, 2) if elapsed else 0.0,
+            "latency_ms": {"min": round((self.hist.min or 0) / 1000, 3), "mean": round(self.hist.mean / 1000, 3),
+                           **{f"p{q:g}": round(self.hist.percentile(q) / 1000, 3) for q in PERCENTILES},
+                           "max": round(self.hist.max / 1000, 3)},
+            "error_breakdown": dict(self.errors),
+        }
+        return out
+
+
+def parse_weights(spec: str, allowed) -> List[Tuple[str, float]]:
+    """'execute=3,intent=1' → [("execute", 3.0), ("intent", 1.0)]。重み省略は 1。"""
+    out = []
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, w = part.partition("=")
+        if name not in allowed:
+            raise ValueError(f"不明な名前です: {name}（{', '.join(allowed)}）")
+        out.append((name, float(w) if w else 1.0))
+    if not out:
+        raise ValueError("1つ以上指定してください")
+    return out
+
+
+@dataclass
+class LoadConfig:
+    base_url: str = "http://127.0.0.1:8000"
+    endpoints: List[Tuple[str, float]] = field(default_factory=lambda: [("execute", 1.0)])
+    mix: List[Tuple[str, float]] = field(default_factory=lambda: [("memo", 3.0), ("calendar", 5.0), ("unknown", 2.0)])
+    concurrency: int = 16
+    rate: float = 0.0               # > 0 なら open-loop（req/s）
+    duration: float = 10.0          # 秒
+    requests: int = 0               # > 0 なら件数で打ち切り
+    timeout: float = 30.0
+    warmup: float = 0.0             # 秒（この間の結果は捨てる）
+    seed: int = 0
+
+
+class LoadGenerator:
+    def __init__(self, cfg: LoadConfig, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.cfg = cfg
+        self.transport = transport
+        self.rnd = random.Random(cfg.seed)
+        self.stats: Dict[str, Stats] = {name: Stats() for name, _ in cfg.endpoints}
+        self._issued = 0
+        self._measure_from = 0.0
+
+    def _next_request(self) -> Tuple[str, dict]:
+        names, weights = zip(*self.cfg.endpoints)
+        endpoint = self.rnd.choices(names, weights=weights)[0]
+        kinds, kw = zip(*self.cfg.mix)
+        text = corpus.KINDS[self.rnd.choices(kinds, weights=kw)[0]](self.rnd)
+        return endpoint, {"text": text}
+
+    def _more(self, deadline: float) -> bool:
+        if self.cfg.requests and self._issued >= self.cfg.requests:
+            return False
+        return time.perf_counter() < deadline
+
+    async def _send(self, client: httpx.AsyncClient, endpoint: str, body: dict, intended: float) -> None:
+        st = self.stats[endpoint]
+        try:
+            # 同じ発話が何度も出るので、冪等化（本文ハッシュでの重複抑止）に吸われないよう毎回キーを変える
+            r = await client.post(ENDPOINTS[endpoint], json=body, headers={"Idempotency-Key": uuid.uuid4().hex})
+            err = None if r.status_code < 500 and r.status_code != 429 else f"status:{r.status_code}"
+        except httpx.HTTPError as e:
+            err = f"exc:{type(e).__name__}"
+        done = time.perf_counter()
+        if intended < self._measure_from:
+            return  # ウォームアップ中
+        st.hist.record((done - intended) * 1e6)
+        if err:
+            st.errors[err] += 1
+        else:
+            st.ok += 1  # 4xx（意図不明の 400 など）は「アプリとして応答した」扱い
+
+    async def _closed_loop(self, client, deadline: float) -> None:
+        async def worker():
+            while self._more(deadline):
+                self._issued += 1
+                endpoint, body = self._next_request()
+                await self._send(client, endpoint, body, time.perf_counter())
+        await asyncio.gather(*(worker() for _ in range(self.cfg.concurrency)))
+
+    async def _open_loop(self, client, deadline: float) -> None:
+        # 同時に飛ばす上限は concurrency（超えた分は待たされた時間も遅延に含まれる）
+        sem = asyncio.Semaphore(self.cfg.concurrency)
+        tasks = set()
+        next_at = time.perf_counter()
+
+        async def fire(endpoint, body, intended):
+            async with sem:
+                await self._send(client, endpoint, body, intended)
+
+        while self._more(deadline):
+            now = time.perf_counter()
+            if next_at > now:
+                await asyncio.sleep(next_at - now)
+            self._issued += 1
+            endpoint, body = self._next_request()
+            t = asyncio.create_task(fire(endpoint, body, next_at))
+            tasks.add(t)
+            t.add_done_callback(tasks.discard)
+            next_at += self.rnd.expovariate(self.cfg.rate)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def run(self) -> dict:
+        cfg = self.cfg
+        limits = httpx.Limits(max_connections=cfg.concurrency, max_keepalive_connections=cfg.concurrency)
+        async with httpx.AsyncClient(base_url=cfg.base_url, transport=self.transport, limits=limits,
+                                     timeout=cfg.timeout) as client:
+            start = time.perf_counter()
+            self._measure_from = start + cfg.warmup
+            deadline = start + cfg.warmup + cfg.duration if not cfg.requests else float("inf")
+            if cfg.rate > 0:
+                await self._open_loop(client, deadline)
+            else:
+                await self._closed_loop(client, deadline)
+            elapsed = time.perf_counter() - self._measure_from
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> dict:
+        total = Stats()
+        for st in self.stats.values():
+            total.hist.merge(st.hist)
+            total.ok += st.ok
+            total.errors.update(st.errors)
+        cfg = self.cfg
+        return {
+            "meta": {
+                "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "base_url": cfg.base_url, "mode": "open" if cfg.rate > 0 else "closed",
+                "concurrency": cfg.concurrency, "rate": cfg.rate, "duration_sec": round(elapsed, 3),
+                "endpoints": dict(cfg.endpoints), "mix": dict(cfg.mix), "seed": cfg.seed,
+            },
+            "total": total.summary(elapsed),
+            "endpoints": {name: st.summary(elapsed) for name, st in self.stats.items()},
+        }
+
+
+CSV_FIELDS = ["label", "created_at", "mode", "concurrency", "rate", "endpoint", "requests", "ok", "errors",
+              "error_rate", "throughput_rps", "min", "mean", "p50", "p90", "p99", "p99.9", "max"]
+
+
+def write_csv(path: str, report: dict, label: str = "") -> None:
+    """1エンドポイント1行で追記（初回はヘッダつき）。複数回の実行を1ファイルに並べて比べる用。"""
+    new = not os.path.exists(path)
+    meta = report["meta"]
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        if new:
+            w.writeheader()
+        for name, s in [("total", report["total"]), *report["endpoints"].items()]:
+            w.writerow({"label": label, "created_at": meta["created_at"], "mode": meta["mode"],
+                        "concurrency": meta["concurrency"], "rate": meta["rate"], "endpoint": name,
+                        **{k: s[k] for k in ("requests", "ok", "errors", "error_rate", "throughput_rps")},
+                        **s["latency_ms"]})
+
+
+def print_report(report: dict) -> None:
+    print(f"{'endpoint':<10} {'reqs':>8} {'rps':>9} {'err%':>7} {'p50':>9} {'p90':>9} {'p99':>9} {'p99.9':>9} {'max':>9}  (ms)")
+    for name, s in [*report["endpoints"].items(), ("total", report["total"])]:
+        lat = s["latency_ms"]
+        print(f"{name:<10} {s['requests']:>8} {s['throughput_rps']:>9.1f} {s['error_rate'] * 100:>6.2f}% "
+              f"{lat['p50']:>9.2f} {lat['p90']:>9.2f} {lat['p99']:>9.2f} {lat['p99.9']:>9.2f} {lat['max']:>9.2f}")
+    errs = report["total"]["error_breakdown"]
+    if errs:
+        print("errors: " + ", ".join(f"{k}={v}" for k, v in sorted(errs.items())))
+
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="/execute などへの負荷試験")
+    ap.add_argument("--base-url", default="http://127.0.0.1:8000")
+    ap.add_argument("--endpoint", default="execute", help=f"重みつき: execute=3,intent=1（{', '.join(ENDPOINTS)}）")
+    ap.add_argument("--mix", default="memo=3,calendar=5,unknown=2", help=f"発話の混ぜ方（{', '.join(corpus.KINDS)}）")
+    ap.add_argument("-c", "--concurrency", type=int, default=16)
+    ap.add_argument("-r", "--rate", type=float, default=0.0, help="open-loop の到着率 req/s（0 なら closed-loop）")
+    ap.add_argument("-d", "--duration", type=float, default=10.0, help="計測秒数")
+    ap.add_argument("-n", "--requests", type=int, default=0, help="件数で打ち切る場合")
+    ap.add_argument("--warmup", type=float, default=0.0, help="最初の N 秒は集計しない")
+    ap.add_argument("--timeout", type=float, default=30.0)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", help="結果 JSON の保存先")
+    ap.add_argument("--csv", help="結果を CSV に追記")
+    ap.add_argument("--label", default="", help="CSV の label 列（例: workers=4）")
+    args = ap.parse_args(argv)
+
+    cfg = LoadConfig(base_url=args.base_url, endpoints=parse_weights(args.endpoint, ENDPOINTS),
+                     mix=parse_weights(args.mix, corpus.KINDS), concurrency=args.concurrency, rate=args.rate,
+                     duration=args.duration, requests=args.requests, timeout=args.timeout,
+                     warmup=args.warmup, seed=args.seed)
+    report = asyncio.run(LoadGenerator(cfg).run())
+    report["meta"]["label"] = args.label
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.csv:
+        write_csv(args.csv, report, args.label)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+# cache_backend.py
+"""
+キャッシュの保存先（LLM 判定結果・冪等キーの記録など）。
+
+uvicorn / gunicorn を複数ワーカーで動かすと、プロセス内のキャッシュはワーカーごとに別物になり、
+8 ワーカーならミスも 8 倍、冪等キーも別のワーカーに再送が来ると効かない。
+同じインターフェースで2つの実装を用意し、CACHE_BACKEND で切り替える。
+
+- MemoryCache : プロセス内の LRU（既定。1 ワーカーならこれで十分）
+- SQLiteCache : 同じホストの全ワーカーで共有する SQLite（WAL）ファイル
+
+どちらも TTL・件数上限・compare-and-set（cas）を持つ。値は JSON にできるもの
+（SQLiteCache は JSON で保存するので、tuple は list で返る）。
+"""
+from __future__ import annotations
+import abc, json, os, sqlite3, tempfile, threading, time
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+
+from loguru import logger
+
+
+class CacheBackend(abc.ABC):
+    """
+    キャッシュの共通インターフェース。ttl を省略するとインスタンスの既定 TTL。
+    cas(key, expected, value) は「今の値が expected なら value にする」を原子的に行う
+    （expected=None は「無い・期限切れなら」。set-if-absent として使える）。
+    """
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[Any]: ...
+
+    @abc.abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None: ...
+
+    @abc.abstractmethod
+    def cas(self, key: str, expected: Optional[Any], value: Any, ttl: Optional[float] = None) -> bool: ...
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None: ...
+
+    @abc.abstractmethod
+    def clear(self) -> None: ...
+
+    @abc.abstractmethod
+    def __len__(self) -> int: ...
+
+
+class MemoryCache(CacheBackend):
+    """プロセス内の LRU。maxsize を超えたら最も使われていないものから捨てる。"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600, timer: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            return self._get_locked(key)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._set_locked(key, value, ttl)
+
+    def cas(self, key: str, expected: Optional[Any], value: Any, ttl: Optional[float] = None) -> bool:
+        with self._lock:
+            if self._get_locked(key) != expected:
+                return False
+            self._set_locked(key, value, ttl)
+            return True
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            now = self._timer()
+            return sum(1 for _, exp in self._entries.values() if exp > now)
+
+    def _get_locked(self, key: str) -> Optional[Any]:
+        hit = self._entries.get(key)
+        if hit is None:
+            return None
+        if hit[1] <= self._timer():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return hit[0]
+
+    def _set_locked(self, key: str, value: Any, ttl: Optional[float]) -> None:
+        self._entries[key] = (value, self._timer() + (self.ttl if ttl is None else ttl))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    ns         TEXT NOT NULL,
+    key        TEXT NOT NULL,
+    value      TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (ns, key)
+);
+CREATE INDEX IF NOT EXISTS cache_expiry ON cache (ns, expires_at);
+"""
+
+
+class SQLiteCache(CacheBackend):
+    """
+    path       : 共有する SQLite ファイル（全ワーカーで同じパスを指定する）
+    namespace  : 同じファイルに複数のキャッシュを置くための名前（llm / idempotency など）
+    maxsize    : namespace ごとの件数上限。超えたら期限の近いものから消す
+                 （読むたびに書き込むとワーカー間でロックを取り合うので、厳密な LRU にはしない）
+    prune_every: 何回の書き込みごとに期限切れの掃除と上限の確認をするか（その間は上限を少し超え得る）
+    """
+
+    def __init__(self, path: str, namespace: str = "default", maxsize: int = 10_000, ttl: float = 3600,
+                 prune_every: int = 64, timer: Callable[[], float] = time.time):
+        self.path = path
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.prune_every = prune_every
+        self._timer = timer  # 全ワーカーで共有できる壁時計
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._writes = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        row = self._conn().execute("SELECT value FROM cache WHERE ns = ? AND key = ? AND expires_at > ?",
+                                   (self.namespace, key, self._timer())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        conn = self._conn()
+        self._upsert(conn, key, _dumps(value), ttl)
+        self._maybe_prune()
+
+    def cas(self, key: str, expected: Optional[Any], value: Any, ttl: Optional[float] = None) -> bool:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")  # 読んで比べて書くまでを全ワーカーで排他
+        try:
+            row = conn.execute("SELECT value FROM cache WHERE ns = ? AND key = ? AND expires_at > ?",
+                               (self.namespace, key, self._timer())).fetchone()
+            current = row[0] if row else None
+            ok = current == (None if expected is None else _dumps(expected))
+            if ok:
+                self._upsert(conn, key, _dumps(value), ttl)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        if ok:
+            self._maybe_prune()
+        return ok
+
+    def delete(self, key: str) -> None:
+        self._conn().execute("DELETE FROM cache WHERE ns = ? AND key = ?", (self.namespace, key))
+
+    def clear(self) -> None:
+        self._conn().execute("DELETE FROM cache WHERE ns = ?", (self.namespace,))
+
+    def __len__(self) -> int:
+        (n,) = self._conn().execute("SELECT COUNT(*) FROM cache WHERE ns = ? AND expires_at > ?",
+                                    (self.namespace, self._timer())).fetchone()
+        return n
+
+    def prune(self) -> None:
+        """期限切れを消し、上限を超えていれば期限の近いものから消す。"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")  # 複数のワーカーが同時に数えて消しすぎないように
+        try:
+            conn.execute("DELETE FROM cache WHERE ns = ? AND expires_at <= ?", (self.namespace, self._timer()))
+            (n,) = conn.execute("SELECT COUNT(*) FROM cache WHERE ns = ?", (self.namespace,)).fetchone()
+            if n > self.maxsize:
+                conn.execute("DELETE FROM cache WHERE ns = ? AND key IN (SELECT key FROM cache WHERE ns = ? "
+                             "ORDER BY expires_at LIMIT ?)", (self.namespace, self.namespace, n - self.maxsize))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    # ---- 内部処理 ----
+    def _upsert(self, conn: sqlite3.Connection, key: str, text: str, ttl: Optional[float]) -> None:
+        conn.execute("INSERT INTO cache (ns, key, value, expires_at) VALUES (?, ?, ?, ?) "
+                     "ON CONFLICT(ns, key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+                     (self.namespace, key, text, self._timer() + (self.ttl if ttl is None else ttl)))
+
+    def _maybe_prune(self) -> None:
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # キャッシュなので電源断で直近の書き込みを失ってもよい
+            with self._init_lock:
+                if not self._initialized:
+                    conn.executescript(_SCHEMA)
+                    self._initialized = True
+            self._local.conn = conn
+        return conn
+
+
+def _dumps(value: Any) -> str:
+    # cas で比べるので、同じ値は同じ文字列になるようにキーを並べる
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+
+
+def from_env(namespace: str, maxsize: int, ttl: float, path: Optional[str] = None) -> CacheBackend:
+    """
+    CACHE_BACKEND=memory（既定）/ sqlite。sqlite の場合のファイルは path → CACHE_PATH → 一時ディレクトリ。
+    path を明示した場合は CACHE_BACKEND によらず sqlite（INTENT_LLM_CACHE_PATH との互換）。
+    """
+    kind = os.getenv("CACHE_BACKEND", "memory").lower()
+    if path is None and kind == "memory":
+        return MemoryCache(maxsize=maxsize, ttl=ttl)
+    if path is None and kind != "sqlite":
+        raise RuntimeError(f"CACHE_BACKEND は memory か sqlite を指定してください（{kind}）")
+    path = path or os.getenv("CACHE_PATH") or os.path.join(tempfile.gettempdir(), "app_cache.sqlite3")
+    logger.info(f"cache {namespace}: sqlite {path}")
+    return SQLiteCache(path, namespace=namespace, maxsize=maxsize, ttl=ttl)
@@ -0,0 +1,226 @@
+# circuit_breaker.py
+"""
+上流ごとのサーキットブレーカ（calendar / sheets / oauth / openai / lineworks）。
+
+上流が落ちている間も毎回タイムアウトまで待つと、待ちが積み上がって全体が詰まる。
+直近 window 秒の呼び出しのうち、失敗（429/5xx/通信エラー）か遅い呼び出しの割合がしきい値を超えたら open にし、
+open の間は上流を呼ばずに CircuitOpenError ですぐ失敗させる。
+open_sec 経ったら half_open にして少数の試し呼び出しだけ通し、成功すれば closed に戻す。
+
+- 4xx などの「呼び出し側の誤り」は上流の故障ではないので成功として数える
+- retry_policy.RetryPolicy に breaker を持たせると、再試行の1回ごとにここを通る
+- 状態は /health の circuits に出る
+"""
+from __future__ import annotations
+import os, threading, time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+from loguru import logger
+
+import metrics
+
+T = TypeVar("T")
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """ブレーカが open なので上流を呼ばなかった。retry_after 秒後に half_open になる。"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} は一時的に利用できません（サーキットブレーカ open、{retry_after:.0f}秒後に再試行）")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def _is_failure(exc: BaseException) -> bool:
+    # 締切切れ（asyncio.wait_for のキャンセル）も「上流が遅い」として失敗に数える
+    import asyncio
+    import retry_policy
+    if isinstance(exc, (asyncio.CancelledError, asyncio.TimeoutError)):
+        return True
+    return isinstance(exc, Exception) and retry_policy.reason_of(exc) is not None
+
+
+class CircuitBreaker:
+    """
+    window_sec    : 失敗率を数える時間窓
+    min_calls     : 窓内の呼び出しがこれ未満なら判定しない（少数の失敗で開かない）
+    failure_rate  : 失敗（遅い呼び出しを含む）の割合がこれ以上で open
+    slow_call_sec : これより時間のかかった呼び出しは失敗扱い（0 で無効）
+    open_sec      : open から half_open に移るまでの秒数
+    half_open_max : half_open で同時に通す試し呼び出しの数
+    """
+
+    def __init__(self, name: str, window_sec: float = 30, min_calls: int = 10,
+                 failure_rate: float = 0.5, slow_call_sec: float = 5.0,
+                 open_sec: float = 15, half_open_max: int = 1,
+                 timer: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.window_sec = window_sec
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_sec = slow_call_sec
+        self.open_sec = open_sec
+        self.half_open_max = half_open_max
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._calls: Deque[Tuple[float, bool]] = deque()  # (時刻, 失敗したか)
+        self._failures = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(self._timer())
+
+    # ---- 呼び出し ----
+    def allow(self) -> None:
+        """通してよければ戻る。open なら CircuitOpenError。"""
+        now = self._timer()
+        with self._lock:
+            state = self._current_state(now)
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and self._probes < self.half_open_max:
+                self._probes += 1
+                return
+            retry_after = max(0.0, self._opened_at + self.open_sec - now)
+        metrics.inc("circuit_rejected", upstream=self.name)
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record(self, failed: bool, elapsed: float = 0.0) -> None:
+        if self.slow_call_sec and elapsed > self.slow_call_sec:
+            failed = True
+        now = self._timer()
+        with self._lock:
+            state = self._current_state(now)
+            if state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                self._transition(OPEN if failed else CLOSED, now)
+                return
+            if state == OPEN:
+                return  # open 前に出ていた呼び出しの結果は数えない
+            self._calls.append((now, failed))
+            self._failures += failed
+            self._prune(now)
+            n = len(self._calls)
+            if n >= self.min_calls and self._failures / n >= self.failure_rate:
+                self._transition(OPEN, now)
+
+    def call(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        self.allow()
+        start = time.perf_counter()
+        try:
+            res = fn(*args, **kwargs)
+        except BaseException as e:
+            self.record(_is_failure(e), time.perf_counter() - start)
+            raise
+        self.record(False, time.perf_counter() - start)
+        return res
+
+    async def acall(self, fn: Callable[..., Awaitable[T]], *args, **kwargs) -> T:
+        self.allow()
+        start = time.perf_counter()
+        try:
+            res = await fn(*args, **kwargs)
+        except BaseException as e:
+            self.record(_is_failure(e), time.perf_counter() - start)
+            raise
+        self.record(False, time.perf_counter() - start)
+        return res
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = self._timer()
+        with self._lock:
+            state = self._current_state(now)
+            self._prune(now)
+            n = len(self._calls)
+            out: Dict[str, Any] = {"state": state, "calls": n,
+                                   "failure_rate": round(self._failures / n, 3) if n else 0.0}
+            if state != CLOSED:
+                out["retry_after"] = round(max(0.0, self._opened_at + self.open_sec - now), 1)
+            return out
+
+    def reset(self) -> None:
+        with self._lock:
+            self._state, self._probes = CLOSED, 0
+            self._calls.clear()
+            self._failures = 0
+
+    # ---- 内部処理（_lock を持って呼ぶ） ----
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self.open_sec:
+            self._transition(HALF_OPEN, now)
+        return self._state
+
+    def _transition(self, to: str, now: float) -> None:
+        if to == self._state:
+            if to == OPEN:
+                self._opened_at = now
+            return
+        logger.warning(f"circuit {self.name}: {self._state} -> {to}")
+        metrics.inc("circuit_transitions", upstream=self.name, to=to)
+        self._state = to
+        if to == OPEN:
+            self._opened_at = now
+            self._probes = 0
+        elif to == CLOSED:
+            self._calls.clear()
+            self._failures = 0
+            self._probes = 0
+
+    def _prune(self, now: float) -> None:
+        calls = self._calls
+        while calls and now - calls[0][0] > self.window_sec:
+            _, failed = calls.popleft()
+            self._failures -= failed
+
+
+# ---- 上流ごとのレジストリ ----
+_ENV_FIELDS = (("WINDOW_SEC", "window_sec", float), ("MIN_CALLS", "min_calls", int),
+               ("FAILURE_RATE", "failure_rate", float), ("SLOW_CALL_SEC", "slow_call_sec", float),
+               ("OPEN_SEC", "open_sec", float), ("HALF_OPEN_MAX", "half_open_max", int))
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return os.getenv("CIRCUIT_BREAKER_ENABLED", "true").lower() == "true"
+
+
+def get(name: str, **defaults) -> Optional[CircuitBreaker]:
+    """
+    名前ごとに1つ。CIRCUIT_<NAME>_* / CIRCUIT_* で設定（どちらも無ければ defaults / 既定値）。
+    CIRCUIT_BREAKER_ENABLED=false なら None。
+    """
+    if not enabled():
+        return None
+    with _registry_lock:
+        b = _breakers.get(name)
+        if b is None:
+            kwargs = dict(defaults)
+            for env, field, cast in _ENV_FIELDS:
+                v = os.getenv(f"CIRCUIT_{name.upper()}_{env}") or os.getenv(f"CIRCUIT_{env}")
+                if v:
+                    kwargs[field] = cast(v)
+            b = _breakers[name] = CircuitBreaker(name, **kwargs)
+        return b
+
+
+def states() -> Dict[str, Dict[str, Any]]:
+    """/health 用。"""
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    return {b.name: b.snapshot() for b in breakers}
+
+
+def reset_all() -> None:
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    for b in breakers:
+        b.reset()
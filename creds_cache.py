@@ -0,0 +1,143 @@
+# creds_cache.py
+"""
+Google OAuth Credentials のプロセス内キャッシュ。
+
+- Credentials はメモリに1つだけ保持し、リクエスト毎のディスク読込をやめる
+- 有効期限の少し前にバックグラウンドで refresh（リクエスト経路では待たない）
+- 期限切れ時の refresh は single-flight（同時リクエストは1回の refresh を共有）
+- トークンファイルへの書き込みは「実際に refresh した時だけ」、かつ原子的に行う
+- リクエスト経路の refresh に失敗したらキャッシュを捨て、次の呼び出しで loader から読み直す
+  （invalid_grant などは同じトークンでは直らない。token_setup.py で再発行したものを拾うため）
+"""
+from __future__ import annotations
+import os, threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Optional
+from loguru import logger
+
+import metrics
+import retry_policy
+
+# 期限の何秒前にバックグラウンド refresh するか
+REFRESH_MARGIN_SEC = int(os.getenv("GOOGLE_CREDS_REFRESH_MARGIN_SEC", "300"))
+# バックグラウンド refresh 失敗時の再試行間隔
+RETRY_INTERVAL_SEC = int(os.getenv("GOOGLE_CREDS_RETRY_INTERVAL_SEC", "30"))
+# トークンエンドポイントへの再試行（通信エラー / 5xx だけ。invalid_grant 等は即失敗）
+OAUTH_RETRY = retry_policy.from_env("oauth")
+
+
+def atomic_write_text(path: Path, text: str) -> None:
+    """同じディレクトリの一時ファイルに書いてから os.replace で差し替える。"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+class CredsCache:
+    """
+    loader: ディスク等から Credentials を組み立てる（refresh はしない）
+    saver : refresh 後の Credentials を永続化する（None なら保存しない）
+    """
+
+    def __init__(self,
+                 loader: Callable[[], Any],
+                 saver: Optional[Callable[[Any], None]] = None,
+                 margin_sec: int = REFRESH_MARGIN_SEC,
+                 background: bool = True):
+        self._loader = loader
+        self._saver = saver
+        self._margin = timedelta(seconds=margin_sec)
+        self._background = background
+        self._lock = threading.Lock()
+        self._creds = None
+        self._timer: Optional[threading.Timer] = None
+
+    def get(self):
+        # 速い経路：有効な Credentials がメモリにあればロックも取らない
+        creds = self._creds
+        if creds is not None and creds.valid:
+            return creds
+        with self._lock:
+            creds = self._creds
+            if creds is None:
+                with metrics.timer("creds_load"):
+                    creds = self._loader()
+            # ロック待ちの間に他スレッドが refresh 済みならそのまま使う
+            if not creds.valid:
+                try:
+                    with metrics.timer("creds_refresh"):
+                        self._refresh_locked(creds)
+                except Exception:
+                    self._creds = None
+                    self._cancel_timer()
+                    raise
+            self._creds = creds
+            self._schedule(creds)
+            return creds
+
+    def peek(self):
+        """メモリにある有効な Credentials（無い・期限切れなら None）。ロックも I/O もしない。"""
+        creds = self._creds
+        return creds if creds is not None and creds.valid else None
+
+    def invalidate(self) -> None:
+        """キャッシュを捨てる（token_setup.py で再発行した後など）。"""
+        with self._lock:
+            self._creds = None
+            self._cancel_timer()
+
+    def close(self) -> None:
+        self.invalidate()
+
+    # ---- 内部処理 ----
+    def _refresh_locked(self, creds) -> None:
+        if not creds.refresh_token:
+            raise RuntimeError("OAuth トークンを更新できません。再同意が必要です。")
+        from google.auth.transport.requests import Request
+        # ここでネット疎通が必要になる点に注意（長期運用はネット修復が必須）
+        OAUTH_RETRY.call(creds.refresh, Request())
+        if self._saver:
+            self._saver(creds)
+        logger.info(f"Google OAuth token refreshed (expiry={creds.expiry})")
+
+    def _cancel_timer(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _schedule(self, creds, delay: Optional[float] = None) -> None:
+        if not self._background or not creds.expiry or not creds.refresh_token:
+            return
+        if delay is None:
+            # google-auth の expiry は naive UTC
+            due = creds.expiry - self._margin
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            delay = max((due - now).total_seconds(), 1.0)
+        self._cancel_timer()
+        t = threading.Timer(delay, self._background_refresh, args=(creds,))
+        t.daemon = True
+        self._timer = t
+        t.start()
+
+    def _background_refresh(self, creds) -> None:
+        with self._lock:
+            # invalidate 済み / 別の Credentials に置き換わっていたら何もしない
+            if self._creds is not creds:
+                return
+            try:
+                self._refresh_locked(creds)
+            except Exception as e:
+                logger.warning(f"Google OAuth background refresh failed: {e}")
+                self._schedule(creds, delay=RETRY_INTERVAL_SEC)
+                return
+            self._schedule(creds)
@@ -0,0 +1,122 @@
+# google_async.py
+"""
+Google Calendar / Sheets の asyncio ネイティブ最小クライアント。
+
+googleapiclient の .execute() はブロッキングで FastAPI のスレッドプールを消費するため、
+よく使う操作（予定の insert/get、値の append/get）だけを httpx.AsyncClient で直接叩く。
+クライアントはプロセスで共有し（keep-alive）、1ワーカーで数百件の同時呼び出しを捌く。
+"""
+from __future__ import annotations
+import asyncio, os
+from typing import Any, Callable, Optional
+from urllib.parse import quote
+
+import httpx
+
+import metrics
+from google_services import new_event_id
+
+# 接続先のルート URL（discovery 文書の rootUrl 相当）。負荷試験ではローカルのスタブに向ける
+CALENDAR_ROOT_URL = os.getenv("GOOGLE_CALENDAR_ROOT_URL", "https://www.googleapis.com/").rstrip("/")
+SHEETS_ROOT_URL = os.getenv("GOOGLE_SHEETS_ROOT_URL", "https://sheets.googleapis.com/").rstrip("/")
+CALENDAR_BASE = f"{CALENDAR_ROOT_URL}/calendar/v3"
+SHEETS_BASE = f"{SHEETS_ROOT_URL}/v4"
+
+MAX_CONNECTIONS = int(os.getenv("GOOGLE_HTTP_MAX_CONNECTIONS", "200"))
+MAX_KEEPALIVE = int(os.getenv("GOOGLE_HTTP_MAX_KEEPALIVE", "50"))
+TIMEOUT_SEC = float(os.getenv("GOOGLE_HTTP_TIMEOUT_SEC", "10"))
+
+
+class GoogleAPIError(Exception):
+    """Google API が 4xx/5xx を返した。str() は "<status> <message>" 形式。"""
+
+    def __init__(self, status: int, message: str, headers: Optional[dict] = None):
+        super().__init__(f"{status} {message}")
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class GoogleAsyncClient:
+    """
+    creds_provider: Credentials を返す関数（app_intent_mvp.get_google_creds）。
+    有効な Credentials を持っている間は呼ばず、期限切れ時だけスレッドで呼ぶ（refresh がブロッキングのため）。
+    creds_peek    : メモリ上の有効な Credentials を返す関数（無ければ None）。
+                    指定すると Credentials を自分では持たず、呼ぶたびにこれで引く（テナントごとに違う場合）。
+    """
+
+    def __init__(self, creds_provider: Callable[[], Any],
+                 transport: Optional[httpx.AsyncBaseTransport] = None,
+                 creds_peek: Optional[Callable[[], Any]] = None):
+        self._creds_provider = creds_provider
+        self._creds_peek = creds_peek
+        self._creds = None
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    # ---- Calendar ----
+    async def insert_event(self, calendar_id: str, body: dict) -> dict:
+        """id つきで登録する（google_services.insert_event と同じく、409 は前回の試行が通っていたとみなす）。"""
+        body = {**body, "id": body.get("id") or new_event_id()}
+        try:
+            return await self._request("POST", f"{CALENDAR_BASE}/calendars/{quote(calendar_id, safe='')}/events",
+                                       json=body)
+        except GoogleAPIError as e:
+            if e.status != 409:
+                raise
+            metrics.inc("calendar_insert_duplicate")
+            return await self.get_event(calendar_id, body["id"])
+
+    async def get_event(self, calendar_id: str, event_id: str) -> dict:
+        return await self._request(
+            "GET", f"{CALENDAR_BASE}/calendars/{quote(calendar_id, safe='')}/events/{quote(event_id, safe='')}")
+
+    # ---- Sheets ----
+    async def append_values(self, spreadsheet_id: str, rng: str, values: list,
+                            value_input_option: str = "RAW") -> dict:
+        return await self._request(
+            "POST", f"{SHEETS_BASE}/spreadsheets/{spreadsheet_id}/values/{quote(rng, safe='')}:append",
+            params={"valueInputOption": value_input_option}, json={"values": values})
+
+    async def get_values(self, spreadsheet_id: str, rng: str) -> dict:
+        return await self._request("GET", f"{SHEETS_BASE}/spreadsheets/{spreadsheet_id}/values/{quote(rng, safe='')}")
+
+    async def aclose(self) -> None:
+        client, self._client, self._loop = self._client, None, None
+        if client is not None:
+            await client.aclose()
+
+    # ---- 内部処理 ----
+    def _http(self) -> httpx.AsyncClient:
+        # AsyncClient はイベントループに紐づくので、ループが変わったら作り直す（テスト等）
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            with metrics.timer("client_build", api="google_async"):
+                self._client = httpx.AsyncClient(
+                    transport=self._transport,
+                    limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE),
+                    timeout=httpx.Timeout(TIMEOUT_SEC, connect=5.0),
+                )
+            self._loop = loop
+        return self._client
+
+    async def _token(self) -> str:
+        if self._creds_peek is not None:
+            creds = self._creds_peek() or await asyncio.to_thread(self._creds_provider)
+            return creds.token
+        creds = self._creds
+        if creds is None or not creds.valid:
+            creds = self._creds = await asyncio.to_thread(self._creds_provider)
+        return creds.token
+
+    async def _request(self, method: str, url: str, **kwargs) -> dict:
+        headers = {"Authorization": f"Bearer {await self._token()}"}
+        r = await self._http().request(method, url, headers=headers, **kwargs)
+        if r.status_code >= 400:
+            try:
+                message = r.json().get("error", {}).get("message") or r.text
+            except ValueError:
+                message = r.text
+            raise GoogleAPIError(r.status_code, message, dict(r.headers))
+        return r.json() if r.content else {}
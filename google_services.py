@@ -0,0 +1,101 @@
+# google_services.py
+"""
+Google API サービスオブジェクト（discovery.build の結果）の使い回し。
+
+- discovery 文書は googleapiclient 同梱の静的ドキュメントをプロセスで1回だけ読む（ネット不要）
+- httplib2.Http はスレッドセーフでないため、サービスは「スレッド毎 × Credentials 毎」に1回だけ組み立てる
+  → 同じスレッドでは同じ HTTP 接続（keep-alive）を使い回せる
+- スレッドごとに GOOGLE_SERVICE_CACHE_SIZE 個までの LRU（テナントが多くてもメモリは一定）
+- 予定の登録はクライアント側で決めた id で行い、再試行しても二重に作らない（insert_event）
+- GOOGLE_CALENDAR_ROOT_URL / GOOGLE_SHEETS_ROOT_URL で接続先を差し替えられる（負荷試験用のスタブ等）
+"""
+from __future__ import annotations
+import json, os, threading, uuid
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Optional
+from urllib.parse import urljoin
+
+import metrics
+import retry_policy
+
+_local = threading.local()
+
+SERVICE_CACHE_SIZE = int(os.getenv("GOOGLE_SERVICE_CACHE_SIZE", "32"))
+
+_ROOT_URL_ENV = {"calendar": "GOOGLE_CALENDAR_ROOT_URL", "sheets": "GOOGLE_SHEETS_ROOT_URL"}
+
+
+@lru_cache(maxsize=None)
+def _discovery_doc(api: str, version: str) -> str:
+    from googleapiclient.discovery_cache import get_static_doc
+    doc = get_static_doc(api, version)
+    if doc is None:
+        raise RuntimeError(f"{api} {version} の discovery 文書が googleapiclient に同梱されていません")
+    return doc
+
+
+def get_service(api: str, version: str, creds) -> Any:
+    """build(api, version, credentials=creds) 相当。2回目以降は組み立て済みのものを返す。"""
+    services = getattr(_local, "services", None)
+    if services is None:
+        services = _local.services = OrderedDict()
+    key = (api, version, id(creds))
+    hit = services.get(key)
+    if hit is not None and hit[0] is creds:
+        services.move_to_end(key)
+        return hit[1]
+
+    from googleapiclient.discovery import build_from_document
+    doc = _discovery_doc(api, version)
+    endpoint = _api_endpoint(api, doc)
+    with metrics.timer("client_build", api=api):
+        svc = build_from_document(doc, credentials=creds,
+                                  client_options={"api_endpoint": endpoint} if endpoint else None)
+    services[key] = (creds, svc)
+    services.move_to_end(key)
+    while len(services) > SERVICE_CACHE_SIZE:
+        services.popitem(last=False)
+    return svc
+
+
+def _api_endpoint(api: str, doc: str) -> Optional[str]:
+    # rootUrl だけ差し替え、servicePath（calendar/v3/ など）はそのまま付ける
+    root = os.getenv(_ROOT_URL_ENV.get(api, ""), "")
+    if not root:
+        return None
+    return urljoin(root.rstrip("/") + "/", json.loads(doc).get("servicePath", ""))
+
+
+def new_event_id() -> str:
+    """Calendar の予定 id（base32hex の a-v0-9、5〜1024 文字）。uuid4 の16進表記はその部分集合。"""
+    return uuid.uuid4().hex
+
+
+def insert_event(service, calendar_id: str, body: dict) -> dict:
+    """
+    events.insert を id つきで行う。id が無ければ付ける。
+    409（同じ id の予定がもうある）は、前回の試行（応答を受け取れなかったもの）が
+    通っていたということなので、その予定を読んで成功として返す。
+    """
+    body = {**body, "id": body.get("id") or new_event_id()}
+    try:
+        return service.events().insert(calendarId=calendar_id, body=body).execute()
+    except Exception as e:
+        if retry_policy.status_of(e) != 409:
+            raise
+        metrics.inc("calendar_insert_duplicate")
+        return service.events().get(calendarId=calendar_id, eventId=body["id"]).execute()
+
+
+def calendar_service(creds) -> Any:
+    return get_service("calendar", "v3", creds)
+
+
+def sheets_service(creds) -> Any:
+    return get_service("sheets", "v4", creds)
+
+
+def clear() -> None:
+    """このスレッドのサービスキャッシュを捨てる（テスト用）。"""
+    _local.services = OrderedDict()
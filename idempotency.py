@@ -0,0 +1,156 @@
+# idempotency.py
+"""
+冪等キーによる重複実行の抑止（/execute, /alexa）。
+
+Alexa / Lambda はタイムアウトすると同じ発話を再送してくる。そのたびに予定や行が増えるうえ、
+再送が起きるのは上流が遅い時なので、遅い時ほど上流への書き込みが倍になる。
+
+- キーは Idempotency-Key ヘッダ。無ければ「正規化した本文のハッシュ」を短い時間窓だけ使う
+- 実行中のキーに来た重複は、最初の実行の Future を待って同じ結果を受け取る
+- 完了後の再送は TTL の間、保存済みの結果をそのまま返す（上流は呼ばない）
+- 失敗（例外・5xx）は保存しない → 再送すれば実行し直せる
+- 記録は cache_backend に置く。SQLiteCache なら別のワーカーに来た再送も重複として扱える
+  （実行中のキーは所有権を cas で取り合い、他のワーカーは結果が書かれるまで待つ）
+"""
+from __future__ import annotations
+import hashlib, threading, time
+from concurrent.futures import Future
+from typing import Any, Dict, Optional, Tuple
+
+from cache_backend import CacheBackend, MemoryCache
+from llm_cache import normalize_text
+
+
+def key_for(header: Optional[str], text: str, text_window_sec: float) -> Optional[str]:
+    """ヘッダがあればそれを、無ければ本文ハッシュ（text_window_sec が 0 なら None = 冪等化しない）。"""
+    if header and header.strip():
+        return "h:" + header.strip()
+    if text_window_sec <= 0 or not (text or "").strip():
+        return None
+    return "t:" + hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+RUNNING, DONE, FAILED = "running", "done", "failed"
+
+
+class IdempotencyStore:
+    """
+    キー → 記録（running / done + 結果 / failed）。期限と件数上限は保存先（backend）が持つ。
+    このプロセスで実行中・待機中のキーは Future も持ち、同じプロセスの重複はそれを待つ。
+    Future は concurrent.futures のものなので、スレッドからは .result()、
+    イベントループからは asyncio.wrap_future() で待てる。
+    begin / finish / fail は保存先を読み書きする（SQLiteCache ならファイルロック）ので、
+    イベントループからは asyncio.to_thread で呼ぶ。
+
+    lease_sec    : 実行中の記録の有効秒数（実行したワーカーが落ちてもこの後は実行し直せる）
+    poll_interval: 別のワーカーが実行中のキーの結果を見に行く間隔
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 600, timer=time.monotonic,
+                 backend: Optional[CacheBackend] = None, lease_sec: float = 60.0, poll_interval: float = 0.05):
+        self._ttl = ttl
+        self._timer = timer
+        self.backend = backend if backend is not None else MemoryCache(maxsize=maxsize, ttl=ttl, timer=timer)
+        self.lease_sec = lease_sec
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._local: Dict[str, Tuple[Future, float]] = {}  # キー → (Future, 結果を残す秒数)
+
+    def begin(self, key: str, ttl: Optional[float] = None) -> Tuple[Future, bool]:
+        """
+        (Future, owner) を返す。owner=True なら呼び出し側が実行して finish/fail する。
+        False なら既存の実行（実行中 or 完了済み）の Future。
+        """
+        ttl = self._ttl if ttl is None else ttl
+        with self._lock:
+            hit = self._local.get(key)
+            if hit is not None:
+                return hit[0], False
+            # 先に Future を置いてからロックを離す。保存先の読み書き（SQLite なら BEGIN IMMEDIATE）は
+            # ロックの外で行い、その間に来た同じプロセスの重複はこの Future を待つ
+            fut: Future = Future()
+            self._local[key] = (fut, ttl)
+        try:
+            return fut, self._claim(key, fut, ttl)
+        except BaseException as e:
+            self._forget(key, fut)
+            fut.set_exception(e)
+            raise
+
+    def _claim(self, key: str, fut: Future, ttl: float) -> bool:
+        while True:
+            rec = self.backend.get(key)
+            if rec is None or rec.get("state") == FAILED:
+                # 誰も実行していない（前回は失敗）→ 所有権を取る。取り合いに負けたら読み直す
+                if self.backend.cas(key, rec, {"state": RUNNING}, min(ttl, self.lease_sec)):
+                    return True
+                continue
+            if rec.get("state") == DONE:
+                self._forget(key, fut)
+                fut.set_result(rec.get("result"))
+                return False
+            # 別のワーカーが実行中：結果が書かれるまで待つ（同じプロセスの後続もこの Future を待つ）
+            threading.Thread(target=self._wait_remote, args=(key, fut), daemon=True).start()
+            return False
+
+    def finish(self, key: str, fut: Future, result) -> None:
+        with self._lock:
+            entry = self._local.pop(key, None)
+            ttl = entry[1] if entry is not None and entry[0] is fut else self._ttl
+        self.backend.set(key, {"state": DONE, "result": result}, ttl)
+        fut.set_result(result)
+
+    def fail(self, key: str, fut: Future, exc: Optional[BaseException] = None, result=None) -> None:
+        """
+        失敗を待っている重複に伝え、キーは消す（後からの再送は実行し直す）。
+        exc があれば例外として、無ければ result（5xx の応答など）をそのまま渡す。
+        """
+        self._forget(key, fut)
+        # failed の記録は他のワーカーで待っている重複に結果を伝えるため。次の begin は実行し直す
+        rec: Dict[str, Any] = {"state": FAILED}
+        if exc is not None:
+            rec["error"] = str(exc)
+        else:
+            rec["result"] = result
+        self.backend.set(key, rec, self.lease_sec)
+        if exc is not None:
+            fut.set_exception(exc)
+        else:
+            fut.set_result(result)
+
+    def __len__(self) -> int:
+        return len(self.backend)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._local.clear()
+        self.backend.clear()
+
+    def _wait_remote(self, key: str, fut: Future) -> None:
+        deadline = time.monotonic() + self.lease_sec
+        try:
+            while True:
+                rec = self.backend.get(key)
+                state = rec.get("state") if rec else None
+                if state == DONE:
+                    fut.set_result(rec.get("result"))
+                    return
+                if state == FAILED:
+                    if "error" in rec:
+                        fut.set_exception(RuntimeError(rec["error"]))
+                    else:
+                        fut.set_result(rec.get("result"))
+                    return
+                if state is None or time.monotonic() > deadline:
+                    # 実行していたワーカーが落ちた（記録が期限切れ）。再送してもらえば実行し直せる
+                    fut.set_exception(RuntimeError("同じ依頼を処理していたワーカーが応答しません。再試行してください。"))
+                    return
+                time.sleep(self.poll_interval)
+        finally:
+            self._forget(key, fut)
+
+    def _forget(self, key: str, fut: Future) -> None:
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None and entry[0] is fut:
+                del self._local[key]
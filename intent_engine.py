@@ -0,0 +1,126 @@
+# intent_engine.py
+"""
+ルール意図判定の字句スキャナ（コンパイル済み・単一パス）。
+
+classify_intent_rule は「キーワードの有無」を any(k in t) で何度も走査し、
+さらに時刻・所要時間・曜日の re.search を別々に 4〜6 回かけていた。
+ここでは 1 本の結合正規表現（名前付きグループ）で本文を 1 回だけ走査し、
+キーワード・時刻・所要時間の出現をまとめて拾う。
+
+- キーワードは最長一致の選択肢で拾う（「明日報告」のように重なるものは複合語で両方立てる）
+- 数字の位置では先読み (?=...) で時刻/所要時間の候補を同時に評価する
+  → 各パターンを re.search した時と同じ「最左の一致」が得られる
+- 終日休暇のパターンは必要キーワードが揃った時だけ評価する
+"""
+from __future__ import annotations
+import re
+from typing import FrozenSet, NamedTuple, Optional, Tuple
+
+# 複合語 → 含まれるキーワード（文字を共有して重なるもの）
+_COMPOUNDS = {
+    "明日報": ("明日", "日報"),
+    "今日報": ("今日", "日報"),
+    "終日報": ("終日", "日報"),
+    "全日報": ("全日", "日報"),
+    "有休暇": ("有休", "休暇"),
+}
+KEYWORDS = (
+    "メモ", "日報", "memo",
+    "明日", "あした", "tomorrow", "今日", "きょう", "today",
+    "時", "曜", "終日", "全日", "有休", "休暇",
+)
+
+_FIRST_CHARS = "".join(sorted({k[0] for k in (*_COMPOUNDS, *KEYWORDS)}))
+_TOKEN_RE = re.compile(
+    # 先頭文字で候補位置を絞る（キーワードの頭文字か数字の位置だけ選択肢を試す）
+    "(?=[" + re.escape(_FIRST_CHARS) + r"\d])"
+    "(?:(?P<kw>" + "|".join(map(re.escape, [*_COMPOUNDS, *KEYWORDS])) + ")"
+    # 数字の並び：直後が「時」「分」「:NN」かを同時に見る。
+    # 分の数字は先読みで拾うだけにして消費しない（「10時30分」の 30分 を所要時間としても拾うため）
+    r"|(?P<d>\d+)(?:\s*(?P<ji>時)(?=\s*(?P<km>\d{1,2}))?"
+    r"|\s*(?P<fun>分)"
+    r"|(?P<colon>:)(?=(?P<cm>\d\d)))?)"
+)
+
+MEMO_KEYWORDS = frozenset(("メモ", "日報", "memo"))
+TOMORROW_KEYWORDS = frozenset(("明日", "あした", "tomorrow"))
+
+# 変換用（検出ではなく置換・抽出に使うもの）はコンパイルだけしておく
+ALLDAY_RE = re.compile(r"(来週)?(?P<wd>[月火水木金土日])曜.*?(終日|全日).*(有休|休暇)")
+MEMO_PREFIX_RE = re.compile(r'^(メモ[:：]?)')
+TITLE_STRIP_RE = re.compile(r'\d+時|\d+分|\d{1,2}:\d{2}|明日|今日|あした|に|から')
+
+# ルールは拾わないが、ローカルモデルの判定を裏付けられる表現（app_intent_mvp._model_result で使う）
+# メモ：「メモ」「日報」以外の、書き留める依頼であることがはっきりした言い回し
+MEMO_CUE_RE = re.compile(r"覚えておいて|書き留めて|記録して|控えておいて|ノートに残して|備忘録"
+                         r"|やることに追加|リストに追加|買い物リスト|(?i:\btodo\b)")
+# 時刻：「時」「HH:MM」を使わない時刻（正午 / noon / 3pm / 10 a.m.）
+LOOSE_TIME_RE = re.compile(r"正午|(?i:\bnoon\b)|(?i:(?<![\d:])(?P<h>\d{1,2})\s*(?P<ap>[ap])\.?m(?![a-z])\.?)")
+
+
+class Tokens(NamedTuple):
+    keywords: FrozenSet[str]
+    kanji_time: Optional[Tuple[int, int]]   # 「10時30分」形式の最初の一致
+    colon_time: Optional[Tuple[int, int]]   # 「13:15」形式の最初の一致
+    duration: Optional[int]                 # 「45分」形式の最初の一致
+
+    @property
+    def memo(self) -> bool:
+        return not MEMO_KEYWORDS.isdisjoint(self.keywords)
+
+    @property
+    def tomorrow(self) -> bool:
+        return not TOMORROW_KEYWORDS.isdisjoint(self.keywords)
+
+    @property
+    def has_time(self) -> bool:
+        return "時" in self.keywords or self.colon_time is not None
+
+    @property
+    def time(self) -> Optional[Tuple[int, int]]:
+        return self.kanji_time or self.colon_time
+
+    @property
+    def allday_candidate(self) -> bool:
+        kw = self.keywords
+        return "曜" in kw and ("終日" in kw or "全日" in kw) and ("有休" in kw or "休暇" in kw)
+
+
+def scan(text: str) -> Tokens:
+    """
+    本文を1回だけ走査して、キーワードと時刻/所要時間の最初の出現を返す。
+
+    数字の並び D について、各パターンを re.search した時の最左一致は
+      「D\\s*時」→ 時 = D の末尾2桁、分 = 時\\s* の直後の先頭2桁
+      「D:NN」   → 時 = D の末尾2桁、分 = NN
+      「D\\s*分」→ 分数 = D の末尾3桁
+    になるので、並び単位で見れば同じ結果が得られる。
+    """
+    found = set()
+    kanji = colon_t = dur = None
+    for kw, d, ji, km, fun, colon, cm in _TOKEN_RE.findall(text):
+        if kw:
+            found.update(_COMPOUNDS.get(kw, (kw,)))
+        elif ji:
+            found.add("時")
+            if kanji is None:
+                kanji = (int(d[-2:]), int(km) if km else 0)
+        elif fun:
+            if dur is None:
+                dur = int(d[-3:])
+        elif colon and colon_t is None:
+            colon_t = (int(d[-2:]), int(cm))
+    return Tokens(frozenset(found), kanji, colon_t, dur)
+
+
+def loose_time(text: str) -> Optional[Tuple[int, int]]:
+    """LOOSE_TIME_RE の最初の一致を (時, 分) にする。無い・あり得ない時刻（13pm など）なら None。"""
+    m = LOOSE_TIME_RE.search(text)
+    if m is None:
+        return None
+    if m.group("h") is None:
+        return (12, 0)  # 正午 / noon
+    h = int(m.group("h"))
+    if not 1 <= h <= 12:
+        return None
+    return (h % 12 + (12 if m.group("ap").lower() == "p" else 0), 0)
@@ -0,0 +1,168 @@
+# intent_model.py
+"""
+オフラインの意図判定モデル（文字 n-gram TF-IDF + 最近傍セントロイド、NumPy のみ）。
+
+ルールで unknown になった文面を、LLM に投げる前にここで判定する。
+ネットワーク不要・1件あたりサブミリ秒。確信度が低いものだけ LLM に回す。
+
+使い方:
+  python intent_model.py train intent_samples.jsonl -o intent_model.npz
+  python intent_model.py predict intent_model.npz "明日の午後に歯医者"
+
+学習データは 1行1件の JSONL: {"text": "...", "intent": "calendar|memo|unknown"}
+"""
+from __future__ import annotations
+import argparse, json, math, re, unicodedata
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy が無い環境ではモデル層を使わない（ルール → LLM のまま）
+    np = None
+
+LABELS = ("calendar", "memo", "unknown")
+TEMPERATURE = 0.05
+_DIGITS_RE = re.compile(r"\d")
+
+
+def _normalize(text: str) -> str:
+    # 全角/半角・大小文字をそろえ、数字は 0 に寄せる（「10時」と「18時」を同じ特徴にする）
+    t = unicodedata.normalize("NFKC", text or "").casefold()
+    return " " + _DIGITS_RE.sub("0", " ".join(t.split())) + " "
+
+
+def char_ngrams(text: str, n_min: int = 1, n_max: int = 3) -> Counter:
+    t = _normalize(text)
+    return Counter(t[i:i + n] for n in range(n_min, n_max + 1) for i in range(len(t) - n + 1))
+
+
+class IntentModel:
+    """
+    vocab    : n-gram → 列番号
+    idf      : (V,) の IDF
+    centroids: (C, V) のクラス重心（L2 正規化済み）
+    labels   : centroids の行に対応するラベル
+    """
+
+    def __init__(self, vocab: dict, idf, centroids, labels: Sequence[str], ngram: Tuple[int, int] = (1, 3)):
+        self.vocab = vocab
+        self.idf = idf
+        self.centroids = centroids
+        self.labels = list(labels)
+        self.ngram = ngram
+
+    # --- 特徴量 ---
+    def transform(self, texts: Sequence[str]):
+        """(N, V) の TF-IDF 行列（各行 L2 正規化、未知の n-gram は無視）。"""
+        X = np.zeros((len(texts), len(self.vocab)), dtype=np.float32)
+        rows, cols, vals = [], [], []
+        for r, t in enumerate(texts):
+            for g, c in char_ngrams(t, *self.ngram).items():
+                j = self.vocab.get(g)
+                if j is not None:
+                    rows.append(r); cols.append(j); vals.append(1.0 + math.log(c))
+        if rows:
+            X[rows, cols] = vals
+        X *= self.idf
+        norms = np.linalg.norm(X, axis=1, keepdims=True)
+        np.divide(X, norms, out=X, where=norms > 0)
+        return X
+
+    # --- 推論 ---
+    def predict_batch(self, texts: Sequence[str]) -> List[Tuple[str, float]]:
+        """
+        各文面の (ラベル, 確信度) を返す。
+        確信度は重心とのコサイン類似度を温度 TEMPERATURE で softmax したもの（0〜1）。
+        短い文面は類似度そのものが低く出るので、絶対値ではなく「他クラスとの差」で見る。
+        """
+        if not texts:
+            return []
+        sims = self.transform(texts) @ self.centroids.T
+        e = np.exp((sims - sims.max(axis=1, keepdims=True)) / TEMPERATURE)
+        probs = e / e.sum(axis=1, keepdims=True)
+        best = probs.argmax(axis=1)
+        return [(self.labels[k], float(probs[i, k])) for i, k in enumerate(best)]
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        return self.predict_batch([text])[0]
+
+    # --- 保存/読込 ---
+    def save(self, path) -> None:
+        vocab = sorted(self.vocab, key=self.vocab.get)
+        with open(path, "wb") as f:
+            np.savez_compressed(f, vocab=np.array(vocab), idf=self.idf, centroids=self.centroids,
+                                labels=np.array(self.labels), ngram=np.array(self.ngram))
+
+    @classmethod
+    def load(cls, path) -> "IntentModel":
+        with np.load(path, allow_pickle=False) as z:
+            vocab = {g: i for i, g in enumerate(z["vocab"].tolist())}
+            return cls(vocab, z["idf"], z["centroids"], z["labels"].tolist(), tuple(z["ngram"].tolist()))
+
+
+def train(samples: Iterable[Tuple[str, str]], ngram: Tuple[int, int] = (1, 3)) -> IntentModel:
+    """(文面, ラベル) の列から学習する。"""
+    if np is None:
+        raise RuntimeError("numpy が入っていないためモデルを学習できません（pip install numpy）")
+    samples = [(t, y) for t, y in samples if t and y in LABELS]
+    if not samples:
+        raise RuntimeError("学習データが空です")
+
+    grams = [char_ngrams(t, *ngram) for t, _ in samples]
+    df = Counter(g for c in grams for g in c)
+    vocab = {g: i for i, g in enumerate(sorted(df))}
+    n = len(samples)
+    idf = np.array([math.log((1 + n) / (1 + df[g])) + 1.0 for g in vocab], dtype=np.float32)
+
+    labels = [y for y in LABELS if any(s[1] == y for s in samples)]
+    model = IntentModel(vocab, idf, np.zeros((len(labels), len(vocab)), dtype=np.float32), labels, ngram)
+    X = model.transform([t for t, _ in samples])
+    y = np.array([labels.index(s[1]) for s in samples])
+    for k in range(len(labels)):
+        c = X[y == k].mean(axis=0)
+        model.centroids[k] = c / (np.linalg.norm(c) or 1.0)
+    return model
+
+
+def read_samples(path) -> List[Tuple[str, str]]:
+    out = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                out.append((row["text"], row["intent"]))
+    return out
+
+
+def load_model(path) -> Optional[IntentModel]:
+    """モデルファイルがあれば読む。numpy が無い / ファイルが無い場合は None。"""
+    if np is None or not path or not Path(path).exists():
+        return None
+    return IntentModel.load(path)
+
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="文字 n-gram 意図判定モデル")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    t = sub.add_parser("train", help="JSONL から学習して .npz に保存")
+    t.add_argument("samples")
+    t.add_argument("-o", "--output", default="intent_model.npz")
+    p = sub.add_parser("predict", help="文面を判定")
+    p.add_argument("model")
+    p.add_argument("texts", nargs="+")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "train":
+        samples = read_samples(args.samples)
+        train(samples).save(args.output)
+        print(f"saved: {args.output}（{len(samples)} 件）")
+    else:
+        model = IntentModel.load(args.model)
+        for text, (label, conf) in zip(args.texts, model.predict_batch(args.texts)):
+            print(f"{label:<9} {conf:.3f}  {text}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# llm_cache.py
+"""
+LLM フォールバック判定のキャッシュ（TTL + 件数上限）。
+
+Alexa からは同じあいまいな言い回しが何度も来るので、
+「正規化したテキスト + モデル名」をキーに判定結果を再利用して LLM の往復（~1秒）と費用を削る。
+保存先は cache_backend（既定はプロセス内の LRU、CACHE_BACKEND=sqlite なら全ワーカーで共有）。
+"""
+from __future__ import annotations
+import threading, time, unicodedata
+from typing import Optional
+
+from cache_backend import CacheBackend, MemoryCache, SQLiteCache
+
+
+def normalize_text(text: str) -> str:
+    """全角/半角・大文字小文字・空白の揺れを吸収する。"""
+    return " ".join(unicodedata.normalize("NFKC", text or "").casefold().split())
+
+
+def cache_key(text: str, model: str) -> str:
+    return f"{model}\x1f{normalize_text(text)}"
+
+
+class LLMCache:
+    """
+    maxsize: 持つ件数（超えたら捨てる）
+    ttl    : 1件の有効秒数
+    path   : SQLite ファイル。指定すると再起動後も残り、同じファイルを使う全ワーカーで共有される
+    backend: 保存先を直接渡す場合（指定すると maxsize / ttl / path は使わない）
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600, path: Optional[str] = None,
+                 timer=time.monotonic, backend: Optional[CacheBackend] = None):
+        if backend is None:
+            backend = (SQLiteCache(path, namespace="llm", maxsize=maxsize, ttl=ttl) if path
+                       else MemoryCache(maxsize=maxsize, ttl=ttl, timer=timer))
+        self.backend = backend
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[dict]:
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: dict) -> None:
+        self.backend.set(key, value)
+
+    def stats(self) -> dict:
+        size = len(self.backend)
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "size": size,
+                    "hit_rate": round(self.hits / total, 4) if total else 0.0}
+
+    def clear(self) -> None:
+        self.backend.clear()
+        with self._lock:
+            self.hits = self.misses = 0
@@ -0,0 +1,223 @@
+# metrics.py
+"""
+プロセス内の簡易メトリクス（カウンタ・ゲージ・ヒストグラム）と、リクエスト内の段階別タイミング。
+
+- inc / observe はスレッドからもイベントループからも呼ばれるので、更新は Lock で守る
+- /metrics では Prometheus のテキスト形式で全部を出す（render_prometheus）
+- timer("stage") で計った時間は、そのリクエストの Server-Timing ヘッダにも載る
+  （contextvars で「今のリクエスト」の記録先を持つ。asyncio.to_thread 先にも引き継がれる）
+"""
+from __future__ import annotations
+import bisect, contextvars, re, threading, time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+_lock = threading.Lock()
+
+LabelKey = Tuple[Tuple[str, str], ...]
+_counters: Dict[Tuple[str, LabelKey], float] = {}
+_gauges: Dict[Tuple[str, LabelKey], float] = {}
+_histograms: Dict[Tuple[str, LabelKey], "_Histogram"] = {}
+_help: Dict[str, str] = {}
+
+# 秒。LLM や Google の往復（~1秒）まで見える幅にしておく
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STAGE_METRIC = "intent_router_stage_seconds"
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # 最後は +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, v)] += 1
+        self.sum += v
+        self.count += 1
+
+
+def _key(labels: dict) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def describe(name: str, text: str) -> None:
+    """/metrics の # HELP 行。"""
+    _help[name] = text
+
+
+# ---- カウンタ ----
+def inc(name: str, n: float = 1, **labels) -> None:
+    k = (name, _key(labels))
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + n
+
+
+def get(name: str, **labels) -> float:
+    with _lock:
+        return _counters.get((name, _key(labels)), 0)
+
+
+def snapshot() -> Dict[str, float]:
+    """ラベルなしのカウンタだけ（/health 用）。"""
+    with _lock:
+        return {name: v for (name, labels), v in _counters.items() if not labels}
+
+
+# ---- ゲージ（待ち行列の長さなど、上下する値）----
+def set_gauge(name: str, value: float, **labels) -> None:
+    k = (name, _key(labels))
+    with _lock:
+        _gauges[k] = value
+
+
+def gauge(name: str, **labels) -> float:
+    with _lock:
+        return _gauges.get((name, _key(labels)), 0)
+
+
+# ---- ヒストグラム ----
+def observe(name: str, seconds: float, **labels) -> None:
+    k = (name, _key(labels))
+    with _lock:
+        h = _histograms.get(k)
+        if h is None:
+            h = _histograms[k] = _Histogram()
+        h.observe(seconds)
+
+
+def histogram_count(name: str, **labels) -> int:
+    with _lock:
+        h = _histograms.get((name, _key(labels)))
+        return h.count if h else 0
+
+
+# ---- 段階別タイミング（リクエスト単位）----
+_timings: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "metrics_timings", default=None)
+
+
+def begin_request() -> contextvars.Token:
+    """このリクエストの段階別タイミングの記録を始める（ミドルウェアから呼ぶ）。"""
+    return _timings.set([])
+
+
+def end_request(token: contextvars.Token) -> List[Tuple[str, float]]:
+    timings = _timings.get() or []
+    _timings.reset(token)
+    return timings
+
+
+@contextmanager
+def timer(stage: str, **labels) -> Iterator[dict]:
+    """
+    with timer("rule") as t:
+        res = classify(...)
+        t["intent"] = res.intent     # 計測後に付けたいラベルはここで足す
+    例外で抜けたら outcome=error、そうでなければ outcome=ok（明示指定があればそちら）。
+    """
+    lab = dict(labels)
+    start = time.perf_counter()
+    try:
+        yield lab
+    except BaseException:
+        lab.setdefault("outcome", "error")
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        lab.setdefault("outcome", "ok")
+        observe(STAGE_METRIC, elapsed, stage=stage, **lab)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def add_timings(timings: List[Tuple[str, float]]) -> None:
+    """別のタスクで測った段階別タイミングを、このリクエストの Server-Timing に足す（集計には足さない）。"""
+    current = _timings.get()
+    if current is not None:
+        current.extend(timings)
+
+
+def server_timing(timings: List[Tuple[str, float]]) -> str:
+    """Server-Timing ヘッダ値（同じ段階が複数回あれば合計）。"""
+    total: Dict[str, float] = {}
+    for stage, sec in timings:
+        total[stage] = total.get(stage, 0.0) + sec
+    return ", ".join(f"{_token(stage)};dur={sec * 1000:.2f}" for stage, sec in total.items())
+
+
+_TOKEN_RE = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def _token(s: str) -> str:
+    return _TOKEN_RE.sub("_", s)
+
+
+# ---- Prometheus テキスト形式 ----
+_NAME_RE = re.compile(r"[^a-zA-Z0-9_:]")
+
+
+def _labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = key + extra
+    if not items:
+        return ""
+    esc = lambda v: v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+
+def _fmt(v: float) -> str:
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+
+def render_prometheus() -> str:
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        hists = sorted(((k, (list(h.counts), h.sum, h.count)) for k, h in _histograms.items()))
+    lines: List[str] = []
+    seen = set()
+    for (name, labels), v in counters:
+        metric = _NAME_RE.sub("_", name)
+        metric = metric if metric.endswith("_total") else metric + "_total"
+        if metric not in seen:
+            seen.add(metric)
+            if name in _help:
+                lines.append(f"# HELP {metric} {_help[name]}")
+            lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric}{_labels(labels)} {_fmt(v)}")
+    for (name, labels), v in gauges:
+        metric = _NAME_RE.sub("_", name)
+        if metric not in seen:
+            seen.add(metric)
+            if name in _help:
+                lines.append(f"# HELP {metric} {_help[name]}")
+            lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric}{_labels(labels)} {_fmt(v)}")
+    for (name, labels), (counts, total, count) in hists:
+        metric = _NAME_RE.sub("_", name)
+        if metric not in seen:
+            seen.add(metric)
+            if name in _help:
+                lines.append(f"# HELP {metric} {_help[name]}")
+            lines.append(f"# TYPE {metric} histogram")
+        cum = 0
+        for le, c in zip((*map(str, BUCKETS), "+Inf"), counts):
+            cum += c
+            lines.append(f"{metric}_bucket{_labels(labels, (('le', le),))} {cum}")
+        lines.append(f"{metric}_sum{_labels(labels)} {total!r}")
+        lines.append(f"{metric}_count{_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+
+describe(STAGE_METRIC, "Time spent in each stage of intent routing / execution (seconds).")
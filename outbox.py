@@ -0,0 +1,308 @@
+# outbox.py
+"""
+上流（Calendar / Sheets）への書き込みの永続アウトボックス。
+
+/execute は判定した操作をまずローカルの SQLite（WAL）に確定させて 202 + job id を返し、
+上流への配送はバックグラウンドのワーカーが再試行つきで行う。
+Google に届かない間も依頼は消えず、復旧後に順に流れる。
+
+- ジョブは pending → running → done / failed。状態は GET /jobs/{id} で見える
+- running はリース（lease_sec）つき。ワーカーが落ちてもリース切れで別のワーカーが拾い直す
+  （同じ DB を複数プロセスで共有してよい。取り出しは BEGIN IMMEDIATE で排他）
+- 取り出すたびに claim（トークン）を振り、状態の更新は「running かつ自分の claim」の時だけ行う。
+  配送中はリースを延長し続けるので、遅い配送が別のワーカーに拾い直されることも、
+  拾い直された後に古いワーカーの結果で上書きすることもない
+- 再試行すべき失敗（429/5xx/通信エラー/ブレーカ open/レート制限/トークン更新の通信失敗）は
+  バックオフして pending に戻し、それ以外と max_attempts 超えは failed
+  （冪等でない書き込み（Sheets の append）は kind ごとに判定を変え、届いていないと分かる失敗だけ送り直す）
+- 積んだ時のテナントを一緒に保存し、配送はそのテナントの認証情報・書き込み先で行う
+"""
+from __future__ import annotations
+import asyncio, json, sqlite3, threading, time, uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from loguru import logger
+
+import metrics
+import retry_policy
+import tenant_store
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    tenant      TEXT,
+    payload     TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    next_at     REAL NOT NULL,
+    lease_until REAL,
+    claim       TEXT,
+    result      TEXT,
+    error       TEXT,
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, next_at);
+"""
+
+
+class Outbox:
+    """ジョブの保存と状態遷移（SQLite）。スレッドごとに接続を持つ。"""
+
+    def __init__(self, path: str, lease_sec: float = 60.0, timer: Callable[[], float] = time.time):
+        self.path = path
+        self.lease_sec = lease_sec
+        self._timer = timer
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def enqueue(self, kind: str, payload: Any, tenant: Optional[str] = None) -> str:
+        job_id = uuid.uuid4().hex
+        now = self._timer()
+        with self._tx() as conn:
+            conn.execute("INSERT INTO jobs (id, kind, tenant, payload, status, next_at, created_at, updated_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         (job_id, kind, tenant, json.dumps(payload, ensure_ascii=False), PENDING, now, now, now))
+        metrics.inc("outbox_enqueued", kind=kind)
+        return job_id
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """
+        配送可能なジョブを1件 running にして返す（リース切れの running も拾う）。無ければ None。
+        返り値の "claim" を complete / fail / retry_later / renew に渡す。
+        """
+        now = self._timer()
+        token = uuid.uuid4().hex
+        with self._tx() as conn:
+            row = conn.execute(
+                "SELECT id, kind, payload, attempts, tenant FROM jobs "
+                "WHERE (status = ? AND next_at <= ?) OR (status = ? AND lease_until < ?) "
+                "ORDER BY next_at LIMIT 1", (PENDING, now, RUNNING, now)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, claim = ?, "
+                         "updated_at = ? WHERE id = ?", (RUNNING, now + self.lease_sec, token, now, row[0]))
+        return {"id": row[0], "kind": row[1], "payload": json.loads(row[2]), "attempts": row[3] + 1,
+                "tenant": row[4], "claim": token}
+
+    # 以下の更新は、まだ自分がリースを持っている（running かつ claim が同じ）時だけ行い、行ったかを返す
+    def complete(self, job_id: str, claim: str, result: Any) -> bool:
+        return self._finish(job_id, claim, DONE, result=json.dumps(result, ensure_ascii=False, default=str))
+
+    def fail(self, job_id: str, claim: str, error: str) -> bool:
+        return self._finish(job_id, claim, FAILED, error=error)
+
+    def retry_later(self, job_id: str, claim: str, error: str, delay: float) -> bool:
+        now = self._timer()
+        with self._tx() as conn:
+            cur = conn.execute("UPDATE jobs SET status = ?, next_at = ?, lease_until = NULL, claim = NULL, error = ?, "
+                               "updated_at = ? WHERE id = ? AND status = ? AND claim = ?",
+                               (PENDING, now + delay, error, now, job_id, RUNNING, claim))
+            return cur.rowcount == 1
+
+    def renew(self, job_id: str, claim: str) -> bool:
+        """配送中のリースを延ばす。False ならもう自分のジョブではない（リース切れで拾い直された）。"""
+        now = self._timer()
+        with self._tx() as conn:
+            cur = conn.execute("UPDATE jobs SET lease_until = ?, updated_at = ? "
+                               "WHERE id = ? AND status = ? AND claim = ?",
+                               (now + self.lease_sec, now, job_id, RUNNING, claim))
+            return cur.rowcount == 1
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT id, kind, status, attempts, next_at, result, error, created_at, updated_at "
+            "FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(("id", "kind", "status", "attempts", "next_at", "result", "error",
+                        "created_at", "updated_at"), row))
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        if job["status"] != PENDING:
+            job.pop("next_at")
+        return job
+
+    def stats(self) -> Dict[str, int]:
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0, **dict(rows)}
+
+    def purge(self, older_than_sec: float) -> int:
+        """完了・失敗から older_than_sec 経ったジョブを消す。"""
+        with self._tx() as conn:
+            cur = conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                               (DONE, FAILED, self._timer() - older_than_sec))
+            return cur.rowcount
+
+    # ---- 内部処理 ----
+    def _finish(self, job_id: str, claim: str, status: str,
+                result: Optional[str] = None, error: Optional[str] = None) -> bool:
+        now = self._timer()
+        with self._tx() as conn:
+            cur = conn.execute("UPDATE jobs SET status = ?, result = ?, error = ?, lease_until = NULL, claim = NULL, "
+                               "updated_at = ? WHERE id = ? AND status = ? AND claim = ?",
+                               (status, result, error, now, job_id, RUNNING, claim))
+            return cur.rowcount == 1
+
+    def _tx(self):
+        return _Transaction(self._conn())
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            # WAL + synchronous=NORMAL：コミットは速く、電源断でも DB は壊れない（直近のコミットは失い得る）
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self._init_lock:
+                if not self._initialized:
+                    conn.executescript(_SCHEMA)
+                    # テナント列・claim 列が無い古い DB には足す（既存のジョブはテナント無し扱い。
+                    # claim の無い running はリース切れを待って拾い直される）
+                    cols = [r[1] for r in conn.execute("PRAGMA table_info(jobs)")]
+                    for col in ("tenant", "claim"):
+                        if col not in cols:
+                            conn.execute(f"ALTER TABLE jobs ADD COLUMN {col} TEXT")
+                    self._initialized = True
+            self._local.conn = conn
+        return conn
+
+
+class _Transaction:
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """後で送り直せば通る見込みのある失敗か。"""
+    from circuit_breaker import CircuitOpenError
+    from rate_limiter import RateLimitedError
+    return isinstance(exc, (CircuitOpenError, RateLimitedError)) or retry_policy.reason_of(exc) is not None
+
+
+def is_retryable_unsent(exc: BaseException) -> bool:
+    """冪等でない書き込み用：上流に届いていないと分かる失敗だけ送り直す（5xx・読み取りタイムアウトは送り直さない）。"""
+    from circuit_breaker import CircuitOpenError
+    from rate_limiter import RateLimitedError
+    return (isinstance(exc, (CircuitOpenError, RateLimitedError))
+            or retry_policy.reason_if_unsent(exc) is not None)
+
+
+class OutboxWorker:
+    """
+    handlers   : kind → async 関数（payload を受けて結果を返す）
+    concurrency: 同時に配送するジョブ数
+    retryable  : kind → 「送り直してよい失敗か」の判定（無い kind は is_retryable）
+    """
+
+    def __init__(self, outbox: Outbox, handlers: Dict[str, Callable[[Any], Awaitable[Any]]],
+                 concurrency: int = 4, poll_interval: float = 1.0, max_attempts: int = 20,
+                 backoff: Optional[retry_policy.RetryPolicy] = None,
+                 retryable: Optional[Dict[str, Callable[[BaseException], bool]]] = None):
+        self.outbox = outbox
+        self.handlers = handlers
+        self.retryable = dict(retryable or {})
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        # 配送の再試行間隔（呼び出し内の再試行より長い間隔で、上流の復旧を待つ）
+        self.backoff = backoff or retry_policy.RetryPolicy("outbox", base=1.0, cap=300.0)
+        self._tasks: List[asyncio.Task] = []
+        self._wake: Optional[asyncio.Event] = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+
+    async def stop(self) -> None:
+        """配送中のジョブはキャンセルする（リース切れ後に次の起動で拾い直される）。"""
+        tasks, self._tasks = self._tasks, []
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def notify(self) -> None:
+        """新しいジョブを積んだ（ポーリングを待たずに拾わせる）。"""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def run_once(self) -> bool:
+        """1件配送する。ジョブが無ければ False。"""
+        job = await asyncio.to_thread(self.outbox.claim)
+        if job is None:
+            return False
+        await self._deliver(job)
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await self.run_once():
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"outbox worker error: {e}")
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, job: Dict[str, Any]) -> None:
+        job_id, kind, claim = job["id"], job["kind"], job["claim"]
+        handler = self.handlers.get(kind)
+        if handler is None:
+            await self._settle(job, self.outbox.fail, job_id, claim, f"未知のジョブ種別です: {kind}")
+            return
+        keeper = asyncio.create_task(self._keep_lease(job))
+        try:
+            with metrics.timer("outbox_deliver", kind=kind), tenant_store.tenant(job.get("tenant")):
+                result = await handler(job["payload"])
+        except Exception as e:
+            if self.retryable.get(kind, is_retryable)(e) and job["attempts"] < self.max_attempts:
+                delay = self.backoff.backoff(job["attempts"] - 1, getattr(e, "retry_after", None)
+                                             or retry_policy.retry_after_of(e))
+                metrics.inc("outbox_retried", kind=kind)
+                logger.info(f"outbox job {job_id} ({kind}) retry in {delay:.1f}s: {e}")
+                await self._settle(job, self.outbox.retry_later, job_id, claim, str(e), delay)
+            else:
+                metrics.inc("outbox_failed", kind=kind)
+                logger.warning(f"outbox job {job_id} ({kind}) failed after {job['attempts']} attempts: {e}")
+                await self._settle(job, self.outbox.fail, job_id, claim, str(e))
+            return
+        finally:
+            keeper.cancel()
+        metrics.inc("outbox_delivered", kind=kind)
+        await self._settle(job, self.outbox.complete, job_id, claim, result)
+
+    async def _keep_lease(self, job: Dict[str, Any]) -> None:
+        """配送が終わるまで、リースの 1/3 ごとに延長する。"""
+        while True:
+            await asyncio.sleep(self.outbox.lease_sec / 3)
+            if not await asyncio.to_thread(self.outbox.renew, job["id"], job["claim"]):
+                metrics.inc("outbox_lease_lost", kind=job["kind"])
+                logger.warning(f"outbox job {job['id']} ({job['kind']}): lease lost while delivering")
+                return
+
+    async def _settle(self, job: Dict[str, Any], update: Callable[..., bool], *args) -> None:
+        # リースを失っていたら（別のワーカーが拾い直した）、そちらの状態を上書きしない
+        if not await asyncio.to_thread(update, *args):
+            metrics.inc("outbox_lease_lost", kind=job["kind"])
+            logger.warning(f"outbox job {job['id']} ({job['kind']}): lease lost, result not recorded")
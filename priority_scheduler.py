@@ -0,0 +1,221 @@
+# priority_scheduler.py
+"""
+上流（Calendar / Sheets / LINE WORKS）呼び出しの優先度つきスケジューラ。
+
+Alexa や /execute の対話的な依頼と、一括登録・バックフィルが同じ上流の同時実行枠を取り合うと、
+大量の一括処理が走っている間は音声の応答が遅くなる。
+呼び出しを優先度クラス（interactive / default / bulk）に分け、
+
+- 全体の同時実行数（max_concurrency）と、クラスごとの上限（cap）を守る
+- 空きが出たら重み（weight）に比例して各クラスに配る（start-time fair queuing）
+  → bulk が溜まっていても interactive は重みぶん先に通り、bulk の cap で枠を使い切らせない
+- クラスごとの待ち行列の長さ・実行中の数・待ち時間をメトリクスに出す
+
+クラスは priority("bulk") で contextvars に設定し、slot() / aslot() はそのクラスで枠を取る
+（asyncio.to_thread 先にも引き継がれる）。スレッドからもイベントループからも使える。
+"""
+from __future__ import annotations
+import asyncio, contextvars, os, threading, time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, Optional
+
+import metrics
+
+INTERACTIVE, DEFAULT, BULK = "interactive", "default", "bulk"
+
+
+@dataclass(frozen=True)
+class ClassConfig:
+    weight: float
+    cap: int
+
+
+class _Waiter:
+    __slots__ = ("cls", "grant", "granted", "enqueued")
+
+    def __init__(self, cls: str, grant: Callable[[], None]):
+        self.cls = cls
+        self.grant = grant
+        self.granted = False
+        self.enqueued = time.perf_counter()
+
+
+class PriorityScheduler:
+    def __init__(self, classes: Dict[str, ClassConfig], max_concurrency: int = 16):
+        self.classes = dict(classes)
+        self.max_concurrency = max_concurrency
+        self._lock = threading.Lock()
+        self._queues: Dict[str, Deque[_Waiter]] = {c: deque() for c in self.classes}
+        self._running: Dict[str, int] = {c: 0 for c in self.classes}
+        self._total = 0
+        # 仮想時刻：クラスごとの「次に配る時の開始時刻」と、直近に配った開始時刻
+        self._vtime: Dict[str, float] = {c: 0.0 for c in self.classes}
+        self._vclock = 0.0
+
+    # ---- 枠の取得・返却 ----
+    def acquire(self, cls: str) -> None:
+        """枠が取れるまでスレッドをブロックする。"""
+        ev = threading.Event()
+        w = self._enqueue(cls, ev.set)
+        if w is not None:
+            ev.wait()
+            self._observe_wait(w)
+
+    async def aacquire(self, cls: str) -> None:
+        loop = asyncio.get_running_loop()
+        fut: asyncio.Future = loop.create_future()
+
+        def grant():
+            loop.call_soon_threadsafe(lambda: fut.done() or fut.set_result(None))
+
+        w = self._enqueue(cls, grant)
+        if w is None:
+            return
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # 待っている間にキャンセルされた：もう枠が割り当て済みなら返し、まだなら行列から抜ける
+            with self._lock:
+                granted = w.granted
+                if not granted:
+                    self._queues[cls].remove(w)
+                    self._gauge(cls)
+            if granted:
+                self.release(cls)
+            raise
+        self._observe_wait(w)
+
+    def release(self, cls: str) -> None:
+        with self._lock:
+            self._running[cls] -= 1
+            self._total -= 1
+            granted = self._dispatch_locked()
+            self._gauge(cls)
+        for w in granted:
+            w.grant()
+
+    @contextmanager
+    def slot(self, cls: str) -> Iterator[None]:
+        self.acquire(cls)
+        try:
+            yield
+        finally:
+            self.release(cls)
+
+    @asynccontextmanager
+    async def aslot(self, cls: str) -> AsyncIterator[None]:
+        await self.aacquire(cls)
+        try:
+            yield
+        finally:
+            self.release(cls)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"max_concurrency": self.max_concurrency, "running": self._total,
+                    "classes": {c: {"queued": len(self._queues[c]), "running": self._running[c],
+                                    "cap": cfg.cap, "weight": cfg.weight}
+                                for c, cfg in self.classes.items()}}
+
+    # ---- 内部処理 ----
+    def _enqueue(self, cls: str, grant: Callable[[], None]) -> Optional[_Waiter]:
+        """すぐ取れたら None、待つ必要があれば行列に入れた _Waiter を返す。"""
+        if cls not in self.classes:
+            raise ValueError(f"未知の優先度クラスです: {cls}")
+        w = _Waiter(cls, grant)
+        with self._lock:
+            self._queues[cls].append(w)
+            granted = self._dispatch_locked()
+            self._gauge(cls)
+        others = [g for g in granted if g is not w]
+        for g in others:
+            g.grant()
+        if w in granted:
+            metrics.observe("scheduler_wait_seconds", 0.0, **{"class": cls})
+            return None
+        return w
+
+    def _dispatch_locked(self) -> list:
+        granted = []
+        while self._total < self.max_concurrency:
+            ready = [c for c, q in self._queues.items() if q and self._running[c] < self.classes[c].cap]
+            if not ready:
+                break
+            # 開始時刻が最も早いクラスから。しばらく空いていたクラスは今の時刻から始める（貯金させない）
+            cls = min(ready, key=lambda c: max(self._vtime[c], self._vclock))
+            start = max(self._vtime[cls], self._vclock)
+            self._vtime[cls] = start + 1.0 / self.classes[cls].weight
+            self._vclock = start
+            w = self._queues[cls].popleft()
+            w.granted = True
+            self._running[cls] += 1
+            self._total += 1
+            granted.append(w)
+            metrics.inc("scheduler_started", **{"class": cls})
+        return granted
+
+    def _gauge(self, cls: str) -> None:
+        metrics.set_gauge("scheduler_queue_depth", len(self._queues[cls]), **{"class": cls})
+        metrics.set_gauge("scheduler_running", self._running[cls], **{"class": cls})
+
+    def _observe_wait(self, w: _Waiter) -> None:
+        metrics.observe("scheduler_wait_seconds", time.perf_counter() - w.enqueued, **{"class": w.cls})
+
+
+# ---- プロセス共有のスケジューラと、今のクラス ----
+_current: contextvars.ContextVar[str] = contextvars.ContextVar("priority_class", default=DEFAULT)
+
+
+def from_env() -> Optional[PriorityScheduler]:
+    """UPSTREAM_SCHEDULER_ENABLED=false なら None（枠を取らずに素通し）。"""
+    if os.getenv("UPSTREAM_SCHEDULER_ENABLED", "true").lower() != "true":
+        return None
+    total = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "16"))
+    defaults = {INTERACTIVE: (8, total), DEFAULT: (4, total), BULK: (1, max(1, total // 4))}
+    classes = {}
+    for cls, (weight, cap) in defaults.items():
+        classes[cls] = ClassConfig(
+            weight=float(os.getenv(f"UPSTREAM_{cls.upper()}_WEIGHT", weight)),
+            cap=int(os.getenv(f"UPSTREAM_{cls.upper()}_CAP", cap)))
+    return PriorityScheduler(classes, total)
+
+
+scheduler = from_env()
+
+
+def current() -> str:
+    return _current.get()
+
+
+@contextmanager
+def priority(cls: str) -> Iterator[None]:
+    """この with の中（と、そこから呼ぶ to_thread 先）の上流呼び出しを cls クラスで行う。"""
+    token = _current.set(cls)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def slot() -> Iterator[None]:
+    if scheduler is None:
+        yield
+        return
+    with scheduler.slot(current()):
+        yield
+
+
+@asynccontextmanager
+async def aslot() -> AsyncIterator[None]:
+    if scheduler is None:
+        yield
+        return
+    async with scheduler.aslot(current()):
+        yield
+
+
+def stats() -> Optional[Dict[str, Any]]:
+    return scheduler.stats() if scheduler is not None else None
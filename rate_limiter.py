@@ -0,0 +1,213 @@
+# rate_limiter.py
+"""
+Google API 呼び出しのクライアント側レート制限（API × 認証情報ごとのトークンバケット）。
+
+Google のクォータは「ユーザー（認証情報）ごと・1分あたり」なので、到着順にそのまま投げると
+バーストで 429 をもらい、その往復と再試行が無駄になる。
+uvicorn を複数ワーカーで動かすと1プロセスからは合計レートが見えないため、
+バケットの状態はローカルの SQLite ファイルに置き、BEGIN IMMEDIATE（ファイルロック）で
+全ワーカーが1つの予算を共有する。
+
+- トークンが足りなければ、max_wait 秒以内に補充される分は「前借り」して待つ
+- それ以上待つ必要があるなら待たずに RateLimitedError（呼び出し側で 503 + Retry-After）
+- 前借りするのは interactive（音声・/execute）の呼び出しだけ。それ以外（一括登録・アウトボックスなど）は
+  前借りせず、interactive 用の取り置き（Limit.reserve）を残して今あるぶんだけを burst 以下に分けて取る
+  （一括登録が先の分まで予約して、後から来た対話的な呼び出しが待たされる・弾かれることがない）
+- 時刻はプロセス間で共有できる time.time()（壁時計）を使う
+"""
+from __future__ import annotations
+import asyncio, hashlib, os, sqlite3, tempfile, threading, time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, Optional
+
+from loguru import logger
+
+import metrics
+
+
+class RateLimitedError(RuntimeError):
+    """レート制限の予算切れ。retry_after 秒後なら通る見込み。"""
+
+    def __init__(self, api: str, retry_after: float):
+        super().__init__(f"{api} の呼び出しが上限に達しています（{retry_after:.1f}秒後に再試行）")
+        self.api = api
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class Limit:
+    rate: float          # 1秒あたりの補充数
+    burst: float         # 最大保持数
+    reserve: float = 0.0  # interactive だけが使える取り置き（それ以外はこれを残して取る）
+
+
+# Google の既定クォータ（Sheets: 60 書込/分/ユーザー、Calendar: 600 /分/ユーザー）より少し控えめ
+DEFAULT_LIMITS = {"calendar": Limit(rate=5.0, burst=10.0, reserve=3.0), "sheets": Limit(rate=0.9, burst=5.0, reserve=2.0)}
+
+
+class RateLimiter:
+    """
+    path     : 共有する SQLite ファイル（全ワーカーで同じパスを指定する）
+    limits   : API 名 → Limit（無い API は制限しない）
+    max_wait : これ以内の待ちなら待つ。超えるなら RateLimitedError
+    """
+
+    def __init__(self, path: str, limits: Dict[str, Limit], max_wait: float = 2.0,
+                 timer: Callable[[], float] = time.time, sleep: Callable[[float], None] = time.sleep):
+        self.path = path
+        self.limits = dict(limits)
+        self.max_wait = max_wait
+        self._timer = timer
+        self._sleep = sleep
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    # ---- 呼び出し側 ----
+    def reserve(self, api: str, credential: str, n: int = 1, max_wait: Optional[float] = None) -> float:
+        """
+        n トークン予約して、待つべき秒数を返す（0 ならすぐ呼んでよい）。
+        待ちが max_wait（省略時は self.max_wait）を超えるなら予約せず RateLimitedError。
+        """
+        limit = self.limits.get(api)
+        if limit is None:
+            return 0.0
+        max_wait = self.max_wait if max_wait is None else max_wait
+        key = f"{api}:{credential}"
+        conn = self._conn()
+        now = self._timer()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            tokens = self._refilled(conn, key, limit, now) - n
+            wait = 0.0 if tokens >= 0 else -tokens / limit.rate
+            if wait > max_wait:
+                conn.execute("ROLLBACK")
+                metrics.inc("rate_limited", api=api)
+                raise RateLimitedError(api, wait - max_wait)
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                         (key, tokens, now))
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        if wait > 0:
+            metrics.observe("rate_limit_wait_seconds", wait, api=api)
+        return wait
+
+    def acquire(self, api: str, credential: str, n: int = 1, max_wait: Optional[float] = None,
+                interactive: bool = True) -> None:
+        """n トークン取れるまで待つ。interactive=False なら前借りせず、取り置きを残して少しずつ取る。"""
+        if interactive:
+            waits: Iterator[float] = iter([self.reserve(api, credential, n, max_wait)])
+        else:
+            waits = self._pieces(api, credential, n, max_wait)
+        for wait in waits:
+            if wait > 0:
+                self._sleep(wait)
+
+    async def aacquire(self, api: str, credential: str, n: int = 1, max_wait: Optional[float] = None,
+                       interactive: bool = True) -> None:
+        # BEGIN IMMEDIATE は他のワーカーがロックを持っていると最大 5 秒（busy timeout）待つので、
+        # SQLite の更新はスレッドで行い、イベントループは止めない（待ちは asyncio.sleep）
+        if interactive:
+            waits: Iterator[float] = iter([await asyncio.to_thread(self.reserve, api, credential, n, max_wait)])
+        else:
+            waits = self._pieces(api, credential, n, max_wait)
+        while True:
+            wait = await asyncio.to_thread(next, waits, None)  # _pieces は1個進めるごとに SQLite を更新する
+            if wait is None:
+                return
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+    def reset(self) -> None:
+        self._conn().execute("DELETE FROM buckets")
+
+    # ---- 内部処理 ----
+    def _pieces(self, api: str, credential: str, n: int, max_wait: Optional[float]) -> Iterator[float]:
+        """
+        前借りしない取り方。limit.reserve を残して今あるぶんを burst 以下のかたまりで取り、
+        足りなければ補充されるまでの秒数を返す（呼び出し側が待ってから続きを取る）。
+        max_wait 秒以内に n 個そろわなければ RateLimitedError（それまでに取った分は戻さない）。
+        """
+        limit = self.limits.get(api)
+        if limit is None:
+            return
+        if limit.burst < 1:  # 取り置きを残して1個も持てない設定は前借りで取るしかない
+            yield self.reserve(api, credential, n, max_wait)
+            return
+        floor = min(limit.reserve, limit.burst - 1)
+        piece_max = int(limit.burst - floor)
+        deadline = self._timer() + (self.max_wait if max_wait is None else max_wait)
+        left = n
+        while left > 0:
+            piece = min(left, piece_max)
+            wait = self._take(api, credential, piece, floor)
+            if wait == 0:
+                left -= piece
+                continue
+            if self._timer() + wait > deadline:
+                metrics.inc("rate_limited", api=api)
+                raise RateLimitedError(api, wait)
+            metrics.observe("rate_limit_wait_seconds", wait, api=api)
+            yield wait
+
+    def _take(self, api: str, credential: str, n: int, floor: float) -> float:
+        """floor 個を残して n 個取れるなら取って 0、取れないなら取らずに、取れるまでの秒数。"""
+        limit = self.limits[api]
+        key = f"{api}:{credential}"
+        conn = self._conn()
+        now = self._timer()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            tokens = self._refilled(conn, key, limit, now)
+            if tokens - n < floor - 1e-9:  # 待った直後の補充が丸め誤差で僅かに足りないことがある
+                conn.execute("ROLLBACK")
+                return (floor + n - tokens) / limit.rate
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                         (key, tokens - n, now))
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        return 0.0
+
+    def _refilled(self, conn: sqlite3.Connection, key: str, limit: Limit, now: float) -> float:
+        row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+        tokens, updated = row if row else (limit.burst, now)
+        return min(limit.burst, tokens + max(0.0, now - updated) * limit.rate)
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 の接続はスレッドをまたげないのでスレッドごとに持つ
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute("CREATE TABLE IF NOT EXISTS buckets "
+                                 "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+                    self._initialized = True
+            self._local.conn = conn
+        return conn
+
+
+def credential_key(value: str) -> str:
+    """認証情報を表す文字列（トークンファイルのパス等）を、DB に残しても差し支えない短いハッシュにする。"""
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()[:16]
+
+
+def from_env() -> Optional[RateLimiter]:
+    """GOOGLE_RATE_LIMIT_ENABLED=false なら None。"""
+    if os.getenv("GOOGLE_RATE_LIMIT_ENABLED", "true").lower() != "true":
+        return None
+    limits = {}
+    for api, default in DEFAULT_LIMITS.items():
+        rate = float(os.getenv(f"GOOGLE_RATE_LIMIT_{api.upper()}_PER_SEC", default.rate))
+        burst = float(os.getenv(f"GOOGLE_RATE_LIMIT_{api.upper()}_BURST", default.burst))
+        reserve = float(os.getenv(f"GOOGLE_RATE_LIMIT_{api.upper()}_RESERVE", default.reserve))
+        if rate > 0:
+            limits[api] = Limit(rate, burst, reserve)
+    path = os.getenv("GOOGLE_RATE_LIMIT_PATH") or os.path.join(tempfile.gettempdir(), "google_rate_limit.sqlite3")
+    logger.info(f"Google API rate limiter: {path} {limits}")
+    return RateLimiter(path, limits, max_wait=float(os.getenv("GOOGLE_RATE_LIMIT_MAX_WAIT_SEC", "2")))
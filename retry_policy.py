@@ -0,0 +1,256 @@
+# retry_policy.py
+"""
+上流呼び出し（Google / OAuth / OpenAI / LINE WORKS）共通の再試行ポリシー。
+
+- 例外から HTTP ステータスを取り出して判定する（文字列の部分一致は使わない）
+  googleapiclient.errors.HttpError(resp.status) / google_async.GoogleAPIError(status) /
+  httpx.HTTPStatusError(response.status_code) / openai.APIStatusError(status_code)
+- 再試行するのは 408/429/5xx と通信エラー（接続失敗・タイムアウト）だけ。その他の 4xx は即座に投げ直す
+- 冪等でない書き込み（Sheets の append など）は classify=reason_if_unsent で
+  「リクエストが上流に届いていないと分かる失敗」（429・接続失敗）だけを再試行する
+  （5xx や読み取りタイムアウトは書き込みが済んでいることがあり、送り直すと二重になる）
+- 待ち時間は指数バックオフ + full jitter（uniform(0, min(cap, base * 2^n))）
+- Retry-After があればそれ以上待つ。ただし呼び出し全体の予算（budget 秒）を超える待ちはせず諦める
+- 諦めたときは最後の例外をそのまま投げる（呼び出し側のステータス別エラー処理がそのまま使える）
+- breaker があれば1回ごとの試行をサーキットブレーカに通す（open なら CircuitOpenError で即失敗、再試行しない）
+- call_guarded / acall_guarded の guard（レート制限・同時実行枠の取得）はブレーカの外で試行ごとに入る
+"""
+from __future__ import annotations
+import asyncio, os, random, time
+from contextlib import nullcontext
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Any, AsyncContextManager, Awaitable, Callable, ContextManager, Optional, TypeVar
+
+from loguru import logger
+
+import circuit_breaker
+import metrics
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+
+# ---- 例外の分類 ----
+def status_of(exc: BaseException) -> Optional[int]:
+    """例外が持っている HTTP ステータス（無ければ None）。"""
+    resp = getattr(exc, "resp", None)          # googleapiclient.errors.HttpError
+    if resp is not None and getattr(resp, "status", None) is not None:
+        return int(resp.status)
+    for attr in ("status", "status_code"):     # GoogleAPIError / openai.APIStatusError
+        v = getattr(exc, attr, None)
+        if isinstance(v, int):
+            return v
+    response = getattr(exc, "response", None)  # httpx.HTTPStatusError
+    v = getattr(response, "status_code", None)
+    return v if isinstance(v, int) else None
+
+
+def _headers_of(exc: BaseException):
+    for h in (getattr(exc, "headers", None),
+              getattr(getattr(exc, "response", None), "headers", None),
+              getattr(exc, "resp", None)):      # httplib2.Response は dict（キーは小文字）
+        if h:
+            return h
+    return None
+
+
+def retry_after_of(exc: BaseException, now: Optional[datetime] = None) -> Optional[float]:
+    """Retry-After（秒数 or HTTP-date）を秒で返す。"""
+    headers = _headers_of(exc)
+    if headers is None:
+        return None
+    try:
+        v = headers.get("retry-after") or headers.get("Retry-After")
+    except AttributeError:
+        return None
+    if not v:
+        return None
+    v = str(v).strip()
+    try:
+        return max(0.0, float(v))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(v)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - (now or datetime.now(timezone.utc))).total_seconds())
+
+
+def _is_transport_error(exc: BaseException) -> bool:
+    import httpx
+    if isinstance(exc, (httpx.TransportError, ConnectionError, TimeoutError)):
+        return True
+    # google-auth / httplib2 / openai の通信エラー（未インストールなら無視）
+    try:
+        from google.auth.exceptions import TransportError as AuthTransportError
+        if isinstance(exc, AuthTransportError):
+            return True
+    except ImportError:
+        pass
+    try:
+        import httplib2
+        if isinstance(exc, httplib2.HttpLib2Error):
+            return True
+    except ImportError:
+        pass
+    try:
+        import openai
+        if isinstance(exc, openai.APIConnectionError):  # APITimeoutError もこの派生
+            return True
+    except ImportError:
+        pass
+    return False
+
+
+def _is_connect_error(exc: BaseException) -> bool:
+    """送信前に失敗した（上流はリクエストを受け取っていない）と分かる通信エラー。"""
+    import httpx
+    if isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, ConnectionRefusedError)):
+        return True
+    try:
+        # アクセストークンの取得で失敗（本体のリクエストはまだ送っていない）
+        from google.auth.exceptions import TransportError as AuthTransportError
+        if isinstance(exc, AuthTransportError):
+            return True
+    except ImportError:
+        pass
+    try:
+        import httplib2
+        if isinstance(exc, httplib2.ServerNotFoundError):
+            return True
+    except ImportError:
+        pass
+    return False
+
+
+def reason_of(exc: BaseException) -> Optional[str]:
+    """再試行すべきならその理由（"429" / "503" / "transport"）、すべきでなければ None。"""
+    status = status_of(exc)
+    if status is not None:
+        return str(status) if status in RETRYABLE_STATUS else None
+    # RefreshError などは retryable 属性で自己申告する
+    if getattr(exc, "retryable", False) is True:
+        return "retryable"
+    return "transport" if _is_transport_error(exc) else None
+
+
+def reason_if_unsent(exc: BaseException) -> Optional[str]:
+    """冪等でない書き込み用の reason_of。上流に届いていないと分かる失敗だけ理由を返す。"""
+    status = status_of(exc)
+    if status is not None:
+        return "429" if status == 429 else None
+    if getattr(exc, "retryable", False) is True:  # トークン更新の失敗など（本体は未送信）
+        return "retryable"
+    return "connect" if _is_connect_error(exc) else None
+
+
+# ---- ポリシー ----
+@dataclass
+class RetryPolicy:
+    """
+    name        : メトリクスのラベル（calendar / sheets / oauth / openai / lineworks）
+    max_attempts: 初回を含む試行回数の上限
+    base / cap  : バックオフの基準秒と上限秒
+    budget      : 初回開始からの合計秒数の上限（これを超える待ちはしない）
+    breaker     : 上流のサーキットブレーカ（None なら通さない）
+    classify    : 例外 → 再試行の理由（None なら再試行しない）。既定は reason_of
+    """
+    name: str
+    max_attempts: int = 4
+    base: float = 0.2
+    cap: float = 5.0
+    budget: float = 10.0
+    rand: Callable[[], float] = random.random
+    timer: Callable[[], float] = time.monotonic
+    sleep: Callable[[float], Any] = time.sleep
+    asleep: Callable[[float], Awaitable[Any]] = asyncio.sleep
+    breaker: Optional[circuit_breaker.CircuitBreaker] = None
+    classify: Callable[[BaseException], Optional[str]] = reason_of
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """attempt 回目（0始まり）の失敗後に待つ秒数。"""
+        delay = self.rand() * min(self.cap, self.base * 2 ** attempt)
+        return max(delay, retry_after) if retry_after is not None else delay
+
+    def next_delay(self, exc: BaseException, attempt: int, started: float) -> Optional[float]:
+        """再試行するなら待つ秒数、諦めるなら None（メトリクスとログもここで）。"""
+        reason = self.classify(exc)
+        if reason is None:
+            return None
+        if attempt + 1 >= self.max_attempts:
+            metrics.inc("upstream_retry_exhausted", api=self.name, reason="attempts")
+            return None
+        delay = self.backoff(attempt, retry_after_of(exc))
+        if self.timer() - started + delay > self.budget:
+            metrics.inc("upstream_retry_exhausted", api=self.name, reason="budget")
+            return None
+        metrics.inc("upstream_retries", api=self.name, reason=reason)
+        logger.info(f"{self.name}: retry {attempt + 1}/{self.max_attempts - 1} in {delay:.2f}s ({reason}: {exc})")
+        return delay
+
+    def call(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        return self.call_guarded(None, fn, *args, **kwargs)
+
+    async def acall(self, fn: Callable[..., Awaitable[T]], *args, **kwargs) -> T:
+        return await self.acall_guarded(None, fn, *args, **kwargs)
+
+    def call_guarded(self, guard: Optional[Callable[[], ContextManager[Any]]],
+                     fn: Callable[..., T], *args, **kwargs) -> T:
+        """
+        試行ごとに guard() の中で fn を呼ぶ。guard はサーキットブレーカの外側なので、
+        レート制限や同時実行枠の待ちは遅い呼び出しとして数えられない（ブレーカが測るのは fn だけ）。
+        """
+        started = self.timer()
+        attempt = 0
+        while True:
+            try:
+                with guard() if guard is not None else nullcontext():
+                    if self.breaker is not None:
+                        return self.breaker.call(fn, *args, **kwargs)
+                    return fn(*args, **kwargs)
+            except Exception as e:
+                delay = self.next_delay(e, attempt, started)
+                if delay is None:
+                    raise
+            self.sleep(delay)
+            attempt += 1
+
+    async def acall_guarded(self, guard: Optional[Callable[[], AsyncContextManager[Any]]],
+                            fn: Callable[..., Awaitable[T]], *args, **kwargs) -> T:
+        started = self.timer()
+        attempt = 0
+        while True:
+            try:
+                async with guard() if guard is not None else nullcontext():
+                    if self.breaker is not None:
+                        return await self.breaker.acall(fn, *args, **kwargs)
+                    return await fn(*args, **kwargs)
+            except Exception as e:
+                delay = self.next_delay(e, attempt, started)
+                if delay is None:
+                    raise
+            await self.asleep(delay)
+            attempt += 1
+
+_ENV_FIELDS = (("MAX_ATTEMPTS", "max_attempts", int), ("BASE_SEC", "base", float),
+               ("CAP_SEC", "cap", float), ("BUDGET_SEC", "budget", float))
+
+
+def from_env(name: str, **defaults) -> RetryPolicy:
+    """
+    RETRY_<NAME>_* があればそれを、無ければ RETRY_* 共通値、それも無ければ defaults / 既定値。
+    同じ名前のサーキットブレーカも付ける。
+    """
+    kwargs = dict(defaults)
+    kwargs.setdefault("breaker", circuit_breaker.get(name))
+    for env, field, cast in _ENV_FIELDS:
+        v = os.getenv(f"RETRY_{name.upper()}_{env}") or os.getenv(f"RETRY_{env}")
+        if v:
+            kwargs[field] = cast(v)
+    return RetryPolicy(name=name, **kwargs)
@@ -2,8 +2,8 @@
 from __future__ import annotations
 import os, json, datetime as dt
 from typing import Any, List
-from app_intent_mvp import create_calendar_event, append_sheets, get_google_creds
-from googleapiclient.discovery import build
+from app_intent_mvp import create_calendar_event, append_sheets, get_google_creds, CALENDAR_RETRY, SHEETS_RETRY
+import google_services
 
 def jprint(tag: str, obj: Any):
     if os.getenv("LOG_PAYLOAD", "1") == "1":
@@ -18,20 +18,20 @@ def iso_jst(ts: dt.datetime) -> str:
     return ts.strftime("%Y-%m-%dT%H:%M:%S+09:00")
 
 def calendar_service():
-    return build("calendar", "v3", credentials=get_google_creds())
+    return google_services.calendar_service(get_google_creds())
 
 def sheets_service():
-    return build("sheets", "v4", credentials=get_google_creds())
+    return google_services.sheets_service(get_google_creds())
 
 def verify_calendar(event_id: str, calendar_id: str = "primary") -> dict:
     svc = calendar_service()
-    got = svc.events().get(calendarId=calendar_id, eventId=event_id).execute()
+    got = CALENDAR_RETRY.call(svc.events().get(calendarId=calendar_id, eventId=event_id).execute)
     jprint("CalendarVerification.get", got)
     return got
 
 def tail_sheet(spreadsheet_id: str, rng: str = "Sheet1!A:Z", tail: int = 5) -> List[list]:
     svc = sheets_service()
-    vr = svc.spreadsheets().values().get(spreadsheetId=spreadsheet_id, range=rng).execute()
+    vr = SHEETS_RETRY.call(svc.spreadsheets().values().get(spreadsheetId=spreadsheet_id, range=rng).execute)
     values = vr.get("values", [])
     tail_rows = values[-tail:] if values else []
     jprint("SheetsVerification.tail", tail_rows)
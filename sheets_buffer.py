@@ -0,0 +1,107 @@
+# sheets_buffer.py
+"""
+Sheets 追記の write-behind バッファ。
+
+同時に来たメモ行を溜めておき、行数 or 待ち時間のしきい値で
+1回の spreadsheets.values.append にまとめて流す。
+呼び出し側は Future を受け取り、自分の行の結果だけを受け取れる。
+"""
+from __future__ import annotations
+import re, threading, time
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Tuple
+from loguru import logger
+
+# "Sheet1!A10:C12" / "'シート 1'!A10:C12" 形式
+_RANGE_RE = re.compile(r"^(?P<sheet>.+)!(?P<c1>[A-Z]+)(?P<r1>\d+)(?::(?P<c2>[A-Z]+)(?P<r2>\d+))?$")
+
+
+def _slice_range(updated_range: Optional[str], offset: int, n: int) -> Optional[str]:
+    """まとめて追記した範囲から offset 行目以降 n 行ぶんの範囲を切り出す。"""
+    m = _RANGE_RE.match(updated_range or "")
+    if not m or n <= 0:
+        return None
+    start = int(m.group("r1")) + offset
+    c2 = m.group("c2") or m.group("c1")
+    return f"{m.group('sheet')}!{m.group('c1')}{start}:{c2}{start + n - 1}"
+
+
+class SheetsAppendBuffer:
+    """
+    flush_fn : rows(2次元配列) を1回で追記し {"updated": n, "range": "..."} を返す関数
+    max_rows : この行数が溜まったら即フラッシュ
+    max_delay: 最初の行が来てからこの秒数でフラッシュ
+    """
+
+    def __init__(self, flush_fn: Callable[[List[list]], dict],
+                 max_rows: int = 50, max_delay: float = 0.2):
+        self._flush_fn = flush_fn
+        self._max_rows = max_rows
+        self._max_delay = max_delay
+        self._cond = threading.Condition()
+        self._pending: List[Tuple[List[list], Future]] = []
+        self._rows = 0
+        self._deadline = 0.0
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, values: List[list]) -> Future:
+        fut: Future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Sheets 追記バッファは停止済みです")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sheets-buffer", daemon=True)
+                self._thread.start()
+            if not self._pending:
+                self._deadline = time.monotonic() + self._max_delay
+            self._pending.append((values, fut))
+            self._rows += len(values)
+            self._cond.notify()
+        return fut
+
+    def close(self, timeout: Optional[float] = 10.0) -> None:
+        """受付を止め、溜まっている行をフラッシュしてから戻る。"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    # ---- 内部処理 ----
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return  # closed かつ空
+                while self._rows < self._max_rows and not self._closed:
+                    remaining = self._deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending, self._rows = self._pending, [], 0
+            self._flush(batch)
+
+    def _flush(self, batch: List[Tuple[List[list], Future]]) -> None:
+        rows = [row for values, _ in batch for row in values]
+        try:
+            res = self._flush_fn(rows)
+        except Exception as e:
+            logger.warning(f"Sheets batch append failed ({len(rows)} rows): {e}")
+            for _, fut in batch:
+                fut.set_exception(e)
+            return
+
+        logger.info(f"Sheets batch append: {len(batch)} requests / {len(rows)} rows")
+        offset = 0
+        for values, fut in batch:
+            fut.set_result({
+                "ok": True,
+                "updated": sum(len(r) for r in values),
+                "range": _slice_range(res.get("range"), offset, len(values)),
+                "batched": len(batch),
+            })
+            offset += len(values)
@@ -0,0 +1,60 @@
+# single_flight.py
+"""
+同じキーの同時実行を1回にまとめる（single-flight / request coalescing）。
+
+Alexa / Lambda は再送や複数デバイスから同じ発話を数ミリ秒差で送ってくる。
+キャッシュに結果が入る前に重なった分は、それぞれがルール判定と LLM 呼び出しを行ってしまう。
+実行中のキーに来た呼び出しは新しく実行せず、先行する実行の結果（例外も）を一緒に受け取る。
+
+- 実行は別タスクで行うので、先行したリクエストが切断されても後続の待ちは巻き込まれない
+- 完了したら即座に忘れる（結果の再利用はキャッシュの役目）
+- まとめた回数は singleflight_coalesced{op} に出る
+- 共有した実行の段階別タイミング（metrics.timer）は、起動したリクエストだけでなく待っていた全員の
+  Server-Timing に載る（集計のヒストグラムには1回だけ）
+"""
+from __future__ import annotations
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+import metrics
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Any, Tuple[asyncio.AbstractEventLoop, asyncio.Task]] = {}
+
+    async def do(self, key: Any, fn: Callable[[], Awaitable[Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        hit = self._inflight.get(key)
+        if hit is not None and hit[0] is loop and not hit[1].done():
+            metrics.inc("singleflight_coalesced", op=self.name)
+            task = hit[1]
+        else:
+            task = loop.create_task(self._run(fn))
+            self._inflight[key] = (loop, task)
+            task.add_done_callback(lambda t, key=key: self._forget(key, t))
+        # shield：待っている側がキャンセルされても、共有している実行は止めない
+        result, timings = await asyncio.shield(task)
+        metrics.add_timings(timings)
+        return result
+
+    @staticmethod
+    async def _run(fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, List[Tuple[str, float]]]:
+        # タスクは起動したリクエストの contextvars を引き継ぐので、タイミングは別に取って全員に返す
+        token = metrics.begin_request()
+        try:
+            result = await fn()
+        finally:
+            timings = metrics.end_request(token)
+        return result, timings
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    def _forget(self, key: Any, task: asyncio.Task) -> None:
+        hit = self._inflight.get(key)
+        if hit is not None and hit[1] is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # 誰も待っていなくても "exception was never retrieved" を出さない
@@ -0,0 +1,281 @@
+# tenant_store.py
+"""
+テナント（利用者）ごとの OAuth トークンと設定の保存先と、使える状態の Credentials の LRU。
+
+1つのデプロイで多数の利用者のカレンダー / シートを扱うため、
+トークンは SQLite（GOOGLE_TOKEN_STORE_PATH）にテナント単位で置く。
+GOOGLE_TOKEN_STORE_KEY（Fernet キー）があれば暗号化して保存する。
+
+- メモリには最近使ったテナントの CredsCache だけを持つ（件数上限つき LRU）
+  → 数千テナントでもメモリは一定、よく使うテナントは refresh もディスク読込もしない
+- refresh はテナントごとに single-flight（CredsCache の仕組みをそのまま使う）
+- 今どのテナントの依頼かは tenant("...") で contextvars に設定する（asyncio.to_thread 先にも引き継がれる）
+- テナント未指定（None）は従来どおり GOOGLE_OAUTH_TOKEN_PATH の単一トークン
+- X-Tenant-Id は名乗るだけなので、テナントごとの API キー（X-Tenant-Key）で本人確認する。
+  保存するのはキーの SHA-256 だけ（キーは token_setup.py --tenant が発行時に1回だけ表示する）
+- 設定とキーのハッシュも LRU のエントリに持ち（settings_ttl 秒で読み直す）、よく使うテナントはディスクを読まない。
+  読み直した時にトークンが書き換わっていれば（token_setup.py での再発行）Credentials も読み直す
+"""
+from __future__ import annotations
+import contextvars, hashlib, hmac, json, os, secrets, sqlite3, threading, time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from loguru import logger
+
+import metrics
+from creds_cache import CredsCache
+
+
+class TokenStore:
+    """テナント → (トークン JSON, 設定 JSON)。key があればトークンを Fernet で暗号化する。"""
+
+    def __init__(self, path: str, key: Optional[str] = None):
+        self.path = path
+        self._fernet = _fernet(key) if key else None
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def get(self, tenant: str) -> Optional[Dict[str, Any]]:
+        """{"token": {...}, "settings": {...}}。無ければ None。"""
+        row = self._conn().execute("SELECT token, settings FROM tenants WHERE tenant = ?", (tenant,)).fetchone()
+        if row is None:
+            return None
+        return {"token": json.loads(self._decrypt(row[0])), "settings": json.loads(row[1] or "{}")}
+
+    def put(self, tenant: str, token: Dict[str, Any], settings: Optional[Dict[str, Any]] = None) -> None:
+        """トークンを保存する。settings が None なら既存の設定を残す。"""
+        blob = self._encrypt(json.dumps(token, ensure_ascii=False))
+        conn = self._conn()
+        if settings is None:
+            conn.execute("INSERT INTO tenants (tenant, token, settings, updated_at) VALUES (?, ?, '{}', ?) "
+                         "ON CONFLICT(tenant) DO UPDATE SET token = excluded.token, updated_at = excluded.updated_at",
+                         (tenant, blob, time.time()))
+        else:
+            # API キーは残す（トークン・設定の更新でキーを配り直させない）
+            conn.execute("INSERT INTO tenants (tenant, token, settings, updated_at) VALUES (?, ?, ?, ?) "
+                         "ON CONFLICT(tenant) DO UPDATE SET token = excluded.token, settings = excluded.settings, "
+                         "updated_at = excluded.updated_at",
+                         (tenant, blob, json.dumps(settings, ensure_ascii=False), time.time()))
+
+    def settings(self, tenant: str) -> Dict[str, Any]:
+        """テナントの設定（calendar_id / sheets_id / sheets_range など。復号はしない）。"""
+        row = self._conn().execute("SELECT settings FROM tenants WHERE tenant = ?", (tenant,)).fetchone()
+        return json.loads(row[0] or "{}") if row else {}
+
+    def profile(self, tenant: str) -> Optional[Dict[str, Any]]:
+        """
+        {"settings": {...}, "key_hash": API キーのハッシュ or None, "token_rev": 保存中のトークンの版}。
+        テナントが無ければ None（復号はしない。token_rev はトークンが書き換わったかを見るためだけの値）。
+        """
+        row = self._conn().execute("SELECT settings, key_hash, token FROM tenants WHERE tenant = ?",
+                                   (tenant,)).fetchone()
+        if row is None:
+            return None
+        return {"settings": json.loads(row[0] or "{}"), "key_hash": row[1],
+                "token_rev": hashlib.sha256(bytes(row[2])).hexdigest()}
+
+    def issue_key(self, tenant: str) -> str:
+        """API キーを発行して（前のキーは無効になる）平文を返す。保存するのはハッシュだけ。"""
+        key = secrets.token_urlsafe(32)
+        cur = self._conn().execute("UPDATE tenants SET key_hash = ?, updated_at = ? WHERE tenant = ?",
+                                   (key_hash(key), time.time(), tenant))
+        if cur.rowcount != 1:
+            raise RuntimeError(f"テナント {tenant} がありません。"
+                               f"先に `python token_setup.py --tenant {tenant}` でトークンを発行してください。")
+        return key
+
+    def delete(self, tenant: str) -> None:
+        self._conn().execute("DELETE FROM tenants WHERE tenant = ?", (tenant,))
+
+    def tenants(self) -> List[str]:
+        return [r[0] for r in self._conn().execute("SELECT tenant FROM tenants ORDER BY tenant")]
+
+    # ---- 内部処理 ----
+    def _encrypt(self, text: str) -> bytes:
+        data = text.encode("utf-8")
+        return self._fernet.encrypt(data) if self._fernet else data
+
+    def _decrypt(self, blob: bytes) -> str:
+        if self._fernet:
+            from cryptography.fernet import InvalidToken
+            try:
+                blob = self._fernet.decrypt(bytes(blob))
+            except InvalidToken:
+                raise RuntimeError("トークンを復号できません。GOOGLE_TOKEN_STORE_KEY が保存時と同じか確認してください。")
+        return bytes(blob).decode("utf-8")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute("CREATE TABLE IF NOT EXISTS tenants (tenant TEXT PRIMARY KEY, token BLOB NOT NULL, "
+                                 "settings TEXT NOT NULL DEFAULT '{}', key_hash TEXT, updated_at REAL NOT NULL)")
+                    # キー列が無い古い DB には足す（キーを発行するまでそのテナントへの依頼は通らない）
+                    if "key_hash" not in [r[1] for r in conn.execute("PRAGMA table_info(tenants)")]:
+                        conn.execute("ALTER TABLE tenants ADD COLUMN key_hash TEXT")
+                    self._initialized = True
+            self._local.conn = conn
+        return conn
+
+
+def key_hash(key: str) -> str:
+    # キーは token_urlsafe(32) の乱数なので、ソルト・ストレッチ無しのハッシュで足りる
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def _fernet(key: str):
+    try:
+        from cryptography.fernet import Fernet
+    except ImportError:
+        raise RuntimeError("GOOGLE_TOKEN_STORE_KEY を使うには cryptography が必要です（pip install cryptography）")
+    return Fernet(key.encode("ascii") if isinstance(key, str) else key)
+
+
+class _Tenant:
+    __slots__ = ("creds", "profile", "loaded_at")
+
+    def __init__(self, creds: CredsCache, profile: Dict[str, Any], loaded_at: float):
+        self.creds = creds
+        self.profile = profile
+        self.loaded_at = loaded_at
+
+
+class TenantCreds:
+    """
+    テナント → (CredsCache, 設定・API キーのハッシュ) の LRU。
+    build       : トークン JSON から Credentials を組み立てる関数（refresh はしない）
+    settings_ttl: 設定・キー・トークンの版を保存先から読み直す間隔
+                  （token_setup.py での変更・キーやトークンの再発行はこの後に効く）
+    """
+
+    def __init__(self, store: TokenStore, build: Callable[[Dict[str, Any]], Any],
+                 maxsize: int = 256, background: bool = False, settings_ttl: float = 60.0,
+                 timer: Callable[[], float] = time.monotonic):
+        self.store = store
+        self._build = build
+        self._maxsize = maxsize
+        self._background = background
+        self._settings_ttl = settings_ttl
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _Tenant]" = OrderedDict()
+
+    def get(self, tenant: str):
+        entry = self._entry(tenant)
+        if entry is None:
+            raise RuntimeError(f"テナント {tenant} の OAuth トークンがありません。"
+                               f"`python token_setup.py --tenant {tenant}` で発行してください。")
+        return entry.creds.get()
+
+    def peek(self, tenant: str):
+        """メモリにある有効な Credentials（無ければ None。I/O はしない）。"""
+        with self._lock:
+            entry = self._entries.get(tenant)
+            if entry is not None:
+                self._entries.move_to_end(tenant)
+        return entry.creds.peek() if entry is not None else None
+
+    def settings(self, tenant: str) -> Dict[str, Any]:
+        """テナントの設定（無いテナントは {}）。"""
+        entry = self._entry(tenant)
+        return entry.profile["settings"] if entry is not None else {}
+
+    def verify(self, tenant: str, key: Optional[str]) -> bool:
+        """key がこのテナントの API キーか。キー未発行・無いテナントは常に False。"""
+        entry = self._entry(tenant)
+        expected = entry.profile.get("key_hash") if entry is not None else None
+        if not key or not expected:
+            return False
+        return hmac.compare_digest(key_hash(key), expected)
+
+    def invalidate(self, tenant: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(tenant, None)
+        if entry is not None:
+            entry.creds.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _entry(self, tenant: str) -> Optional[_Tenant]:
+        now = self._timer()
+        with self._lock:
+            entry = self._entries.get(tenant)
+            if entry is not None:
+                self._entries.move_to_end(tenant)
+                metrics.inc("tenant_creds_hit")
+                if now - entry.loaded_at < self._settings_ttl:
+                    return entry
+        # 保存先の読み込みはロックの外で（無いテナントは LRU に入れない）
+        profile = self.store.profile(tenant)
+        if entry is not None:
+            if profile is None:
+                self.invalidate(tenant)
+                return None
+            if profile["token_rev"] != entry.profile["token_rev"]:
+                # 再発行されたトークン（自分の refresh を保存した場合も変わるが、読み直すだけで害は無い）
+                entry.creds.invalidate()
+            entry.profile, entry.loaded_at = profile, now
+            return entry
+        metrics.inc("tenant_creds_miss")
+        if profile is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(tenant)
+            if entry is not None:  # 読んでいる間に別のスレッドが入れた
+                return entry
+            entry = self._entries[tenant] = _Tenant(
+                CredsCache(lambda: self._load(tenant), lambda creds: self._save(tenant, creds),
+                           background=self._background),
+                profile, now)
+            evicted = []
+            while len(self._entries) > self._maxsize:
+                evicted.append(self._entries.popitem(last=False)[1])
+        for e in evicted:
+            e.creds.close()  # バックグラウンド refresh のタイマーを止める
+        return entry
+
+    def _load(self, tenant: str):
+        rec = self.store.get(tenant)
+        if rec is None:
+            raise RuntimeError(f"テナント {tenant} の OAuth トークンがありません。"
+                               f"`python token_setup.py --tenant {tenant}` で発行してください。")
+        return self._build(rec["token"])
+
+    def _save(self, tenant: str, creds) -> None:
+        self.store.put(tenant, json.loads(creds.to_json()))
+        logger.info(f"tenant {tenant}: OAuth token saved")
+
+
+# ---- 今のテナント ----
+_current: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("tenant", default=None)
+
+
+def current() -> Optional[str]:
+    return _current.get()
+
+
+@contextmanager
+def tenant(name: Optional[str]) -> Iterator[None]:
+    token = _current.set(name or None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def from_env() -> TokenStore:
+    """GOOGLE_TOKEN_STORE_PATH（相対パスはプロジェクト直下から）/ GOOGLE_TOKEN_STORE_KEY。"""
+    path = Path(os.getenv("GOOGLE_TOKEN_STORE_PATH", ".env.variables/google_tokens.sqlite3"))
+    if not path.is_absolute():
+        path = Path(__file__).parent / path
+    return TokenStore(str(path), os.getenv("GOOGLE_TOKEN_STORE_KEY") or None)
@@ -0,0 +1,27 @@
+# tests/test_bench_suite.py
+from benchmarks import bench_suite, corpus
+
+
+def test_corpus_is_deterministic():
+    assert corpus.generate(200, seed=1) == corpus.generate(200, seed=1)
+    assert corpus.generate(200, seed=1) != corpus.generate(200, seed=2)
+
+
+def test_percentile_nearest_rank():
+    xs = list(range(1, 101))
+    assert bench_suite.percentile(xs, 50) == 50
+    assert bench_suite.percentile(xs, 99) == 99
+    assert bench_suite.percentile([], 99) == 0.0
+
+
+def test_suite_runs_every_target_on_small_corpus():
+    report = bench_suite.run_suite(n=50, rounds=1)
+    assert set(report["results"]) == set(bench_suite.targets())
+    assert all(r["ops_per_sec"] > 0 and r["n"] == 50 for r in report["results"].values())
+
+
+def test_compare_flags_only_regressions_beyond_threshold():
+    base = {"results": {"a": {"ops_per_sec": 1000}, "b": {"ops_per_sec": 1000}}}
+    cur = {"results": {"a": {"ops_per_sec": 850}, "b": {"ops_per_sec": 950}, "c": {"ops_per_sec": 1}}}
+    out = bench_suite.compare(base, cur, threshold=0.10)
+    assert len(out) == 1 and out[0].startswith("a:")
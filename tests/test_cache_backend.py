@@ -0,0 +1,115 @@
+# tests/test_cache_backend.py
+import multiprocessing as mp
+
+import pytest
+
+from cache_backend import CacheBackend, MemoryCache, SQLiteCache
+from idempotency import IdempotencyStore
+from llm_cache import LLMCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _backends(tmp_path, clock, maxsize=3):
+    return [MemoryCache(maxsize=maxsize, ttl=10, timer=clock),
+            SQLiteCache(str(tmp_path / "c.sqlite3"), maxsize=maxsize, ttl=10, prune_every=1, timer=clock)]
+
+
+def test_ttl_cas_and_delete(tmp_path):
+    clock = Clock()
+    for c in _backends(tmp_path, clock):
+        c.set("k", {"v": 1})
+        assert c.get("k") == {"v": 1}
+        assert not c.cas("k", None, {"v": 2})          # あるので set-if-absent は失敗
+        assert not c.cas("k", {"v": 9}, {"v": 2})      # 期待値と違う
+        assert c.cas("k", {"v": 1}, {"v": 2}) and c.get("k") == {"v": 2}
+        c.set("short", "x", ttl=1)
+        clock.now += 2
+        assert c.get("short") is None and len(c) == 1
+        assert c.cas("short", None, "y")               # 期限切れは「無い」扱い
+        c.delete("k")
+        assert c.get("k") is None
+        clock.now += 11
+        assert len(c) == 0
+        c.clear()
+
+
+def test_size_bound(tmp_path):
+    clock = Clock()
+    mem, sq = _backends(tmp_path, clock, maxsize=3)
+    for i in range(5):
+        clock.now += 1
+        mem.set(f"k{i}", i); sq.set(f"k{i}", i)
+    assert len(mem) == 3 and len(sq) == 3
+    assert sq.get("k0") is None and sq.get("k4") == 4  # 期限の近い（古い）ものから消える
+
+
+def test_sqlite_namespaces_are_separate(tmp_path):
+    path = str(tmp_path / "c.sqlite3")
+    a, b = SQLiteCache(path, namespace="a"), SQLiteCache(path, namespace="b")
+    a.set("k", 1)
+    assert b.get("k") is None
+    b.clear()
+    assert a.get("k") == 1
+
+
+def _worker_add(path, n, q):
+    c = SQLiteCache(path, namespace="race")
+    q.put(sum(1 for i in range(n) if c.cas(f"k{i}", None, "mine")))
+
+
+def test_cas_is_atomic_across_processes(tmp_path):
+    path = str(tmp_path / "c.sqlite3")
+    ctx = mp.get_context("spawn")
+    q = ctx.Queue()
+    procs = [ctx.Process(target=_worker_add, args=(path, 50, q)) for _ in range(4)]
+    for p in procs: p.start()
+    won = [q.get(timeout=30) for _ in procs]
+    for p in procs: p.join()
+    assert sum(won) == 50                               # 各キーを取れたのはちょうど1プロセス
+
+
+def test_llm_cache_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / "c.sqlite3")
+    w1, w2 = LLMCache(path=path), LLMCache(path=path)   # 別ワーカー相当
+    w1.set("k", {"intent": "memo"})
+    assert w2.get("k") == {"intent": "memo"} and w2.stats()["hits"] == 1
+
+
+def test_idempotency_across_workers_waits_for_owner(tmp_path):
+    path = str(tmp_path / "c.sqlite3")
+    w1 = IdempotencyStore(backend=SQLiteCache(path, namespace="idem"), poll_interval=0.01)
+    w2 = IdempotencyStore(backend=SQLiteCache(path, namespace="idem"), poll_interval=0.01)
+
+    fut, owner = w1.begin("execute:h:req-1")
+    assert owner
+    dup, dup_owner = w2.begin("execute:h:req-1")        # 別のワーカーに再送が来た
+    assert not dup_owner and not dup.done()
+    w1.finish("execute:h:req-1", fut, ({"ok": True}, 200))
+    assert dup.result(timeout=5) == [{"ok": True}, 200]  # JSON 経由なので list
+    assert w2.begin("execute:h:req-1")[0].result() == [{"ok": True}, 200]
+
+    # 失敗したキーは他のワーカーでも実行し直せる
+    f2, _ = w1.begin("execute:h:req-2")
+    waiter, _ = w2.begin("execute:h:req-2")
+    w1.fail("execute:h:req-2", f2, exc=RuntimeError("503 backend"))
+    with pytest.raises(RuntimeError, match="503"):
+        waiter.result(timeout=5)
+    assert w2.begin("execute:h:req-2")[1] is True
+
+
+def test_backend_interface_is_abstract():
+    class NoCas(CacheBackend):  # cas などを実装し忘れた保存先は作れない
+        def get(self, key): return None
+        def set(self, key, value, ttl=None): pass
+
+    with pytest.raises(TypeError):
+        CacheBackend()
+    with pytest.raises(TypeError, match="cas"):
+        NoCas()
@@ -0,0 +1,135 @@
+# tests/test_calendar_batch.py
+import os
+os.environ["DRY_RUN"] = "true"
+
+from fastapi.testclient import TestClient
+import app_intent_mvp
+from app_intent_mvp import app, create_calendar_events_batch
+
+client = TestClient(app)
+
+EV = {"summary": "早番", "start": "2025-09-01T09:00:00+09:00", "end": "2025-09-01T17:00:00+09:00"}
+
+
+class FakeBatch:
+    def __init__(self, callback, sizes):
+        self.callback, self.items, self.sizes = callback, [], sizes
+
+    def add(self, req, request_id):
+        self.items.append((request_id, req))
+
+    def execute(self):
+        self.sizes.append(len(self.items))
+        for rid, body in self.items:
+            if body["summary"] == "NG":
+                self.callback(rid, None, RuntimeError("invalid"))
+            else:
+                self.callback(rid, {"id": f"evt{rid}", "htmlLink": "https://example.invalid"}, None)
+
+
+class FakeService:
+    def __init__(self):
+        self.sizes = []
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(callback, self.sizes)
+
+    def events(self):
+        return self
+
+    def insert(self, calendarId, body):
+        return body
+
+
+def test_batch_results_in_input_order(monkeypatch):
+    svc = FakeService()
+    monkeypatch.setattr(app_intent_mvp, "DRY_RUN", False)
+    monkeypatch.setattr(app_intent_mvp, "get_google_creds", lambda: object())
+    monkeypatch.setattr(app_intent_mvp, "calendar_service", lambda creds: svc)
+
+    events = [dict(EV, summary=f"shift{i}") for i in range(7)]
+    events[2] = dict(EV, summary="NG")
+    events[4] = {"summary": "start なし"}
+    res = create_calendar_events_batch(events, batch_size=3)
+
+    assert svc.sizes == [3, 3]          # 不正な1件は送らず、6件を3件ずつ
+    assert [r["ok"] for r in res] == [True, True, False, True, False, True, True]
+    assert res[0]["id"] == "evt0" and res[6]["id"] == "evt6"
+    assert "invalid" in res[2]["error"]
+
+
+def test_batch_endpoint_dry_run():
+    r = client.post("/calendar/events:batch", json={"events": [EV, EV, {"summary": "x"}]})
+    body = r.json()
+    assert r.status_code == 200
+    assert body["count"] == 3 and body["failed"] == 1 and not body["ok"]
+    assert [x["ok"] for x in body["results"]] == [True, True, False]
+
+
+def test_batch_endpoint_rejects_empty():
+    assert client.post("/calendar/events:batch", json={"events": []}).status_code == 400
+
+
+class HttpError503(Exception):
+    def __init__(self):
+        super().__init__("<HttpError 503>")
+        self.resp = type("Resp", (dict,), {"status": 503})()
+
+
+def test_batch_resends_only_retryable_failures(monkeypatch):
+    from retry_policy import RetryPolicy
+    svc = FakeService()
+    sent = []
+
+    class FlakyBatch(FakeBatch):
+        def execute(self):
+            self.sizes.append(len(self.items))
+            for rid, body in self.items:
+                sent.append(rid)
+                if body["summary"] == "busy" and sent.count(rid) == 1:
+                    self.callback(rid, None, HttpError503())
+                else:
+                    self.callback(rid, {"id": f"evt{rid}", "htmlLink": "https://example.invalid"}, None)
+
+    svc.new_batch_http_request = lambda callback: FlakyBatch(callback, svc.sizes)
+    monkeypatch.setattr(app_intent_mvp, "DRY_RUN", False)
+    monkeypatch.setattr(app_intent_mvp, "get_google_creds", lambda: object())
+    monkeypatch.setattr(app_intent_mvp, "calendar_service", lambda creds: svc)
+    monkeypatch.setattr(app_intent_mvp, "CALENDAR_RETRY", RetryPolicy("calendar", sleep=lambda s: None))
+
+    events = [EV, dict(EV, summary="busy"), EV]
+    res = create_calendar_events_batch(events)
+    assert svc.sizes == [3, 1]          # 2回目は 503 だった1件だけ
+    assert [r["ok"] for r in res] == [True, True, True]
+
+
+class HttpError409(Exception):
+    def __init__(self):
+        super().__init__("<HttpError 409>")
+        self.resp = type("Resp", (dict,), {"status": 409})()
+
+
+def test_batch_sends_event_ids_and_treats_409_as_created(monkeypatch):
+    svc = FakeService()
+    bodies = []
+
+    class DupBatch(FakeBatch):
+        def execute(self):
+            self.sizes.append(len(self.items))
+            for rid, body in self.items:
+                bodies.append(body)
+                # 前回の試行が通っていた1件は 409 になる
+                if body["summary"] == "dup":
+                    self.callback(rid, None, HttpError409())
+                else:
+                    self.callback(rid, {"id": body["id"], "htmlLink": "https://example.invalid"}, None)
+
+    svc.new_batch_http_request = lambda callback: DupBatch(callback, svc.sizes)
+    monkeypatch.setattr(app_intent_mvp, "DRY_RUN", False)
+    monkeypatch.setattr(app_intent_mvp, "get_google_creds", lambda: object())
+    monkeypatch.setattr(app_intent_mvp, "calendar_service", lambda creds: svc)
+
+    res = create_calendar_events_batch([EV, dict(EV, summary="dup", id="fixedid0")])
+    assert all(len(b["id"]) >= 5 for b in bodies) and bodies[1]["id"] == "fixedid0"
+    assert [r["ok"] for r in res] == [True, True]
+    assert res[1]["id"] == "fixedid0"
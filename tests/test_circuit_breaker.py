@@ -0,0 +1,160 @@
+# tests/test_circuit_breaker.py
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import circuit_breaker
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from google_async import GoogleAPIError
+from retry_policy import RetryPolicy
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _breaker(clock, **kw):
+    kw.setdefault("min_calls", 4)
+    kw.setdefault("failure_rate", 0.5)
+    kw.setdefault("open_sec", 10)
+    kw.setdefault("window_sec", 30)
+    return CircuitBreaker("test", timer=clock, **kw)
+
+
+def _fail():
+    raise GoogleAPIError(503, "backend error")
+
+
+def _bad_request():
+    raise GoogleAPIError(400, "invalid")
+
+
+def test_opens_on_failure_rate_and_fails_fast():
+    clock = Clock()
+    b = _breaker(clock)
+    assert b.call(lambda: "ok") == "ok"
+    for _ in range(3):
+        with pytest.raises(GoogleAPIError):
+            b.call(_fail)
+    assert b.state == circuit_breaker.OPEN
+
+    calls = []
+    with pytest.raises(CircuitOpenError) as ei:
+        b.call(lambda: calls.append(1))
+    assert calls == []                       # open の間は上流を呼ばない
+    assert ei.value.retry_after == 10
+
+
+def test_client_errors_do_not_open():
+    clock = Clock()
+    b = _breaker(clock)
+    for _ in range(10):
+        with pytest.raises(GoogleAPIError):
+            b.call(_bad_request)
+    assert b.state == circuit_breaker.CLOSED
+
+
+def test_min_calls_and_window():
+    clock = Clock()
+    b = _breaker(clock)
+    for _ in range(3):
+        with pytest.raises(GoogleAPIError):
+            b.call(_fail)
+    assert b.state == circuit_breaker.CLOSED   # 件数が少ないうちは開かない
+    clock.now = 60                              # 古い失敗は窓から外れる
+    b.call(lambda: None)
+    with pytest.raises(GoogleAPIError):
+        b.call(_fail)
+    assert b.snapshot()["calls"] == 2 and b.state == circuit_breaker.CLOSED
+
+
+def test_slow_calls_count_as_failures():
+    clock = Clock()
+    b = _breaker(clock, slow_call_sec=1.0)
+    for _ in range(4):
+        b.record(False, elapsed=2.0)
+    assert b.state == circuit_breaker.OPEN
+
+
+def test_half_open_probe_closes_or_reopens():
+    clock = Clock()
+    b = _breaker(clock, half_open_max=1)
+    for _ in range(4):
+        b.record(True)
+    clock.now = 10
+    assert b.state == circuit_breaker.HALF_OPEN
+
+    # 試し呼び出しは1件だけ通す
+    b.allow()
+    with pytest.raises(CircuitOpenError):
+        b.allow()
+    b.record(True)                              # 試しが失敗 → また open
+    assert b.state == circuit_breaker.OPEN
+
+    clock.now = 20
+    assert b.call(lambda: "ok") == "ok"         # 試しが成功 → closed
+    assert b.state == circuit_breaker.CLOSED
+    assert b.snapshot() == {"state": "closed", "calls": 0, "failure_rate": 0.0}
+
+
+def test_async_timeout_counts_as_failure():
+    clock = Clock()
+    b = _breaker(clock, min_calls=1, failure_rate=1.0)
+
+    async def slow():
+        await asyncio.sleep(1)
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(b.acall(slow), 0.01)
+
+    asyncio.run(main())
+    assert b.state == circuit_breaker.OPEN
+
+
+def test_retry_policy_does_not_retry_open_circuit():
+    clock = Clock()
+    b = _breaker(clock, min_calls=2)
+    calls = []
+
+    def fn():
+        calls.append(1)
+        _fail()
+
+    p = RetryPolicy("test", max_attempts=5, breaker=b, sleep=lambda s: None)
+    with pytest.raises(CircuitOpenError):
+        p.call(fn)
+    assert len(calls) == 2                      # 2回失敗で open、3回目は呼ばずに諦める
+
+
+def test_execute_fails_fast_with_503_when_open(monkeypatch):
+    import app_intent_mvp
+
+    async def open_circuit(payload):
+        raise CircuitOpenError("calendar", 4.2)
+
+    monkeypatch.setattr(app_intent_mvp, "create_calendar_event_async", open_circuit)
+    app_intent_mvp.idempotency.clear()
+    client = TestClient(app_intent_mvp.app)
+    r = client.post("/execute", json={"text": "明日10時に商談30分"})
+    assert r.status_code == 503
+    assert r.headers["Retry-After"] == "5"
+    assert "一時的に利用できません" in r.json()["hint"]
+
+
+def test_health_shows_circuit_states(monkeypatch):
+    import app_intent_mvp
+    b = circuit_breaker.get("calendar")
+    assert b is not None
+    monkeypatch.setattr(b, "_state", circuit_breaker.OPEN)
+    monkeypatch.setattr(b, "_opened_at", b._timer())
+    body = TestClient(app_intent_mvp.app).get("/health").json()
+    assert body["status"] == "degraded"
+    assert body["circuits"]["calendar"]["state"] == "open"
+    assert {"calendar", "sheets", "oauth", "openai", "lineworks"} <= set(body["circuits"])
+    b.reset()
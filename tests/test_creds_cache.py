@@ -0,0 +1,83 @@
+# tests/test_creds_cache.py
+import json, threading, time
+from datetime import datetime, timedelta
+
+from creds_cache import CredsCache, atomic_write_text
+
+
+class FakeCreds:
+    """google.oauth2.credentials.Credentials の必要部分だけ真似る"""
+    def __init__(self, valid=True, refresh_token="r"):
+        self.token = "t0" if valid else None
+        self.refresh_token = refresh_token
+        self.expiry = datetime.utcnow() + timedelta(hours=1)
+        self.refreshed = 0
+
+    @property
+    def valid(self):
+        return self.token is not None
+
+    def refresh(self, request):
+        time.sleep(0.05)  # 同時リクエストが重なるように
+        self.refreshed += 1
+        self.token = f"t{self.refreshed}"
+
+    def to_json(self):
+        return json.dumps({"token": self.token})
+
+
+def test_loader_called_once_and_cached():
+    calls = []
+    def loader():
+        calls.append(1)
+        return FakeCreds()
+    cache = CredsCache(loader, background=False)
+    assert cache.get() is cache.get()
+    assert len(calls) == 1
+
+
+def test_expired_refresh_is_single_flight():
+    creds = FakeCreds(valid=False)
+    saved = []
+    cache = CredsCache(lambda: creds, saver=saved.append, background=False)
+
+    threads = [threading.Thread(target=cache.get) for _ in range(10)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    assert creds.refreshed == 1
+    assert saved == [creds]  # 実際に refresh した時だけ保存
+
+
+def test_no_refresh_token_raises():
+    cache = CredsCache(lambda: FakeCreds(valid=False, refresh_token=None), background=False)
+    try:
+        cache.get()
+        assert False, "RuntimeError が出るはず"
+    except RuntimeError as e:
+        assert "再同意" in str(e)
+
+
+def test_failed_refresh_drops_cache_and_reloads():
+    class Revoked(FakeCreds):
+        def refresh(self, request):
+            raise RuntimeError("invalid_grant")  # 同じトークンでは何度やっても直らない
+
+    source = [Revoked()]
+    cache = CredsCache(lambda: source[0], background=False)
+    cache.get().token = None  # キャッシュ中に期限切れ
+    source[0] = FakeCreds()   # token_setup.py で再発行
+    try:
+        cache.get()
+        assert False, "invalid_grant が出るはず"
+    except RuntimeError as e:
+        assert "invalid_grant" in str(e)
+    assert cache.get() is source[0]
+
+
+def test_atomic_write_text(tmp_path):
+    p = tmp_path / "sub" / "token.json"
+    atomic_write_text(p, '{"a": 1}')
+    atomic_write_text(p, '{"a": 2}')
+    assert json.loads(p.read_text(encoding="utf-8")) == {"a": 2}
+    assert [x.name for x in p.parent.iterdir()] == ["token.json"]
@@ -0,0 +1,96 @@
+# tests/test_fake_upstream.py
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import google_services
+from benchmarks.fake_upstream import Fault, FakeUpstream, create_app
+from google_async import GoogleAPIError, GoogleAsyncClient
+
+
+class _Creds:
+    valid = True
+    token = "t"
+
+
+def _up(**fault):
+    return FakeUpstream({s: Fault(latency_ms=0, **fault) for s in ("calendar", "sheets", "oauth", "lineworks")}, seed=0)
+
+
+def test_async_client_round_trip_against_fake():
+    app = create_app(_up())
+    client = GoogleAsyncClient(lambda: _Creds(), transport=httpx.ASGITransport(app=app))
+
+    async def main():
+        created = await client.insert_event("primary", {"summary": "x", "start": {"dateTime": "a"},
+                                                        "end": {"dateTime": "b"}})
+        got = await client.get_event("primary", created["id"])
+        appended = await client.append_values("sid", "Sheet1!A:C", [["1", "memo", "a"], ["2", "memo", "b"]])
+        values = await client.get_values("sid", "Sheet1!A:C")
+        await client.aclose()
+        return created, got, appended, values
+
+    created, got, appended, values = asyncio.run(main())
+    assert got["summary"] == "x" and got["id"] == created["id"]
+    assert appended["updates"]["updatedRange"] == "Sheet1!A1:C2"
+    assert appended["updates"]["updatedCells"] == 6
+    assert values["values"][1] == ["2", "memo", "b"]
+
+
+def test_client_event_id_is_kept_and_duplicates_return_409():
+    up = _up()
+    client = TestClient(create_app(up))
+    body = {"id": "abc123", "summary": "x", "start": {"dateTime": "a"}, "end": {"dateTime": "b"}}
+    assert client.post("/calendar/v3/calendars/primary/events", json=body).json()["id"] == "abc123"
+    r = client.post("/calendar/v3/calendars/primary/events", json={**body, "summary": "再送"})
+    assert r.status_code == 409 and r.json()["error"]["errors"][0]["reason"] == "duplicate"
+    assert client.post("/calendar/v3/calendars/other/events", json=body).status_code == 200  # id はカレンダーごと
+
+    # 応答を受け取れなかった試行の再送：アプリのクライアントは 409 → 既存の予定を返す（二重にならない）
+    gclient = GoogleAsyncClient(lambda: _Creds(), transport=httpx.ASGITransport(app=create_app(up)))
+
+    async def main():
+        again = await gclient.insert_event("primary", {**body, "summary": "再送"})
+        await gclient.aclose()
+        return again
+
+    assert asyncio.run(main())["summary"] == "x"
+    assert len(up.events) == 2 and up.stats["calendar.duplicate"] == 2
+
+
+def test_error_injection_and_quota():
+    up = _up(rate_429=1.0, retry_after_sec=7)
+    client = TestClient(create_app(up))
+    r = client.post("/calendar/v3/calendars/primary/events", json={"start": {}, "end": {}})
+    assert r.status_code == 429 and r.headers["retry-after"] == "7"
+    assert r.json()["error"]["status"] == "RESOURCE_EXHAUSTED"
+
+    up.configure({"calendar": {"rate_429": 0.0, "quota_per_min": 2}})
+    codes = [client.post("/calendar/v3/calendars/primary/events", json={"start": {}, "end": {}}).status_code
+             for _ in range(3)]
+    assert codes == [200, 200, 429]
+    assert client.get("/_fake/stats").json()["stats"]["calendar.quota_exceeded"] == 1
+
+
+def test_token_and_webhook_endpoints():
+    up = _up()
+    client = TestClient(create_app(up))
+    r = client.post("/token", data={"grant_type": "refresh_token", "refresh_token": "r"})
+    assert r.json()["access_token"].startswith("fake-") and r.json()["expires_in"] == 3600
+    assert client.post("/lineworks/webhook", json={"content": {"type": "text", "text": "hi"}}).status_code == 200
+    assert up.webhooks[0]["content"]["text"] == "hi"
+
+
+def test_google_services_root_url_override(monkeypatch):
+    from google.oauth2.credentials import Credentials
+    monkeypatch.setenv("GOOGLE_CALENDAR_ROOT_URL", "http://127.0.0.1:8099/")
+    monkeypatch.setenv("GOOGLE_SHEETS_ROOT_URL", "http://127.0.0.1:8099")
+    google_services.clear()
+    creds = Credentials(token="t")
+    cal = google_services.calendar_service(creds).events().insert(calendarId="primary", body={})
+    sh = google_services.sheets_service(creds).spreadsheets().values().get(spreadsheetId="sid", range="A1")
+    google_services.clear()
+    assert cal.uri.startswith("http://127.0.0.1:8099/calendar/v3/calendars/primary/events")
+    assert sh.uri.startswith("http://127.0.0.1:8099/v4/spreadsheets/sid/values/")
@@ -0,0 +1,73 @@
+# tests/test_google_async.py
+import asyncio, json
+import httpx
+import pytest
+
+from google_async import GoogleAsyncClient, GoogleAPIError
+
+
+class FakeCreds:
+    token = "tok"
+    valid = True
+
+
+def _client(handler):
+    calls = []
+    def provider():
+        calls.append(1)
+        return FakeCreds()
+    return GoogleAsyncClient(provider, transport=httpx.MockTransport(handler)), calls
+
+
+def test_insert_event_and_append_values():
+    seen = []
+    def handler(req: httpx.Request):
+        seen.append(req)
+        if "calendar" in req.url.path:
+            return httpx.Response(200, json={"id": "e1", "htmlLink": "https://example.invalid"})
+        return httpx.Response(200, json={"updates": {"updatedCells": 3, "updatedRange": "Sheet1!A5:C5"}})
+
+    cli, calls = _client(handler)
+
+    async def main():
+        ev = await cli.insert_event("primary", {"summary": "商談"})
+        # 並行呼び出しでも Credentials は1回しか取りに行かない
+        res = await asyncio.gather(*[cli.append_values("sid", "Sheet1!A:C", [["a", "b", "c"]]) for _ in range(5)])
+        await cli.aclose()
+        return ev, res
+
+    ev, res = asyncio.run(main())
+    assert ev["id"] == "e1"
+    assert all(r["updates"]["updatedCells"] == 3 for r in res)
+    assert seen[0].url.path == "/calendar/v3/calendars/primary/events"
+    assert seen[0].headers["Authorization"] == "Bearer tok"
+    assert seen[1].url.params["valueInputOption"] == "RAW"
+    assert json.loads(seen[1].content) == {"values": [["a", "b", "c"]]}
+    assert len(calls) == 1
+
+
+def test_error_status_raises_google_api_error():
+    def handler(req):
+        return httpx.Response(429, json={"error": {"message": "Rate Limit Exceeded"}}, headers={"Retry-After": "2"})
+    cli, _ = _client(handler)
+    with pytest.raises(GoogleAPIError) as ei:
+        asyncio.run(cli.get_values("sid", "Sheet1!A:C"))
+    assert ei.value.status == 429
+    assert str(ei.value) == "429 Rate Limit Exceeded"
+    assert ei.value.headers["retry-after"] == "2"
+
+
+def test_insert_event_409_returns_existing_event():
+    seen = []
+    def handler(req: httpx.Request):
+        seen.append(req)
+        if req.method == "POST":
+            return httpx.Response(409, json={"error": {"message": "The requested identifier already exists."}})
+        return httpx.Response(200, json={"id": req.url.path.rsplit("/", 1)[-1], "htmlLink": "https://example.invalid"})
+
+    cli, _ = _client(handler)
+    ev = asyncio.run(cli.insert_event("primary", {"summary": "商談"}))
+    sent_id = json.loads(seen[0].content)["id"]
+    assert len(sent_id) == 32 and set(sent_id) <= set("0123456789abcdef")  # base32hex の範囲
+    assert ev["id"] == sent_id
+    assert seen[1].method == "GET" and seen[1].url.path.endswith(f"/events/{sent_id}")
@@ -0,0 +1,71 @@
+# tests/test_google_services.py
+import threading
+from google.oauth2.credentials import Credentials
+
+import google_services
+
+
+def test_service_is_reused_per_thread_and_creds():
+    google_services.clear()
+    creds = Credentials(token="dummy")
+    svc1 = google_services.calendar_service(creds)
+    svc2 = google_services.calendar_service(creds)
+    assert svc1 is svc2
+
+    # Credentials が変われば作り直す
+    other = Credentials(token="dummy2")
+    assert google_services.calendar_service(other) is not svc1
+
+    # 別スレッドは別の HTTP 接続を持つ
+    seen = {}
+    t = threading.Thread(target=lambda: seen.update(svc=google_services.calendar_service(creds)))
+    t.start(); t.join()
+    assert seen["svc"] is not svc1
+
+
+def test_sheets_service_uses_static_discovery():
+    google_services.clear()
+    svc = google_services.sheets_service(Credentials(token="dummy"))
+    req = svc.spreadsheets().values().get(spreadsheetId="sid", range="Sheet1!A:C")
+    assert req.uri.startswith("https://sheets.googleapis.com/v4/spreadsheets/sid/values/")
+
+
+def test_service_cache_is_bounded_lru(monkeypatch):
+    monkeypatch.setattr(google_services, "SERVICE_CACHE_SIZE", 2)
+    google_services.clear()
+    creds = [Credentials(token=f"t{i}") for i in range(3)]
+    first = google_services.sheets_service(creds[0])
+    google_services.sheets_service(creds[1])
+    assert google_services.sheets_service(creds[0]) is first  # 使ったので新しい側へ
+    google_services.sheets_service(creds[2])                  # creds[1] が追い出される
+    assert len(google_services._local.services) == 2
+    assert google_services.sheets_service(creds[0]) is first
+    google_services.clear()
+
+
+def test_insert_event_409_reads_existing_event():
+    class Conflict(Exception):
+        def __init__(self):
+            self.resp = type("Resp", (dict,), {"status": 409})()
+
+    class Req:
+        def __init__(self, fn):
+            self.execute = fn
+
+    class Events:
+        def __init__(self):
+            self.sent = []
+
+        def insert(self, calendarId, body):
+            self.sent.append(body)
+            def run():
+                raise Conflict()
+            return Req(run)
+
+        def get(self, calendarId, eventId):
+            return Req(lambda: {"id": eventId, "summary": "既存"})
+
+    events = Events()
+    svc = type("Svc", (), {"events": lambda self: events})()
+    ev = google_services.insert_event(svc, "primary", {"summary": "商談"})
+    assert ev == {"id": events.sent[0]["id"], "summary": "既存"}
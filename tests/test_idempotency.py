@@ -0,0 +1,144 @@
+# tests/test_idempotency.py
+import asyncio, os, threading
+os.environ["DRY_RUN"] = "true"
+
+import pytest
+from fastapi.testclient import TestClient
+
+import alexa_bridge
+import app_intent_mvp
+from idempotency import IdempotencyStore, key_for
+
+
+@pytest.fixture(autouse=True)
+def _clear():
+    app_intent_mvp.idempotency.clear()
+    yield
+    app_intent_mvp.idempotency.clear()
+
+
+def test_key_prefers_header_and_normalizes_text():
+    assert key_for(" abc ", "x", 60) == "h:abc"
+    assert key_for(None, "メモ：　牛乳", 60) == key_for(None, "メモ: 牛乳", 60)
+    assert key_for(None, "メモ: 牛乳", 0) is None
+
+
+def test_store_ttl_failure_and_bound():
+    now = [0.0]
+    s = IdempotencyStore(maxsize=2, ttl=10, timer=lambda: now[0])
+    f, owner = s.begin("a")
+    assert owner and s.begin("a") == (f, False)
+    s.finish("a", f, 1)
+    now[0] = 11
+    assert s.begin("a")[1] is True          # 期限切れ → 実行し直し
+
+    g, _ = s.begin("b")
+    s.fail("b", g, result="5xx")
+    assert s.begin("b")[1] is True          # 失敗は保存しない
+    s.begin("c"); s.begin("d")
+    assert len(s) == 2
+
+
+def test_execute_replays_result_without_second_upstream_call(monkeypatch):
+    calls = []
+
+    async def fake_append(values):
+        calls.append(values)
+        await asyncio.sleep(0.05)
+        return {"ok": True, "updated": 1}
+
+    monkeypatch.setattr(app_intent_mvp, "append_sheets_async", fake_append)
+    client = TestClient(app_intent_mvp.app)
+    h = {"Idempotency-Key": "req-1"}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.post("/execute", json={"text": "メモ: 牛乳"}, headers=h)))
+               for _ in range(3)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    late = client.post("/execute", json={"text": "メモ: 牛乳"}, headers=h)
+
+    assert len(calls) == 1
+    assert {r.json()["result"]["updated"] for r in [*results, late]} == {1}
+    assert late.headers["idempotent-replayed"] == "true"
+    # 別のキーなら実行される
+    client.post("/execute", json={"text": "メモ: 牛乳"}, headers={"Idempotency-Key": "req-2"})
+    assert len(calls) == 2
+
+
+def test_execute_failure_is_not_cached(monkeypatch):
+    n = []
+
+    async def flaky(values):
+        n.append(1)
+        if len(n) == 1:
+            raise RuntimeError("503 backend")
+        return {"ok": True, "updated": 1}
+
+    monkeypatch.setattr(app_intent_mvp, "append_sheets_async", flaky)
+    client = TestClient(app_intent_mvp.app)
+    assert client.post("/execute", json={"text": "メモ: 卵"}).status_code == 500
+    assert client.post("/execute", json={"text": "メモ: 卵"}).status_code == 200
+    assert len(n) == 2
+
+
+def test_degraded_unknown_is_not_cached(monkeypatch):
+    answers = [None, app_intent_mvp.IntentResult(intent="unknown"),  # 締切切れ → LLM が unknown と判定
+               app_intent_mvp.IntentResult(intent="memo", suggested_payload={"values": [["t", "memo", "x"]]})]
+
+    async def fake_llm(text):
+        return answers.pop(0)
+
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(app_intent_mvp, "classify_intent_llm_async", fake_llm)
+    client = TestClient(app_intent_mvp.app)
+    h = {"Idempotency-Key": "req-degraded"}
+    r = client.post("/execute", json={"text": "あれをお願い"}, headers=h)
+    assert r.status_code == 400 and r.json()["degraded"] is True
+    r = client.post("/execute", json={"text": "あれをお願い"}, headers=h)  # 再送は判定し直す
+    assert r.status_code == 400 and "degraded" not in r.json() and "idempotent-replayed" not in r.headers
+    r = client.post("/execute", json={"text": "あれをお願い"}, headers=h)  # 判定済みの unknown は保存済み
+    assert r.headers["idempotent-replayed"] == "true" and len(answers) == 1
+
+
+def test_alexa_bridge_dedupes_by_text(monkeypatch):
+    calls = []
+    monkeypatch.setattr(alexa_bridge, "append_sheets", lambda values: calls.append(values) or {"ok": True})
+    client = TestClient(alexa_bridge.app)
+    a = client.post("/alexa", json={"text": "メモ: パン"})
+    b = client.post("/alexa", json={"text": "メモ: パン"})
+    assert len(calls) == 1 and a.json() == b.json()
+
+
+def test_backend_io_runs_outside_the_lock():
+    from cache_backend import MemoryCache
+
+    class SlowBackend(MemoryCache):
+        def __init__(self):
+            super().__init__()
+            self.blocked = {"slow"}
+            self.entered = threading.Event()
+            self.release = threading.Event()
+
+        def get(self, key):
+            if key in self.blocked:
+                self.entered.set()
+                self.release.wait(5)  # SQLite のロック待ち相当
+            return super().get(key)
+
+    backend = SlowBackend()
+    s = IdempotencyStore(backend=backend)
+    got = []
+    t = threading.Thread(target=lambda: got.append(s.begin("slow")))
+    t.start()
+    assert backend.entered.wait(5)
+    # 保存先の I/O 中でも別のキーは待たされず、同じキーの重複は同じ Future を受け取る
+    fut_other, owner_other = s.begin("other")
+    dup, dup_owner = s.begin("slow")
+    assert owner_other and not dup_owner
+    backend.release.set()
+    t.join(5)
+    fut, owner = got[0]
+    assert owner and dup is fut
+    s.finish("slow", fut, "done")
+    assert dup.result(1) == "done"
@@ -0,0 +1,58 @@
+# tests/test_intent_engine.py
+import random
+from datetime import datetime as _dt
+
+import pytest
+
+import app_intent_mvp
+import intent_engine
+from benchmarks import legacy_intent
+from benchmarks.bench_intent_engine import UTTERANCES
+
+
+class FrozenDatetime(_dt):
+    @classmethod
+    def now(cls, tz=None):
+        return _dt(2025, 8, 20, 9, 41, 7, 123456, tzinfo=tz)
+
+
+@pytest.fixture
+def frozen(monkeypatch):
+    monkeypatch.setattr(app_intent_mvp, "datetime", FrozenDatetime)
+    monkeypatch.setattr(legacy_intent, "datetime", FrozenDatetime)
+
+
+def _fuzz_texts(n=3000, seed=0):
+    parts = ["0", "1", "2", "9", "10", "45", "123", "１０", "時", "分", ":", " ", "　", "明日", "報告",
+             "日報", "メモ", "メモ：", "memo", "tomorrow", "来週", "水", "曜", "終日", "全日", "有休",
+             "休暇", "に", "から", "商談", "12:30"]
+    rnd = random.Random(seed)
+    return ["".join(rnd.choice(parts) for _ in range(rnd.randint(0, 8))) for _ in range(n)]
+
+
+def _same(text):
+    try:
+        expected = legacy_intent.classify_intent_rule(text).model_dump()
+    except ValueError as e:            # 25時 など：旧実装と同じ例外になること
+        with pytest.raises(type(e)):
+            app_intent_mvp.classify_intent_rule(text)
+        return
+    assert app_intent_mvp.classify_intent_rule(text).model_dump() == expected, text
+
+
+@pytest.mark.parametrize("text", UTTERANCES)
+def test_identical_to_legacy_on_samples(frozen, text):
+    _same(text)
+
+
+def test_identical_to_legacy_on_fuzzed_text(frozen):
+    for text in _fuzz_texts():
+        _same(text)
+
+
+def test_scan_single_pass_tokens():
+    tok = intent_engine.scan("明日報告 10時30分から 13:15 45分")
+    assert {"明日", "日報", "時"} <= tok.keywords
+    assert tok.kanji_time == (10, 30) and tok.colon_time == (13, 15)
+    assert tok.duration == 30   # 最左の「N分」（10時30分 の 30分）
+    assert tok.memo and tok.tomorrow and tok.has_time
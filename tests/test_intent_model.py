@@ -0,0 +1,98 @@
+# tests/test_intent_model.py
+import os
+os.environ["DRY_RUN"] = "true"
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import app_intent_mvp
+import intent_model
+from app_intent_mvp import IntentResult
+from tests.test_e2e import CASES
+
+SAMPLES = os.path.join(os.path.dirname(__file__), "..", "intent_samples.jsonl")
+
+
+@pytest.fixture(scope="module")
+def model():
+    return intent_model.train(intent_model.read_samples(SAMPLES))
+
+
+def test_seed_cases_are_in_training_data():
+    texts = {t for t, _ in intent_model.read_samples(SAMPLES)}
+    assert {t for t, _ in CASES} <= texts
+
+
+def test_predicts_training_cases(model):
+    for text, intent in CASES:
+        label, conf = model.predict(text)
+        assert label == intent and 0.0 <= conf <= 1.0
+
+
+def test_batch_matches_single_and_save_load_roundtrip(model, tmp_path):
+    texts = ["明日の午後に歯医者", "牛乳を買う", "こんにちは", ""]
+    path = tmp_path / "m.npz"
+    model.save(path)
+    loaded = intent_model.IntentModel.load(path)
+    batch = loaded.predict_batch(texts)
+    assert [b[0] for b in batch] == [model.predict(t)[0] for t in texts]
+    assert batch[0][0] == "calendar"
+
+
+@pytest.fixture
+def enabled(model, monkeypatch):
+    monkeypatch.setattr(app_intent_mvp, "_intent_model", model)
+    monkeypatch.setattr(app_intent_mvp, "_intent_model_loaded", True)
+
+
+def test_tier_is_opt_in(monkeypatch):
+    monkeypatch.setattr(app_intent_mvp, "INTENT_MODEL_ENABLED", False)
+    monkeypatch.setattr(app_intent_mvp, "_intent_model", None)
+    monkeypatch.setattr(app_intent_mvp, "_intent_model_loaded", False)
+    assert app_intent_mvp.get_intent_model() is None
+
+
+def test_tier_resolves_rule_unknown_text_with_evidence(enabled, monkeypatch):
+    # ルールが unknown にする文面でも、本文に裏付けがあればモデルの判定で決める（LLM を呼ばない）
+    texts = ("明日の正午に歯医者", "明日3pmに歯医者", "覚えておいて 傘は玄関", "買い物リスト 牛乳")
+    assert all(app_intent_mvp.classify_intent_rule(t).intent == "unknown" for t in texts)
+    cal = app_intent_mvp.classify_intent_model("明日の正午に歯医者")
+    assert cal.intent == "calendar" and cal.suggested_payload["start"].endswith("T12:00:00+09:00")
+    assert "正午" not in cal.suggested_payload["summary"]
+    assert app_intent_mvp.classify_intent_model("明日3pmに歯医者").suggested_payload["start"].endswith("T15:00:00+09:00")
+    memo = app_intent_mvp.classify_intent_model("覚えておいて 傘は玄関")
+    assert memo.intent == "memo" and memo.suggested_payload["values"][0][2] == "覚えておいて 傘は玄関"
+    assert [r.intent for r in app_intent_mvp.classify_intent_model_batch(list(texts))] == \
+        ["calendar", "calendar", "memo", "memo"]
+
+    # 裏付けの無い予定・memo・unknown は書き込みの根拠にしない（LLM へ）
+    for text in ("明日の午後に歯医者", "明日の天気", "牛乳", "こんにちは", "正午のニュース"):
+        assert app_intent_mvp.classify_intent_model(text) is None
+
+    monkeypatch.setattr(app_intent_mvp, "INTENT_MODEL_MIN_CONFIDENCE", 1.01)
+    assert app_intent_mvp.classify_intent_model("明日の正午に歯医者") is None
+
+
+def test_execute_writes_only_evidenced_model_results(enabled, monkeypatch):
+    from fastapi.testclient import TestClient
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    app_intent_mvp.idempotency.clear()
+    client = TestClient(app_intent_mvp.app)
+    for text in ("明日の天気", "明日の午後に歯医者", "牛乳"):
+        assert client.post("/execute", json={"text": text}).status_code == 400
+
+    r = client.post("/execute", json={"text": "控えておいて 部屋番号は305"})
+    assert r.status_code == 200 and r.json()["tool"] == "sheets"  # LLM 無しで書ける
+
+    body = client.post("/intent/route", json={"text": "明日の午後に歯医者"}).json()
+    assert body["intent"] == "unknown" and body["hint"]["intent"] == "calendar"
+
+
+def test_batch_route_sends_unverified_predictions_to_llm(enabled, monkeypatch):
+    sent = []
+    monkeypatch.setattr(app_intent_mvp, "classify_intents_llm_batch",
+                        lambda texts: sent.extend(texts) or [None] * len(texts))
+    res = app_intent_mvp.route_intents_batch(["明日の午後に歯医者", "メモ: A", "記録して 血圧120"])
+    assert [r.intent for r in res] == ["unknown", "memo", "memo"]
+    assert sent == ["明日の午後に歯医者"]
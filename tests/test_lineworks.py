@@ -0,0 +1,36 @@
+# tests/test_lineworks.py
+import asyncio
+import httpx
+
+from tools import lw_client
+from tools.send_text import send_text_to_lineworks
+
+
+def test_send_text_reuses_shared_client(monkeypatch):
+    posted, created = [], []
+
+    def handler(req):
+        posted.append(req)
+        return httpx.Response(200)
+
+    def new_client():
+        created.append(1)
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    monkeypatch.setenv("LINEWORKS_WEBHOOK_URL", "https://example.invalid/hook")
+    monkeypatch.setattr(lw_client, "_new_client", new_client)
+
+    async def main():
+        await lw_client.startup()
+        oks = await asyncio.gather(*[send_text_to_lineworks(f"msg{i}") for i in range(5)])
+        await lw_client.shutdown()
+        return oks
+
+    assert asyncio.run(main()) == [True] * 5
+    assert len(posted) == 5
+    assert len(created) == 1   # 通知ごとに AsyncClient を作らない
+
+
+def test_send_text_without_url_is_skipped(monkeypatch):
+    monkeypatch.delenv("LINEWORKS_WEBHOOK_URL", raising=False)
+    assert asyncio.run(send_text_to_lineworks("x")) is False
@@ -0,0 +1,64 @@
+# tests/test_llm_async.py
+import asyncio, os
+os.environ["DRY_RUN"] = "true"
+
+import pytest
+
+import app_intent_mvp
+import metrics
+
+
+class FakeAsyncOpenAI:
+    def __init__(self, delay=0.0, content='{"intent":"memo","suggested_payload":{"values":[["x"]]}}'):
+        self.delay, self.content, self.calls = delay, content, 0
+        self.chat = type("Chat", (), {"completions": self})()
+
+    async def create(self, **kw):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        msg = type("M", (), {"content": self.content})
+        return type("R", (), {"choices": [type("C", (), {"message": msg})]})
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    client = FakeAsyncOpenAI()
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(app_intent_mvp, "_new_async_llm_client", lambda key: client)
+    app_intent_mvp.llm_cache.clear()
+    metrics.reset()
+    yield client
+    app_intent_mvp.llm_cache.clear()
+    asyncio.run(app_intent_mvp.close_async_llm_client())
+
+
+def test_result_is_returned_and_cached(fake):
+    async def main():
+        a = await app_intent_mvp.classify_intent_llm_async("牛乳")
+        b = await app_intent_mvp.classify_intent_llm_async("牛乳")
+        return a, b
+
+    a, b = asyncio.run(main())
+    assert a.intent == b.intent == "memo" and fake.calls == 1
+
+
+def test_deadline_degrades_to_none(fake, monkeypatch):
+    fake.delay = 1.0
+    monkeypatch.setattr(app_intent_mvp, "INTENT_LLM_TIMEOUT_SEC", 0.05)
+    assert asyncio.run(app_intent_mvp.classify_intent_llm_async("遅い")) is None
+    assert metrics.get("llm_fallback_timeout") == 1
+
+
+def test_concurrency_limit_rejects_overflow(fake, monkeypatch):
+    fake.delay = 0.1
+    monkeypatch.setattr(app_intent_mvp, "INTENT_LLM_MAX_CONCURRENCY", 2)
+
+    async def main():
+        return await asyncio.gather(*(app_intent_mvp.classify_intent_llm_async(f"文{i}") for i in range(5)))
+
+    res = asyncio.run(main())
+    assert sum(r is not None for r in res) == 2
+    assert metrics.get("llm_fallback_rejected") == 3
@@ -0,0 +1,84 @@
+# tests/test_llm_cache.py
+import asyncio, os
+os.environ["DRY_RUN"] = "true"
+
+import pytest
+
+import app_intent_mvp
+from app_intent_mvp import IntentResult
+from llm_cache import LLMCache, cache_key
+
+
+@pytest.fixture(autouse=True)
+def _clear():
+    app_intent_mvp.llm_cache.clear()
+    yield
+    app_intent_mvp.llm_cache.clear()
+
+
+def test_key_normalizes_width_case_and_spaces():
+    assert cache_key("ＡＢＣ　 牛乳を買う ", "m") == cache_key("abc 牛乳を買う", "m")
+    assert cache_key("牛乳", "m1") != cache_key("牛乳", "m2")
+
+
+def test_ttl_expiry_and_stats():
+    now = [1000.0]
+    c = LLMCache(maxsize=2, ttl=10, timer=lambda: now[0])
+    c.set("k", {"intent": "memo"})
+    assert c.get("k") == {"intent": "memo"}
+    now[0] += 11
+    assert c.get("k") is None
+    assert c.stats()["hits"] == 1 and c.stats()["misses"] == 1
+
+
+def test_sqlite_persists_across_instances(tmp_path):
+    path = str(tmp_path / "c.sqlite3")
+    LLMCache(path=path).set("k", {"intent": "calendar", "suggested_payload": None})
+    assert LLMCache(path=path).get("k") == {"intent": "calendar", "suggested_payload": None}
+
+
+def test_single_fallback_is_cached_and_failures_are_not(monkeypatch):
+    calls = []
+
+    class FakeAsyncOpenAI:
+        def __init__(self):
+            self.chat = type("Chat", (), {"completions": self})()
+
+        async def create(self, **kw):
+            calls.append(kw["messages"][-1]["content"])
+            if len(calls) == 1:
+                raise RuntimeError("boom")
+            msg = type("M", (), {"content": '{"intent":"memo","suggested_payload":{"values":[["x"]]}}'})
+            return type("R", (), {"choices": [type("C", (), {"message": msg})]})
+
+        async def close(self):
+            pass
+
+    monkeypatch.setattr(app_intent_mvp, "_new_async_llm_client", lambda key: FakeAsyncOpenAI())
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+
+    async def main():
+        try:
+            return [await app_intent_mvp.classify_intent_llm_async(t) for t in ("牛乳", "牛乳", " 牛乳 ")]
+        finally:
+            await app_intent_mvp.close_async_llm_client()
+
+    first, second, spaced = asyncio.run(main())
+    assert first is None                                  # 失敗はキャッシュしない
+    assert second.intent == spaced.intent == "memo"
+    assert len(calls) == 2
+
+
+def test_batch_only_sends_cache_misses(monkeypatch):
+    chunks = []
+
+    def fake_chunk(client_, texts):
+        chunks.append(list(texts))
+        return [IntentResult(intent="memo") for _ in texts]
+
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(app_intent_mvp, "_llm_classify_chunk", fake_chunk)
+    app_intent_mvp.classify_intents_llm_batch(["牛乳", "卵"])
+    res = app_intent_mvp.classify_intents_llm_batch(["牛乳", "パン", "卵"])
+    assert chunks == [["牛乳", "卵"], ["パン"]]
+    assert [r.intent for r in res] == ["memo", "memo", "memo"]
@@ -0,0 +1,43 @@
+# tests/test_loadgen.py
+import asyncio, csv, os, random
+os.environ["DRY_RUN"] = "true"
+
+import httpx
+import pytest
+
+from benchmarks import loadgen
+
+
+def test_histogram_percentiles_within_relative_error():
+    rnd = random.Random(0)
+    values = sorted(int(rnd.lognormvariate(8, 1.2)) for _ in range(20000))
+    h = loadgen.Histogram()
+    for v in values:
+        h.record(v)
+    for q in (50, 90, 99, 99.9):
+        exact = values[int(q / 100 * len(values)) - 1]
+        assert abs(h.percentile(q) - exact) <= exact / 64 + 1
+    assert h.max == values[-1] and h.min == values[0] and h.total == len(values)
+
+
+def test_parse_weights():
+    assert loadgen.parse_weights("execute=3,intent", loadgen.ENDPOINTS) == [("execute", 3.0), ("intent", 1.0)]
+    with pytest.raises(ValueError):
+        loadgen.parse_weights("nope=1", loadgen.ENDPOINTS)
+
+
+@pytest.mark.parametrize("rate", [0.0, 500.0])
+def test_runs_against_app_in_process(rate, tmp_path):
+    from app_intent_mvp import app
+    cfg = loadgen.LoadConfig(base_url="http://test", endpoints=[("execute", 1), ("intent", 1)],
+                             concurrency=4, rate=rate, requests=40, seed=1)
+    report = asyncio.run(loadgen.LoadGenerator(cfg, transport=httpx.ASGITransport(app=app)).run())
+    assert report["total"]["requests"] == 40 and report["total"]["errors"] == 0
+    assert report["meta"]["mode"] == ("open" if rate else "closed")
+    assert report["total"]["latency_ms"]["p99"] >= report["total"]["latency_ms"]["p50"] > 0
+
+    path = tmp_path / "runs.csv"
+    loadgen.write_csv(str(path), report, label="a")
+    loadgen.write_csv(str(path), report, label="b")
+    rows = list(csv.DictReader(open(path, encoding="utf-8")))
+    assert [r["label"] for r in rows].count("b") == 3  # total + 2 エンドポイント
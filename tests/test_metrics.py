@@ -0,0 +1,83 @@
+# tests/test_metrics.py
+import os
+os.environ["DRY_RUN"] = "true"
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app_intent_mvp
+import metrics
+from app_intent_mvp import app
+
+client = TestClient(app)
+
+
+def test_timer_records_histogram_and_request_timings():
+    metrics.reset()
+    token = metrics.begin_request()
+    with metrics.timer("rule") as st:
+        st["intent"] = "memo"
+    with pytest.raises(ValueError):
+        with metrics.timer("upstream_sheets"):
+            raise ValueError("boom")
+    timings = metrics.end_request(token)
+
+    assert [s for s, _ in timings] == ["rule", "upstream_sheets"]
+    assert metrics.histogram_count(metrics.STAGE_METRIC, stage="rule", intent="memo", outcome="ok") == 1
+    assert metrics.histogram_count(metrics.STAGE_METRIC, stage="upstream_sheets", outcome="error") == 1
+    assert metrics.server_timing([("a", 0.001), ("a", 0.002)]) == "a;dur=3.00"
+
+
+def test_prometheus_text_format():
+    metrics.reset()
+    metrics.inc("llm_fallback_timeout")
+    metrics.inc("execute_requests", intent="memo", outcome="ok")
+    metrics.observe("execute_seconds", 0.003, intent="memo", outcome="ok")
+    text = metrics.render_prometheus()
+    assert "# TYPE llm_fallback_timeout_total counter\nllm_fallback_timeout_total 1" in text
+    assert 'execute_requests_total{intent="memo",outcome="ok"} 1' in text
+    assert 'execute_seconds_bucket{intent="memo",outcome="ok",le="0.005"} 1' in text
+    assert 'execute_seconds_bucket{intent="memo",outcome="ok",le="0.0025"} 0' in text
+    assert 'execute_seconds_count{intent="memo",outcome="ok"} 1' in text
+
+
+def test_execute_exposes_server_timing_and_metrics_endpoint():
+    metrics.reset()
+    app_intent_mvp.idempotency.clear()
+    r = client.post("/execute", json={"text": "メモ: 牛乳"})
+    assert r.status_code == 200
+    stages = [part.split(";")[0] for part in r.headers["server-timing"].split(", ")]
+    assert "rule" in stages and not any(s.startswith("upstream") for s in stages)  # DRY_RUN では上流を呼ばない
+
+    body = client.get("/metrics").text
+    assert 'intent_router_stage_seconds_count{intent="memo",outcome="ok",stage="rule"} 1' in body
+    assert 'execute_requests_total{intent="memo",outcome="ok"} 1' in body
+
+
+def test_upstream_stages_are_named_per_api(monkeypatch):
+    import asyncio
+
+    async def insert_event(calendar_id, body):
+        return {"id": "e1"}
+
+    async def append_values(spreadsheet_id, rng, values):
+        return {"updates": {"updatedCells": 1}}
+
+    monkeypatch.setattr(app_intent_mvp, "DRY_RUN", False)
+    monkeypatch.setattr(app_intent_mvp, "google_rate_limiter", None)
+    monkeypatch.setattr(app_intent_mvp.google_async, "insert_event", insert_event)
+    monkeypatch.setattr(app_intent_mvp.google_async, "append_values", append_values)
+    monkeypatch.setenv("SHEETS_ID", "sid")
+    metrics.reset()
+
+    async def main():
+        token = metrics.begin_request()
+        await app_intent_mvp.create_calendar_event_async(
+            {"summary": "x", "start": "2025-09-01T10:00:00+09:00", "end": "2025-09-01T10:30:00+09:00"})
+        await app_intent_mvp.append_sheets_async([["t", "memo", "x"]])
+        return metrics.end_request(token)
+
+    stages = [s for s, _ in asyncio.run(main())]
+    # Server-Timing でもヒストグラムでも calendar と sheets を分けて見られる
+    assert stages == ["upstream_wait_calendar", "upstream_calendar", "upstream_wait_sheets", "upstream_sheets"]
+    assert metrics.histogram_count(metrics.STAGE_METRIC, stage="upstream_sheets", outcome="ok") == 1
@@ -0,0 +1,65 @@
+# tests/test_notify_queue.py
+import asyncio
+
+from tools.notify_queue import NotifyDispatcher, RetryableSendError, TokenBucket
+
+
+def test_messages_to_same_url_are_coalesced():
+    sent = []
+
+    async def send(url, text):
+        sent.append((url, text))
+
+    async def main():
+        d = NotifyDispatcher(send=send, coalesce_window=0.05, rate_per_sec=100, burst=100)
+        await d.start()
+        assert d.enqueue("a", "u1") and d.enqueue("b", "u1") and d.enqueue("c", "u2")
+        await asyncio.sleep(0.2)
+        await d.stop()
+
+    asyncio.run(main())
+    assert sorted(sent) == [("u1", "a\nb"), ("u2", "c")]
+
+
+def test_retry_with_backoff_then_success():
+    attempts = []
+
+    async def flaky(url, text):
+        attempts.append(text)
+        if len(attempts) < 3:
+            raise RetryableSendError("status=503")
+
+    async def main():
+        d = NotifyDispatcher(send=flaky, coalesce_window=0.01, backoff_base=0.01, rate_per_sec=100, burst=100)
+        await d.start()
+        d.enqueue("x", "u")
+        await d.stop(timeout=2)
+        return d.sent
+
+    assert asyncio.run(main()) == 1
+    assert attempts == ["x", "x", "x"]
+
+
+def test_queue_full_drops_and_stop_drains_pending():
+    sent = []
+
+    async def send(url, text):
+        sent.append(text)
+
+    async def main():
+        d = NotifyDispatcher(send=send, queue_size=2, coalesce_window=10, rate_per_sec=100, burst=100)
+        await d.start()
+        results = [d.enqueue(m, "u") for m in "abc"]
+        await d.stop()          # まとめ待ち（10秒）でも停止時に流れる
+        return results, d.dropped
+
+    results, dropped = asyncio.run(main())
+    assert results == [True, True, False] and dropped == 1
+    assert sent == ["a\nb"]
+
+
+def test_token_bucket_spaces_out_requests():
+    b = TokenBucket(rate=10, burst=2)
+    waits = [b.take() for _ in range(4)]
+    assert waits[:2] == [0.0, 0.0]
+    assert 0.05 < waits[2] <= 0.11 and 0.15 < waits[3] <= 0.21
@@ -0,0 +1,197 @@
+# tests/test_outbox.py
+import asyncio, time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from circuit_breaker import CircuitOpenError
+from google_async import GoogleAPIError
+from outbox import Outbox, OutboxWorker
+from retry_policy import RetryPolicy
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_job_lifecycle_and_lease(tmp_path):
+    clock = Clock()
+    ob = Outbox(str(tmp_path / "ob.sqlite3"), lease_sec=30, timer=clock)
+    jid = ob.enqueue("memo", {"values": [["a", "memo", "牛乳"]]})
+    assert ob.get(jid)["status"] == "pending"
+
+    job = ob.claim()
+    assert job["id"] == jid and job["payload"]["values"][0][2] == "牛乳" and job["attempts"] == 1
+    assert ob.claim() is None                  # running 中は他のワーカーに渡さない
+
+    clock.now += 31                            # ワーカーが落ちてリース切れ → 拾い直せる
+    job2 = ob.claim()
+    assert job2["attempts"] == 2 and job2["claim"] != job["claim"]
+    # 古いワーカーが後から結果を書こうとしても、拾い直した側の状態は上書きしない
+    assert not ob.complete(jid, job["claim"], {"ok": True})
+    assert not ob.renew(jid, job["claim"])
+    assert ob.get(jid)["status"] == "running"
+
+    assert ob.retry_later(jid, job2["claim"], "503 backend error", delay=10)
+    assert ob.claim() is None
+    clock.now += 10
+    job3 = ob.claim()
+    assert not ob.retry_later(jid, job2["claim"], "late", delay=1)  # 前回の claim はもう使えない
+    assert ob.complete(jid, job3["claim"], {"ok": True, "updated": 3})
+    got = ob.get(jid)
+    assert got["status"] == "done" and got["result"] == {"ok": True, "updated": 3}
+    assert ob.stats() == {"pending": 0, "running": 0, "done": 1, "failed": 0}
+
+    clock.now += 100
+    assert ob.purge(older_than_sec=50) == 1 and ob.get(jid) is None
+
+
+def test_jobs_survive_reopen(tmp_path):
+    path = str(tmp_path / "ob.sqlite3")
+    jid = Outbox(path).enqueue("calendar", {"summary": "商談"})
+    assert Outbox(path).claim()["id"] == jid   # 再起動後の別インスタンスから見える
+
+
+def _worker(ob, handler, **kw):
+    return OutboxWorker(ob, {"memo": handler}, concurrency=1, poll_interval=0.01,
+                        backoff=RetryPolicy("outbox", base=0.0, cap=0.0), **kw)
+
+
+def test_worker_retries_retryable_errors_then_succeeds(tmp_path):
+    ob = Outbox(str(tmp_path / "ob.sqlite3"))
+    calls = []
+
+    async def handler(payload):
+        calls.append(payload)
+        if len(calls) == 1:
+            raise GoogleAPIError(503, "backend error")
+        if len(calls) == 2:
+            raise CircuitOpenError("sheets", 0.0)
+        return {"ok": True}
+
+    w = _worker(ob, handler)
+    jid = ob.enqueue("memo", {"values": [["x"]]})
+
+    async def main():
+        for _ in range(3):
+            assert await w.run_once()
+        assert not await w.run_once()
+
+    asyncio.run(main())
+    job = ob.get(jid)
+    assert job["status"] == "done" and job["attempts"] == 3 and len(calls) == 3
+
+
+def test_worker_fails_on_client_error_and_after_max_attempts(tmp_path):
+    ob = Outbox(str(tmp_path / "ob.sqlite3"))
+
+    async def bad_request(payload):
+        raise GoogleAPIError(400, "Unable to parse range")
+
+    async def always_down(payload):
+        raise GoogleAPIError(503, "backend error")
+
+    async def main():
+        j1 = ob.enqueue("memo", {})
+        await _worker(ob, bad_request).run_once()
+        j2 = ob.enqueue("memo", {})
+        w = _worker(ob, always_down, max_attempts=2)
+        await w.run_once(); await w.run_once()
+        return j1, j2
+
+    j1, j2 = asyncio.run(main())
+    assert ob.get(j1)["status"] == "failed" and "Unable to parse range" in ob.get(j1)["error"]
+    assert ob.get(j2)["status"] == "failed" and ob.get(j2)["attempts"] == 2
+
+
+def test_execute_returns_202_and_job_is_delivered(monkeypatch, tmp_path):
+    import app_intent_mvp
+    ob = Outbox(str(tmp_path / "ob.sqlite3"))
+    delivered = []
+
+    async def fake_append(values):
+        delivered.append(values)
+        return {"ok": True, "updated": 3}
+
+    monkeypatch.setattr(app_intent_mvp, "OUTBOX_ENABLED", True)
+    monkeypatch.setattr(app_intent_mvp, "outbox_store", ob)
+    monkeypatch.setattr(app_intent_mvp, "outbox_worker", OutboxWorker(
+        ob, {"calendar": app_intent_mvp._deliver_calendar, "memo": app_intent_mvp._deliver_memo},
+        concurrency=2, poll_interval=0.05))
+    monkeypatch.setattr(app_intent_mvp, "append_sheets_async", fake_append)
+    app_intent_mvp.idempotency.clear()
+
+    with TestClient(app_intent_mvp.app) as client:
+        r = client.post("/execute", json={"text": "メモ: アウトボックス経由"})
+        assert r.status_code == 202
+        body = r.json()
+        assert body["accepted"] and body["tool"] == "sheets" and body["status_url"] == f"/jobs/{body['job_id']}"
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            job = client.get(body["status_url"]).json()
+            if job["status"] == "done":
+                break
+            time.sleep(0.02)
+        assert job["status"] == "done" and job["result"]["updated"] == 3
+        assert delivered and delivered[0][0][-1] == "アウトボックス経由"
+        assert client.get("/health").json()["outbox"]["done"] == 1
+        assert client.get("/jobs/nope").status_code == 404
+
+
+def test_lease_is_renewed_while_delivering(tmp_path):
+    ob = Outbox(str(tmp_path / "ob.sqlite3"), lease_sec=0.3)
+    stolen = []
+
+    async def slow(payload):
+        for _ in range(4):  # リースより長くかかる配送
+            await asyncio.sleep(0.15)
+            stolen.append(await asyncio.to_thread(ob.claim))
+        return {"ok": True}
+
+    jid = ob.enqueue("memo", {"values": [["x"]]})
+    asyncio.run(_worker(ob, slow).run_once())
+    assert stolen == [None] * 4                # 延長されているので別のワーカーには拾われない
+    job = ob.get(jid)
+    assert job["status"] == "done" and job["attempts"] == 1
+
+
+def test_non_idempotent_kind_is_not_redelivered_after_5xx(tmp_path):
+    from outbox import is_retryable_unsent
+    ob = Outbox(str(tmp_path / "ob.sqlite3"))
+
+    async def append_5xx(payload):
+        raise GoogleAPIError(503, "backend error")  # 行は書けているかもしれない
+
+    async def append_429(payload):
+        raise GoogleAPIError(429, "rate limit")
+
+    async def main():
+        j1 = ob.enqueue("memo", {})
+        await _worker(ob, append_5xx, retryable={"memo": is_retryable_unsent}).run_once()
+        j2 = ob.enqueue("memo", {})
+        await _worker(ob, append_429, retryable={"memo": is_retryable_unsent}).run_once()
+        return j1, j2
+
+    j1, j2 = asyncio.run(main())
+    assert ob.get(j1)["status"] == "failed"
+    assert ob.get(j2)["status"] == "pending"
+
+
+def test_calendar_job_gets_event_id_at_enqueue(monkeypatch, tmp_path):
+    import app_intent_mvp
+    ob = Outbox(str(tmp_path / "ob.sqlite3"))
+    monkeypatch.setattr(app_intent_mvp, "OUTBOX_ENABLED", True)
+    monkeypatch.setattr(app_intent_mvp, "outbox_store", ob)
+    monkeypatch.setattr(app_intent_mvp, "outbox_worker", OutboxWorker(ob, {}))
+
+    body, status = asyncio.run(app_intent_mvp._execute_text("明日10時に商談30分"))
+    assert status == 202
+    job = ob.claim()
+    event_id = job["payload"]["id"]
+    assert len(event_id) == 32
+    # 配送し直しても同じ id で登録する
+    assert app_intent_mvp._event_body(job["payload"])["id"] == event_id
@@ -0,0 +1,214 @@
+# tests/test_priority_scheduler.py
+import asyncio, threading, time
+
+import pytest
+
+import metrics
+import priority_scheduler
+from priority_scheduler import BULK, DEFAULT, INTERACTIVE, ClassConfig, PriorityScheduler
+
+
+def _sched(total=1, bulk_cap=None, **weights):
+    w = {INTERACTIVE: 4, DEFAULT: 2, BULK: 1, **weights}
+    return PriorityScheduler({
+        INTERACTIVE: ClassConfig(w[INTERACTIVE], total),
+        DEFAULT: ClassConfig(w[DEFAULT], total),
+        BULK: ClassConfig(w[BULK], bulk_cap or total),
+    }, total)
+
+
+def test_weighted_fair_order():
+    s = _sched(total=1)
+    order = []
+
+    async def job(cls):
+        async with s.aslot(cls):
+            order.append(cls)
+            await asyncio.sleep(0)
+
+    async def main():
+        await s.aacquire(DEFAULT)               # 枠を塞いでから両クラスを溜める
+        tasks = [asyncio.create_task(job(BULK)) for _ in range(10)]
+        tasks += [asyncio.create_task(job(INTERACTIVE)) for _ in range(10)]
+        await asyncio.sleep(0.01)
+        assert s.stats()["classes"][BULK]["queued"] == 10
+        s.release(DEFAULT)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    # bulk が先に溜まっていても、重み 4:1 で interactive が先に通る
+    assert order[:5].count(INTERACTIVE) == 4
+    assert order[:10].count(INTERACTIVE) == 8
+    assert sorted(order) == sorted([BULK] * 10 + [INTERACTIVE] * 10)
+
+
+def test_class_cap_keeps_room_for_interactive():
+    s = _sched(total=4, bulk_cap=2)
+    running = {BULK: 0, INTERACTIVE: 0}
+    peak = {BULK: 0, INTERACTIVE: 0}
+    bulk_done = [0]
+    done_before_interactive = []
+
+    async def job(cls, dur):
+        async with s.aslot(cls):
+            if cls == INTERACTIVE:
+                done_before_interactive.append(bulk_done[0])
+            running[cls] += 1
+            peak[cls] = max(peak[cls], running[cls])
+            await asyncio.sleep(dur)
+            running[cls] -= 1
+        if cls == BULK:
+            bulk_done[0] += 1
+
+    async def main():
+        bulk = [asyncio.create_task(job(BULK, 0.02)) for _ in range(20)]
+        await asyncio.sleep(0.005)
+        await asyncio.gather(*[job(INTERACTIVE, 0.001) for _ in range(2)])
+        await asyncio.gather(*bulk)
+
+    asyncio.run(main())
+    assert peak[BULK] == 2                       # 一括処理は cap を超えない
+    assert done_before_interactive == [0, 0]     # 一括処理の枠が空くのを待たずに通る
+
+
+def test_cancelled_waiter_leaves_queue():
+    s = _sched(total=1)
+
+    async def main():
+        await s.aacquire(DEFAULT)
+        t = asyncio.create_task(s.aacquire(BULK))
+        await asyncio.sleep(0)
+        t.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await t
+        assert s.stats()["classes"][BULK]["queued"] == 0
+        s.release(DEFAULT)
+        assert s.stats()["running"] == 0
+
+    asyncio.run(main())
+
+
+def test_threads_and_event_loop_share_slots():
+    s = _sched(total=2)
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def work():
+        with s.slot(BULK):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.01)
+            with lock:
+                active[0] -= 1
+
+    async def main():
+        threads = [threading.Thread(target=work) for _ in range(6)]
+        for t in threads: t.start()
+        async with s.aslot(INTERACTIVE):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            await asyncio.sleep(0.01)
+            with lock:
+                active[0] -= 1
+        await asyncio.to_thread(lambda: [t.join() for t in threads])
+
+    asyncio.run(main())
+    assert peak[0] <= 2 and s.stats()["running"] == 0
+
+
+def test_priority_context_and_metrics(monkeypatch):
+    metrics.reset()
+    s = _sched(total=2)
+    monkeypatch.setattr(priority_scheduler, "scheduler", s)
+
+    async def main():
+        with priority_scheduler.priority(INTERACTIVE):
+            # to_thread 先にもクラスが引き継がれる
+            assert await asyncio.to_thread(priority_scheduler.current) == INTERACTIVE
+            async with priority_scheduler.aslot():
+                assert s.stats()["classes"][INTERACTIVE]["running"] == 1
+        assert priority_scheduler.current() == DEFAULT
+
+    asyncio.run(main())
+    assert metrics.get("scheduler_started", **{"class": INTERACTIVE}) == 1
+    assert metrics.histogram_count("scheduler_wait_seconds", **{"class": INTERACTIVE}) == 1
+    assert metrics.gauge("scheduler_running", **{"class": INTERACTIVE}) == 0
+    assert "# TYPE scheduler_queue_depth gauge" in metrics.render_prometheus()
+
+    with pytest.raises(ValueError):
+        s.acquire("urgent")
+
+
+def test_interactive_create_during_bulk_batch(monkeypatch, tmp_path):
+    import app_intent_mvp
+    import circuit_breaker
+    from rate_limiter import Limit, RateLimiter
+    from retry_policy import RetryPolicy
+
+    ev = {"summary": "早番", "start": "2025-09-01T09:00:00+09:00", "end": "2025-09-01T17:00:00+09:00"}
+    started = threading.Event()
+
+    class Req:
+        def __init__(self, body):
+            self.body = body
+
+        def execute(self):
+            time.sleep(0.05)
+            return {"id": self.body["id"], "htmlLink": "https://example.invalid"}
+
+    class Batch:
+        def __init__(self, callback):
+            self.callback, self.items = callback, []
+
+        def add(self, req, request_id):
+            self.items.append((request_id, req))
+
+        def execute(self):
+            started.set()
+            time.sleep(0.1)  # 一括登録の1バッチ（この間は枠を占有している）
+            for rid, req in self.items:
+                self.callback(rid, {"id": req.body["id"], "htmlLink": "https://example.invalid"}, None)
+
+    class Service:
+        def new_batch_http_request(self, callback):
+            return Batch(callback)
+
+        def events(self):
+            return self
+
+        def insert(self, calendarId, body):
+            return Req(body)
+
+    # 枠は1つだけ、レート制限は取り置き3。ブレーカは 0.2 秒を超えた呼び出しが1回でもあれば open
+    breaker = circuit_breaker.CircuitBreaker("calendar-bulk-test", min_calls=1, slow_call_sec=0.2)
+    rl = RateLimiter(str(tmp_path / "rl.sqlite3"), {"calendar": Limit(rate=20.0, burst=10.0, reserve=3.0)},
+                     max_wait=0)
+    monkeypatch.setattr(priority_scheduler, "scheduler", _sched(total=1))
+    monkeypatch.setattr(app_intent_mvp, "DRY_RUN", False)
+    monkeypatch.setattr(app_intent_mvp, "get_google_creds", lambda: object())
+    monkeypatch.setattr(app_intent_mvp, "calendar_service", lambda creds: Service())
+    monkeypatch.setattr(app_intent_mvp, "google_rate_limiter", rl)
+    monkeypatch.setattr(app_intent_mvp, "CALENDAR_RETRY", RetryPolicy("calendar", breaker=breaker))
+
+    bulk = []
+
+    def run_bulk():
+        with priority_scheduler.priority(BULK):
+            bulk.extend(app_intent_mvp.create_calendar_events_batch([ev] * 20, batch_size=5))
+
+    t = threading.Thread(target=run_bulk)
+    t.start()
+    assert started.wait(5)
+    with priority_scheduler.priority(INTERACTIVE):
+        t0 = time.perf_counter()
+        # 一括登録が先のトークンを予約していないので max_wait=0 でも弾かれず、枠は次に空いた時に取れる
+        created = app_intent_mvp.create_calendar_event(ev)
+        elapsed = time.perf_counter() - t0
+    t.join(10)
+
+    assert created["id"] and elapsed < 0.5
+    assert len(bulk) == 20 and all(r["ok"] for r in bulk)
+    # 枠待ち・トークン待ちはブレーカに数えられていない
+    assert breaker.snapshot() == {"state": "closed", "calls": 5, "failure_rate": 0.0}
@@ -0,0 +1,168 @@
+# tests/test_rate_limiter.py
+import asyncio
+import multiprocessing
+import sqlite3
+
+import pytest
+
+from rate_limiter import Limit, RateLimitedError, RateLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _limiter(tmp_path, clock=None, **kw):
+    return RateLimiter(str(tmp_path / "rl.sqlite3"), {"sheets": Limit(rate=1.0, burst=2.0)},
+                       timer=clock or Clock(), **kw)
+
+
+def test_burst_then_wait_then_reject(tmp_path):
+    clock = Clock()
+    rl = _limiter(tmp_path, clock, max_wait=1.5)
+    assert rl.reserve("sheets", "u1") == 0.0
+    assert rl.reserve("sheets", "u1") == 0.0
+    assert rl.reserve("sheets", "u1") == pytest.approx(1.0)   # 1秒後に補充される分を前借り
+    with pytest.raises(RateLimitedError) as ei:
+        rl.reserve("sheets", "u1")                             # 2秒待ちは max_wait 超え → 即失敗
+    assert ei.value.retry_after == pytest.approx(0.5)
+    clock.now += 3
+    assert rl.reserve("sheets", "u1") == 0.0
+
+
+def test_buckets_are_per_api_and_credential(tmp_path):
+    rl = _limiter(tmp_path, max_wait=0)
+    rl.reserve("sheets", "u1")
+    rl.reserve("sheets", "u1")
+    with pytest.raises(RateLimitedError):
+        rl.reserve("sheets", "u1")
+    assert rl.reserve("sheets", "u2") == 0.0      # 別の認証情報は別の予算
+    assert rl.reserve("calendar", "u1") == 0.0    # 制限の無い API は素通し
+
+
+def test_batch_reserves_n_tokens(tmp_path):
+    rl = _limiter(tmp_path)
+    assert rl.reserve("sheets", "u1", n=5, max_wait=float("inf")) == pytest.approx(3.0)
+
+
+def test_state_is_shared_between_instances(tmp_path):
+    # 別ワーカー相当：同じファイルを指す別インスタンス
+    clock = Clock()
+    a, b = _limiter(tmp_path, clock, max_wait=0), _limiter(tmp_path, clock, max_wait=0)
+    a.reserve("sheets", "u1")
+    b.reserve("sheets", "u1")
+    with pytest.raises(RateLimitedError):
+        a.reserve("sheets", "u1")
+
+
+def _worker(path, n, out):
+    rl = RateLimiter(path, {"sheets": Limit(rate=0.001, burst=10.0)}, max_wait=0)
+    ok = 0
+    for _ in range(n):
+        try:
+            rl.reserve("sheets", "u1")
+            ok += 1
+        except RateLimitedError:
+            pass
+    out.put(ok)
+
+
+def test_processes_share_one_budget(tmp_path):
+    path = str(tmp_path / "rl.sqlite3")
+    ctx = multiprocessing.get_context("spawn")
+    out = ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(path, 8, out)) for _ in range(3)]
+    for p in procs: p.start()
+    for p in procs: p.join(30)
+    assert sum(out.get(timeout=5) for _ in procs) == 10
+
+
+def test_async_acquire_waits(tmp_path):
+    rl = RateLimiter(str(tmp_path / "rl.sqlite3"), {"sheets": Limit(rate=50.0, burst=1.0)})
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        await rl.aacquire("sheets", "u1")
+        await rl.aacquire("sheets", "u1")
+        return loop.time() - t0
+
+    assert asyncio.run(main()) >= 0.015
+
+
+def test_async_acquire_does_not_block_the_loop_on_a_locked_file(tmp_path):
+    path = str(tmp_path / "rl.sqlite3")
+    rl = RateLimiter(path, {"sheets": Limit(rate=1.0, burst=5.0, reserve=2.0)})
+    rl.reset()  # テーブルを作っておく
+    holder = sqlite3.connect(path, isolation_level=None)
+    holder.execute("BEGIN IMMEDIATE")  # 別のワーカーが更新中
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        # ループが止まっていると COMMIT できず、busy timeout まで詰まる
+        asyncio.get_running_loop().call_later(0.3, holder.execute, "COMMIT")
+        await rl.aacquire("sheets", "u1")
+        await rl.aacquire("sheets", "u1", 2, interactive=False)
+        task.cancel()
+        return ticks
+
+    assert asyncio.run(main()) >= 10
+
+
+def test_execute_returns_503_when_rate_limited(monkeypatch, tmp_path):
+    from fastapi.testclient import TestClient
+    import app_intent_mvp
+
+    rl = RateLimiter(str(tmp_path / "rl.sqlite3"), {"calendar": Limit(rate=0.1, burst=0.0)}, max_wait=0)
+    monkeypatch.setattr(app_intent_mvp, "DRY_RUN", False)
+    monkeypatch.setattr(app_intent_mvp, "google_rate_limiter", rl)
+    monkeypatch.setattr(app_intent_mvp.google_async, "insert_event",
+                        lambda *a: pytest.fail("上流を呼んではいけない"))
+    app_intent_mvp.idempotency.clear()
+    r = TestClient(app_intent_mvp.app).post("/execute", json={"text": "明日10時に商談30分"})
+    assert r.status_code == 503
+    assert r.headers["Retry-After"] == "10"
+
+
+def test_bulk_takes_pieces_and_leaves_reserve_for_interactive(tmp_path):
+    clock = Clock()
+    slept = []
+
+    def sleep(sec):
+        slept.append(sec)
+        clock.now += sec
+
+    rl = RateLimiter(str(tmp_path / "rl.sqlite3"), {"calendar": Limit(rate=5.0, burst=10.0, reserve=3.0)},
+                     timer=clock, sleep=sleep, max_wait=0)
+    # 50件の一括登録：前借りせず、取り置き3を残して7個ずつ取りながら補充を待つ
+    rl.acquire("calendar", "u1", 50, max_wait=float("inf"), interactive=False)
+    assert sum(slept) == pytest.approx((50 - 7) / 5.0)
+    assert all(w <= 7 / 5.0 + 1e-9 for w in slept)
+    # 直後でも interactive は取り置きから待たずに取れる（一括登録が先の分を予約していない）
+    for _ in range(3):
+        assert rl.reserve("calendar", "u1") == 0.0
+    with pytest.raises(RateLimitedError):
+        rl.reserve("calendar", "u1")
+
+
+def test_bulk_does_not_borrow(tmp_path):
+    clock = Clock()
+    rl = RateLimiter(str(tmp_path / "rl.sqlite3"), {"sheets": Limit(rate=1.0, burst=5.0, reserve=2.0)},
+                     timer=clock, sleep=lambda s: None)
+    rl.acquire("sheets", "u1", 3, interactive=False)
+    with pytest.raises(RateLimitedError) as ei:
+        rl.acquire("sheets", "u1", 1, max_wait=0.5, interactive=False)  # 取り置きには手を付けない
+    assert ei.value.retry_after == pytest.approx(1.0)
+    assert rl.reserve("sheets", "u1", 2, max_wait=0) == 0.0
@@ -0,0 +1,221 @@
+# tests/test_retry_policy.py
+import asyncio
+from datetime import datetime, timezone
+
+import httpx
+import pytest
+
+import metrics
+import retry_policy
+from google_async import GoogleAPIError
+from retry_policy import RetryPolicy
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def sleep(self, sec):
+        self.slept.append(sec)
+        self.now += sec
+
+    async def asleep(self, sec):
+        self.sleep(sec)
+
+
+def _policy(clock, **kw):
+    kw.setdefault("rand", lambda: 1.0)  # jitter の上限をそのまま使う
+    return RetryPolicy("test", timer=lambda: clock.now, sleep=clock.sleep, asleep=clock.asleep, **kw)
+
+
+class FakeResp(dict):
+    def __init__(self, status, headers=None):
+        super().__init__(headers or {})
+        self.status = status
+
+
+class FakeHttpError(Exception):
+    """googleapiclient.errors.HttpError と同じく resp.status / resp（小文字ヘッダの dict）を持つ"""
+    def __init__(self, status, headers=None):
+        super().__init__(f"<HttpError {status}>")
+        self.resp = FakeResp(status, headers)
+
+
+def _flaky(errors, result="ok"):
+    calls = []
+    def fn():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return fn, calls
+
+
+def test_classification_by_status_not_message():
+    req = httpx.Request("GET", "https://example.invalid")
+    assert retry_policy.reason_of(FakeHttpError(503)) == "503"
+    assert retry_policy.reason_of(GoogleAPIError(429, "Rate Limit")) == "429"
+    assert retry_policy.reason_of(httpx.HTTPStatusError("x", request=req, response=httpx.Response(502))) == "502"
+    assert retry_policy.reason_of(httpx.ConnectError("refused", request=req)) == "transport"
+    # 本文に "5" や "500" が含まれていても、ステータスが 4xx なら再試行しない
+    assert retry_policy.reason_of(GoogleAPIError(400, "row 500 is invalid")) is None
+    assert retry_policy.reason_of(FakeHttpError(403)) is None
+    assert retry_policy.reason_of(ValueError("5 errors")) is None
+
+
+def test_retry_after_seconds_and_http_date():
+    assert retry_policy.retry_after_of(GoogleAPIError(429, "x", {"retry-after": "7"})) == 7.0
+    now = datetime(2025, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
+    e = FakeHttpError(503, {"retry-after": "Wed, 01 Jan 2025 00:00:30 GMT"})
+    assert retry_policy.retry_after_of(e, now=now) == 30.0
+    assert retry_policy.retry_after_of(GoogleAPIError(429, "x")) is None
+
+
+def test_exponential_backoff_with_full_jitter():
+    clock = FakeClock()
+    fn, calls = _flaky([FakeHttpError(503)] * 3)
+    p = _policy(clock, base=0.1, cap=0.3, max_attempts=4)
+    assert p.call(fn) == "ok"
+    assert len(calls) == 4
+    assert clock.slept == pytest.approx([0.1, 0.2, 0.3])  # 上限 cap で頭打ち
+
+    # jitter は [0, 上限) の一様乱数
+    p = _policy(clock, base=1.0, cap=8.0, rand=lambda: 0.25)
+    assert p.backoff(3) == 2.0
+
+
+def test_non_retryable_error_is_raised_immediately():
+    clock = FakeClock()
+    fn, calls = _flaky([GoogleAPIError(400, "Unable to parse range")])
+    with pytest.raises(GoogleAPIError):
+        _policy(clock).call(fn)
+    assert len(calls) == 1 and clock.slept == []
+
+
+def test_retry_after_is_honored_and_budget_stops_retries():
+    metrics.reset()
+    clock = FakeClock()
+    fn, calls = _flaky([GoogleAPIError(429, "x", {"retry-after": "2"})] * 5)
+    with pytest.raises(GoogleAPIError) as ei:
+        _policy(clock, base=0.01, budget=5.0, max_attempts=10).call(fn)
+    assert ei.value.status == 429                  # 最後の例外がそのまま出る
+    assert clock.slept == [2.0, 2.0]               # 3回目の待ちで予算 5 秒を超えるので諦める
+    assert len(calls) == 3
+    assert metrics.get("upstream_retries", api="test", reason="429") == 2
+    assert metrics.get("upstream_retry_exhausted", api="test", reason="budget") == 1
+
+
+def test_attempts_limit():
+    clock = FakeClock()
+    fn, calls = _flaky([FakeHttpError(500)] * 5)
+    with pytest.raises(FakeHttpError):
+        _policy(clock, max_attempts=2).call(fn)
+    assert len(calls) == 2
+
+
+def test_async_call():
+    clock = FakeClock()
+    req = httpx.Request("POST", "https://example.invalid")
+    errors = [httpx.ReadTimeout("slow", request=req)]
+
+    async def fn(x):
+        if errors:
+            raise errors.pop()
+        return x * 2
+
+    assert asyncio.run(_policy(clock).acall(fn, 21)) == 42
+    assert len(clock.slept) == 1
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.setenv("RETRY_MAX_ATTEMPTS", "6")
+    monkeypatch.setenv("RETRY_SHEETS_BUDGET_SEC", "3")
+    p = retry_policy.from_env("sheets", base=0.5)
+    assert (p.max_attempts, p.budget, p.base) == (6, 3.0, 0.5)
+    assert retry_policy.from_env("calendar").budget == 10.0
+
+
+def test_calendar_event_async_retries_5xx(monkeypatch):
+    import app_intent_mvp
+    clock = FakeClock()
+    calls = []
+
+    async def insert_event(calendar_id, body):
+        calls.append(body)
+        if len(calls) == 1:
+            raise GoogleAPIError(503, "backend error")
+        return {"id": "e1", "htmlLink": "https://example.invalid"}
+
+    monkeypatch.setattr(app_intent_mvp, "DRY_RUN", False)
+    monkeypatch.setattr(app_intent_mvp.google_async, "insert_event", insert_event)
+    monkeypatch.setattr(app_intent_mvp, "CALENDAR_RETRY", _policy(clock, base=0.01))
+    out = asyncio.run(app_intent_mvp.create_calendar_event_async(
+        {"summary": "商談", "start": "2025-09-01T10:00:00+09:00", "end": "2025-09-01T10:30:00+09:00"}))
+    assert out["id"] == "e1" and len(calls) == 2
+
+
+def test_calendar_endpoint_maps_status(monkeypatch):
+    from fastapi.testclient import TestClient
+    import app as app_module
+
+    async def denied(body):
+        raise GoogleAPIError(403, "insufficient permissions")
+
+    async def down(body):
+        raise GoogleAPIError(503, "backend error")
+
+    ev = {"summary": "x", "start": "2025-09-01T10:00:00+09:00", "end": "2025-09-01T10:30:00+09:00"}
+    with TestClient(app_module.app) as client:
+        monkeypatch.setattr(app_module, "create_event", denied)
+        assert client.post("/calendar/events", json=ev).status_code == 403
+        monkeypatch.setattr(app_module, "create_event", down)
+        assert client.post("/calendar/events", json=ev).status_code == 503
+
+
+def test_unsent_only_classification():
+    req = httpx.Request("POST", "https://example.invalid")
+    assert retry_policy.reason_if_unsent(GoogleAPIError(429, "Rate Limit")) == "429"
+    assert retry_policy.reason_if_unsent(httpx.ConnectError("refused", request=req)) == "connect"
+    # 送った後の失敗（読み取りタイムアウト・5xx）は二重書き込みになり得るので再試行しない
+    assert retry_policy.reason_if_unsent(httpx.ReadTimeout("slow", request=req)) is None
+    assert retry_policy.reason_if_unsent(FakeHttpError(503)) is None
+
+    clock = FakeClock()
+    fn, calls = _flaky([FakeHttpError(503)])
+    with pytest.raises(FakeHttpError):
+        _policy(clock, classify=retry_policy.reason_if_unsent).call(fn)
+    assert len(calls) == 1
+    fn, calls = _flaky([FakeHttpError(429)])
+    assert _policy(clock, classify=retry_policy.reason_if_unsent).call(fn) == "ok" and len(calls) == 2
+
+
+def test_guard_waits_outside_breaker():
+    from contextlib import asynccontextmanager, contextmanager
+    import circuit_breaker
+
+    breaker = circuit_breaker.CircuitBreaker("guarded", slow_call_sec=0.05)
+    clock = FakeClock()
+    policy = _policy(clock, breaker=breaker)
+    entered = []
+
+    @contextmanager
+    def guard():
+        entered.append(1)
+        import time; time.sleep(0.1)  # レート制限・同時実行枠の待ち
+        yield
+
+    @asynccontextmanager
+    async def aguard():
+        await asyncio.sleep(0.1)
+        yield
+
+    fn, calls = _flaky([FakeHttpError(503)])
+    assert policy.call_guarded(guard, fn) == "ok"
+    assert len(entered) == 2 and len(calls) == 2  # 試行ごとに guard に入り直す
+
+    async def fast():
+        return "ok"
+    assert asyncio.run(policy.acall_guarded(aguard, fast)) == "ok"
+    # 待ちは遅い呼び出しに数えられない（1回目の 503 だけが失敗）
+    assert breaker.snapshot()["calls"] == 3 and breaker.snapshot()["failure_rate"] == 0.333
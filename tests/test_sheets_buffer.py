@@ -0,0 +1,59 @@
+# tests/test_sheets_buffer.py
+import threading
+import pytest
+
+from sheets_buffer import SheetsAppendBuffer
+
+
+def _fake_append(calls):
+    def flush(rows):
+        calls.append(rows)
+        return {"updated": sum(len(r) for r in rows), "range": f"Sheet1!A10:C{9 + len(rows)}"}
+    return flush
+
+
+def test_concurrent_rows_are_coalesced():
+    calls = []
+    buf = SheetsAppendBuffer(_fake_append(calls), max_rows=100, max_delay=0.2)
+    futs = []
+    lock = threading.Lock()
+
+    def worker(i):
+        f = buf.submit([[f"ts{i}", "memo", f"body{i}"]])
+        with lock:
+            futs.append((i, f))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(20)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    results = [f.result(timeout=2) for _, f in futs]
+    assert len(calls) == 1 and len(calls[0]) == 20
+    assert all(r["ok"] and r["updated"] == 3 and r["batched"] == 20 for r in results)
+    # 各呼び出し元には自分の1行ぶんの範囲が返る
+    assert sorted(r["range"] for r in results) == sorted(f"Sheet1!A{n}:C{n}" for n in range(10, 30))
+    buf.close()
+
+
+def test_max_rows_triggers_flush_and_close_drains():
+    calls = []
+    buf = SheetsAppendBuffer(_fake_append(calls), max_rows=2, max_delay=60)
+    f1 = buf.submit([["a"], ["b"]])
+    assert f1.result(timeout=2)["updated"] == 2   # 行数しきい値で即フラッシュ
+    f2 = buf.submit([["c"]])
+    buf.close()                                   # 待ち時間前でも停止時に流れる
+    assert f2.result(timeout=2)["range"] == "Sheet1!A10:C10"
+    assert len(calls) == 2
+    with pytest.raises(RuntimeError):
+        buf.submit([["d"]])
+
+
+def test_flush_error_is_propagated_to_each_caller():
+    def boom(rows):
+        raise RuntimeError("quota exceeded")
+    buf = SheetsAppendBuffer(boom, max_rows=2, max_delay=0.05)
+    futs = [buf.submit([["x"]]), buf.submit([["y"]])]
+    for f in futs:
+        with pytest.raises(RuntimeError, match="quota"):
+            f.result(timeout=2)
+    buf.close()
@@ -0,0 +1,93 @@
+# tests/test_single_flight.py
+import asyncio, os
+os.environ["DRY_RUN"] = "true"
+
+import pytest
+
+import app_intent_mvp
+import metrics
+from app_intent_mvp import IntentResult
+from single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_run():
+    metrics.reset()
+    sf = SingleFlight("t")
+    runs = []
+
+    async def work(v):
+        runs.append(v)
+        await asyncio.sleep(0.02)
+        return v
+
+    async def main():
+        got = await asyncio.gather(*[sf.do("k", lambda: work(1)) for _ in range(5)], sf.do("other", lambda: work(2)))
+        assert len(sf) == 0                       # 終わったら忘れる
+        assert await sf.do("k", lambda: work(3)) == 3
+        return got
+
+    assert asyncio.run(main()) == [1, 1, 1, 1, 1, 2]
+    assert runs == [1, 2, 3]
+    assert metrics.get("singleflight_coalesced", op="t") == 4
+
+
+def test_errors_are_shared_and_cancelled_leader_does_not_cancel_followers():
+    sf = SingleFlight("t")
+
+    async def boom():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream")
+
+    async def slow():
+        await asyncio.sleep(0.02)
+        return "ok"
+
+    async def main():
+        results = await asyncio.gather(sf.do("e", boom), sf.do("e", boom), return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results)
+
+        leader = asyncio.create_task(sf.do("s", slow))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(sf.do("s", slow))
+        await asyncio.sleep(0)
+        leader.cancel()                           # 先行リクエストの切断
+        assert await follower == "ok"
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+    asyncio.run(main())
+
+
+def test_route_coalesces_identical_unknown_texts(monkeypatch):
+    metrics.reset()
+    calls = []
+
+    async def fake_fallback(text):
+        calls.append(text)
+        with metrics.timer("llm"):
+            await asyncio.sleep(0.05)
+        return IntentResult(intent="memo", suggested_payload={"values": [[text.strip()]]})
+
+    monkeypatch.setattr(app_intent_mvp, "classify_intent_fallback", fake_fallback)
+
+    async def one(text):
+        token = metrics.begin_request()
+        try:
+            res = await app_intent_mvp.route({"text": text})
+        finally:
+            timings = metrics.end_request(token)
+        return res, timings
+
+    async def main():
+        # 前後の空白違いは同じ文面としてまとめるが、全角・大文字違いは payload が変わるのでまとめない
+        texts = ["あれやっといて"] * 4 + ["あれやっといて　", "ほかの話", "ＡＢＣやっといて", "abcやっといて"]
+        return await asyncio.gather(*[one(t) for t in texts])
+
+    responses = asyncio.run(main())
+    assert sorted(calls) == sorted(["あれやっといて", "ほかの話", "ＡＢＣやっといて", "abcやっといて"])
+    assert all(b'"intent":"memo"' in r.body for r, _ in responses)
+    assert "ＡＢＣやっといて".encode() in responses[6][0].body and b"abc" in responses[7][0].body
+    assert metrics.get("singleflight_coalesced", op="classify") == 4
+    # 待っていただけのリクエストの Server-Timing にも共有した判定の時間が載る（集計は実行した回数だけ）
+    assert all({stage for stage, _ in timings} == {"rule", "llm"} for _, timings in responses)
+    assert metrics.histogram_count(metrics.STAGE_METRIC, stage="llm", outcome="ok") == 4
@@ -0,0 +1,228 @@
+# tests/test_tenant_store.py
+import asyncio, json, sqlite3, threading, time
+
+import pytest
+
+import metrics
+import tenant_store
+from outbox import Outbox
+from tenant_store import TenantCreds, TokenStore
+
+
+class FakeCreds:
+    def __init__(self, token, valid=True):
+        self.token = token if valid else None
+        self.refresh_token = "r"
+        self.expiry = None
+        self.refreshed = 0
+
+    @property
+    def valid(self):
+        return self.token is not None
+
+    def refresh(self, request):
+        time.sleep(0.05)  # 同時リクエストが重なるように
+        self.refreshed += 1
+        self.token = f"fresh{self.refreshed}"
+
+    def to_json(self):
+        return json.dumps({"token": self.token, "refresh_token": self.refresh_token})
+
+
+def test_store_round_trip_and_settings(tmp_path):
+    store = TokenStore(str(tmp_path / "t.sqlite3"))
+    store.put("acme", {"token": "a"}, {"calendar_id": "acme@group"})
+    store.put("acme", {"token": "b"})  # settings=None は設定を残す
+    assert store.get("acme") == {"token": {"token": "b"}, "settings": {"calendar_id": "acme@group"}}
+    assert store.settings("nobody") == {} and store.get("nobody") is None
+    store.put("beta", {"token": "c"}, {})
+    assert store.tenants() == ["acme", "beta"]
+    store.delete("beta")
+    assert store.tenants() == ["acme"]
+
+
+def test_store_encrypts_tokens(tmp_path):
+    pytest.importorskip("cryptography")
+    from cryptography.fernet import Fernet
+    path = str(tmp_path / "t.sqlite3")
+    key = Fernet.generate_key().decode()
+    TokenStore(path, key).put("acme", {"refresh_token": "secret-refresh"})
+
+    raw = sqlite3.connect(path).execute("SELECT token FROM tenants").fetchone()[0]
+    assert b"secret-refresh" not in bytes(raw)
+    assert TokenStore(path, key).get("acme")["token"] == {"refresh_token": "secret-refresh"}
+    with pytest.raises(RuntimeError, match="GOOGLE_TOKEN_STORE_KEY"):
+        TokenStore(path, Fernet.generate_key().decode()).get("acme")
+
+
+def test_lru_is_bounded_and_hot_tenants_stay_cached(tmp_path):
+    metrics.reset()
+    store = TokenStore(str(tmp_path / "t.sqlite3"))
+    for i in range(5):
+        store.put(f"t{i}", {"token": f"tok{i}"})
+    built = []
+
+    def build(raw):
+        built.append(raw["token"])
+        return FakeCreds(raw["token"])
+
+    tc = TenantCreds(store, build, maxsize=2)
+    tc.get("t0"); tc.get("t1"); tc.get("t0"); tc.get("t2")  # t1 が一番古い → 追い出される
+    assert len(tc) == 2
+    assert tc.peek("t0").token == "tok0" and tc.peek("t1") is None
+    tc.get("t0")
+    assert built == ["tok0", "tok1", "tok2"]  # t0 は読み直していない
+    assert metrics.get("tenant_creds_hit") == 2 and metrics.get("tenant_creds_miss") == 3
+
+    with pytest.raises(RuntimeError, match="--tenant nobody"):
+        tc.get("nobody")
+
+
+def test_refresh_is_single_flight_per_tenant(tmp_path):
+    store = TokenStore(str(tmp_path / "t.sqlite3"))
+    store.put("acme", {"token": "old"}, {"sheets_id": "S"})
+    store.put("beta", {"token": "old"})
+    creds = FakeCreds("old", valid=False)
+    tc = TenantCreds(store, lambda raw: creds, maxsize=8)
+
+    got = []
+    threads = [threading.Thread(target=lambda: got.append(tc.get("acme"))) for _ in range(10)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    assert creds.refreshed == 1 and len(got) == 10 and all(c is creds for c in got)
+    # refresh 後のトークンはテナントの保存先に書き戻され、設定は残る
+    assert store.get("acme") == {"token": {"token": "fresh1", "refresh_token": "r"}, "settings": {"sheets_id": "S"}}
+    assert store.get("beta")["token"] == {"token": "old"}
+
+
+def test_current_tenant_routes_creds_and_settings(monkeypatch, tmp_path):
+    import app_intent_mvp
+    store = TokenStore(str(tmp_path / "t.sqlite3"))
+    store.put("acme", {"token": "acme-token"}, {"calendar_id": "acme@group", "sheets_id": "ACME"})
+    monkeypatch.setattr(app_intent_mvp, "token_store", store)
+    monkeypatch.setattr(app_intent_mvp, "_TENANT_CREDS", TenantCreds(store, lambda raw: FakeCreds(raw["token"])))
+    default = FakeCreds("default-token")
+    monkeypatch.setattr(app_intent_mvp._CREDS_CACHE, "get", lambda: default)
+    monkeypatch.setenv("GOOGLE_CALENDAR_ID", "primary")
+    monkeypatch.setenv("SHEETS_ID", "DEFAULT")
+
+    assert app_intent_mvp.get_google_creds() is default
+    assert app_intent_mvp.google_settings()["calendar_id"] == "primary"
+
+    async def main():
+        with tenant_store.tenant("acme"):
+            # to_thread 先にもテナントが引き継がれる
+            creds = await asyncio.to_thread(app_intent_mvp.get_google_creds)
+            assert creds.token == "acme-token"
+            assert app_intent_mvp.peek_google_creds() is creds
+            conf = app_intent_mvp.google_settings()
+            assert (conf["calendar_id"], conf["sheets_id"], conf["sheets_range"]) == ("acme@group", "ACME", "Sheet1!A:C")
+            return app_intent_mvp._google_credential()
+
+    acme_key = asyncio.run(main())
+    assert acme_key != app_intent_mvp._google_credential()  # レート制限の予算もテナントごと
+    assert tenant_store.current() is None
+
+
+def test_outbox_job_keeps_tenant(tmp_path):
+    path = str(tmp_path / "ob.sqlite3")
+    # テナント列が無い古い DB でも開ける
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, "
+                 "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, next_at REAL NOT NULL, "
+                 "lease_until REAL, result TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)")
+    conn.close()
+    ob = Outbox(path)
+    ob.enqueue("memo", {"values": []}, tenant="acme")
+    assert ob.claim()["tenant"] == "acme"
+
+
+
+def test_api_key_is_hashed_and_survives_token_updates(tmp_path):
+    path = str(tmp_path / "t.sqlite3")
+    store = TokenStore(path)
+    with pytest.raises(RuntimeError, match="--tenant nobody"):
+        store.issue_key("nobody")
+    store.put("acme", {"token": "a"}, {"calendar_id": "acme@group"})
+    key = store.issue_key("acme")
+    assert key not in str(sqlite3.connect(path).execute("SELECT * FROM tenants").fetchall())
+    store.put("acme", {"token": "b"}, {"calendar_id": "new@group"})  # 再同意・設定変更でもキーは残る
+    profile = store.profile("acme")
+    assert (profile["settings"], profile["key_hash"]) == ({"calendar_id": "new@group"}, tenant_store.key_hash(key))
+    assert store.profile("nobody") is None
+
+
+def test_settings_and_key_are_cached_in_the_lru_entry(tmp_path):
+    store = TokenStore(str(tmp_path / "t.sqlite3"))
+    store.put("acme", {"token": "a"}, {"sheets_id": "S"})
+    key = store.issue_key("acme")
+    reads = []
+    profile = store.profile
+    store.profile = lambda t: reads.append(t) or profile(t)
+    now = [0.0]
+    tc = TenantCreds(store, lambda raw: FakeCreds(raw["token"]), settings_ttl=60, timer=lambda: now[0])
+
+    assert tc.verify("acme", key) and not tc.verify("acme", "wrong") and not tc.verify("acme", None)
+    assert tc.settings("acme") == {"sheets_id": "S"} and tc.get("acme").token == "a"
+    assert reads == ["acme"]                   # よく使うテナントはディスクを読まない
+    assert not tc.verify("nobody", key) and tc.settings("nobody") == {} and len(tc) == 1
+
+    new_key = store.issue_key("acme")          # 再発行は settings_ttl 後に効く
+    now[0] += 61
+    assert tc.verify("acme", new_key) and not tc.verify("acme", key)
+
+
+def test_reissued_token_replaces_cached_creds(tmp_path):
+    store = TokenStore(str(tmp_path / "t.sqlite3"))
+    store.put("acme", {"token": "old"})
+    now = [0.0]
+    tc = TenantCreds(store, lambda raw: FakeCreds(raw["token"]), settings_ttl=60, timer=lambda: now[0])
+    assert tc.get("acme").token == "old"
+    store.put("acme", {"token": "reissued"})  # token_setup.py --tenant acme で再同意
+    now[0] += 30
+    assert tc.get("acme").token == "old"
+    now[0] += 31
+    assert tc.get("acme").token == "reissued"
+
+
+def test_endpoints_require_the_tenant_key(monkeypatch, tmp_path):
+    from fastapi.testclient import TestClient
+    import alexa_bridge
+    import app_intent_mvp
+    store = TokenStore(str(tmp_path / "t.sqlite3"))
+    store.put("acme", {"token": "a"})
+    store.put("beta", {"token": "b"})
+    key = store.issue_key("acme")
+    monkeypatch.setattr(app_intent_mvp, "DRY_RUN", True)
+    monkeypatch.setattr(app_intent_mvp, "_TENANT_CREDS", TenantCreds(store, lambda raw: FakeCreds(raw["token"])))
+    app_intent_mvp.idempotency.clear()
+    client = TestClient(app_intent_mvp.app)
+
+    def execute(headers):
+        return client.post("/execute", json={"text": "メモ: テナント"}, headers=headers).status_code
+
+    assert execute({"X-Tenant-Id": "acme"}) == 401
+    assert execute({"X-Tenant-Id": "acme", "X-Tenant-Key": "guess"}) == 401
+    assert execute({"X-Tenant-Id": "beta", "X-Tenant-Key": key}) == 401  # 他のテナントのキーでは通らない
+    assert execute({"X-Tenant-Id": "acme", "X-Tenant-Key": key}) == 200
+    assert execute({}) == 200                                            # テナント未指定は従来どおり
+    r = client.post("/calendar/events:batch", json={"events": [{"summary": "x"}]}, headers={"X-Tenant-Id": "acme"})
+    assert r.status_code == 401
+    r = TestClient(alexa_bridge.app).post("/alexa", json={"text": "メモ: テナント"}, headers={"X-Tenant-Id": "acme"})
+    assert r.status_code == 401
+    app_intent_mvp.idempotency.clear()
+
+
+def test_old_store_without_key_column_is_migrated(tmp_path):
+    path = str(tmp_path / "t.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE tenants (tenant TEXT PRIMARY KEY, token BLOB NOT NULL, "
+                 "settings TEXT NOT NULL DEFAULT '{}', updated_at REAL NOT NULL)")
+    conn.execute("INSERT INTO tenants VALUES ('acme', ?, '{}', 0)", (b'{"token": "a"}',))
+    conn.commit(); conn.close()
+    store = TokenStore(path)
+    profile = store.profile("acme")
+    assert (profile["settings"], profile["key_hash"]) == ({}, None)  # キー発行まではどのキーでも通らない
+    assert not TenantCreds(store, FakeCreds).verify("acme", "")
+    store.issue_key("acme")
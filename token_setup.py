@@ -1,12 +1,34 @@
 # token_setup.py （プロジェクト直下）
+# 使い方:
+#   python token_setup.py                          … GOOGLE_OAUTH_TOKEN_PATH に保存（単一利用者）
+#   python token_setup.py --tenant acme \
+#       --calendar-id xxx@group.calendar.google.com --sheets-id 1AbC...   … テナントの保存先（GOOGLE_TOKEN_STORE_PATH）に保存
+#                                                    （初回は API キーを発行して表示する。依頼時に X-Tenant-Key で送る）
+#   python token_setup.py --tenant acme --rotate-key … API キーだけ再発行する（同意はやり直さない）
 from pathlib import Path
-import os, json
+import argparse, os, json
 from urllib.parse import urlencode
 from requests_oauthlib import OAuth2Session
 from dotenv import load_dotenv
 
 load_dotenv(override=False)
 
+parser = argparse.ArgumentParser(description="Google OAuth トークンを同意コードで発行して保存する")
+parser.add_argument("--tenant", help="テナント ID（指定するとトークンをテナントの保存先に書く）")
+parser.add_argument("--calendar-id", help="このテナントの予定の登録先（省略時は GOOGLE_CALENDAR_ID）")
+parser.add_argument("--sheets-id", help="このテナントのメモの追記先（省略時は SHEETS_ID）")
+parser.add_argument("--sheets-range", help="このテナントの追記範囲（省略時は GOOGLE_SHEETS_RANGE）")
+parser.add_argument("--rotate-key", action="store_true", help="テナントの API キーを再発行する（前のキーは無効）")
+args = parser.parse_args()
+
+if args.rotate_key:
+    if not args.tenant:
+        parser.error("--rotate-key には --tenant が必要です")
+    import tenant_store
+    key = tenant_store.from_env().issue_key(args.tenant)
+    print(f"✅ API key issued: tenant={args.tenant}\n   X-Tenant-Key: {key}\n   （この表示きりです。安全な場所に控えてください）")
+    raise SystemExit(0)
+
 CLIENT_JSON = os.getenv("GOOGLE_OAUTH_CLIENT_JSON", ".env.variables/google_oauth_client.json")
 TOKEN_PATH  = os.getenv("GOOGLE_OAUTH_TOKEN_PATH",  ".env.variables/google_token.json")
 
@@ -52,6 +74,18 @@ token = oauth.fetch_token(
     include_client_id=True,
 )
 
-Path(TOKEN_PATH).parent.mkdir(parents=True, exist_ok=True)
-Path(TOKEN_PATH).write_text(json.dumps(token, ensure_ascii=False, indent=2), encoding="utf-8")
-print("✅ token saved:", TOKEN_PATH)
+if args.tenant:
+    import tenant_store
+    store = tenant_store.from_env()
+    settings = {k: v for k, v in (("calendar_id", args.calendar_id), ("sheets_id", args.sheets_id),
+                                  ("sheets_range", args.sheets_range)) if v}
+    # 設定を何も指定しなければ既存の設定を残す（トークンの再発行だけ）
+    store.put(args.tenant, dict(token), {**store.settings(args.tenant), **settings} if settings else None)
+    print(f"✅ token saved: tenant={args.tenant} ({store.path})")
+    if not store.profile(args.tenant)["key_hash"]:
+        key = store.issue_key(args.tenant)
+        print(f"   X-Tenant-Key: {key}\n   （この表示きりです。安全な場所に控えてください。再発行は --rotate-key）")
+else:
+    Path(TOKEN_PATH).parent.mkdir(parents=True, exist_ok=True)
+    Path(TOKEN_PATH).write_text(json.dumps(token, ensure_ascii=False, indent=2), encoding="utf-8")
+    print("✅ token saved:", TOKEN_PATH)
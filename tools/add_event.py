@@ -14,6 +14,8 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 import datetime
 import logging
+import retry_policy
+from google_services import insert_event, new_event_id
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -42,12 +44,13 @@ def add_event(summary, start_dt, end_dt, calendar_id="primary"):
     creds = get_credentials()
     service = build("calendar", "v3", credentials=creds)
     event = {
+        "id": new_event_id(),  # 再試行しても同じ id（二重登録にならない）
         "summary": summary,
         "start": {"dateTime": start_dt, "timeZone": "Asia/Tokyo"},
         "end": {"dateTime": end_dt, "timeZone": "Asia/Tokyo"},
     }
     try:
-        result = service.events().insert(calendarId=calendar_id, body=event).execute()
+        result = retry_policy.from_env("calendar").call(insert_event, service, calendar_id, event)
         logger.info(f"✅ イベント登録成功: {result.get('htmlLink')}")
         logger.debug(f"[DEBUG] APIレスポンス: {result}")
         return {"ok": True, "link": result.get("htmlLink"), "result": result}
@@ -0,0 +1,65 @@
+# tools/lw_client.py
+"""
+LINE WORKS 通知用の共有 httpx.AsyncClient。
+
+通知のたびに AsyncClient を作ると毎回 TCP/TLS ハンドシェイクが走るため、
+プロセスで1つだけ作って keep-alive / HTTP/2 で使い回す。
+FastAPI では lifespan の startup()/shutdown() で開閉し、
+スクリプト等 lifespan の外では初回利用時に作る。
+"""
+from __future__ import annotations
+import asyncio, importlib.util, os
+from typing import Optional
+
+import httpx
+from loguru import logger
+
+_client: Optional[httpx.AsyncClient] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _http2_enabled() -> bool:
+    if os.getenv("LW_HTTP2", "true").lower() != "true":
+        return False
+    if importlib.util.find_spec("h2") is None:
+        logger.warning("h2 が未インストールのため LINE WORKS 通知は HTTP/1.1 で送ります（pip install h2）")
+        return False
+    return True
+
+
+def _new_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=_http2_enabled(),
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("LW_HTTP_MAX_CONNECTIONS", "20")),
+            max_keepalive_connections=int(os.getenv("LW_HTTP_MAX_KEEPALIVE", "10")),
+            keepalive_expiry=float(os.getenv("LW_HTTP_KEEPALIVE_EXPIRY_SEC", "30")),
+        ),
+        # フェーズ毎のタイムアウト（接続 / 読込 / 書込 / プール空き待ち）
+        timeout=httpx.Timeout(
+            connect=float(os.getenv("LW_HTTP_CONNECT_TIMEOUT_SEC", "2")),
+            read=float(os.getenv("LW_HTTP_READ_TIMEOUT_SEC", "3")),
+            write=float(os.getenv("LW_HTTP_WRITE_TIMEOUT_SEC", "3")),
+            pool=float(os.getenv("LW_HTTP_POOL_TIMEOUT_SEC", "1")),
+        ),
+    )
+
+
+def get_client() -> httpx.AsyncClient:
+    """共有クライアントを返す。イベントループが変わっていたら作り直す（テスト等）。"""
+    global _client, _loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _loop is not loop or _client.is_closed:
+        _client, _loop = _new_client(), loop
+    return _client
+
+
+async def startup() -> None:
+    get_client()
+
+
+async def shutdown() -> None:
+    global _client, _loop
+    client, _client, _loop = _client, None, None
+    if client is not None and not client.is_closed:
+        await client.aclose()
@@ -0,0 +1,217 @@
+# tools/notify_queue.py
+"""
+LINE WORKS 通知のバックグラウンド送信キュー。
+
+- enqueue() は積むだけで即座に戻る（/execute のレイテンシに通知時間を含めない）
+- 宛先（Webhook URL）ごとに短い時間窓でメッセージをまとめて1回で投稿
+- 宛先ごとのトークンバケットで Webhook のレート制限を超えない
+- LINE WORKS のサーキットブレーカが open の間は送らず、half_open になる頃に積み直す
+- 429/5xx/通信エラーは retry_policy の指数バックオフ（Retry-After 優先）で再送、その他の 4xx は捨てる
+"""
+from __future__ import annotations
+import asyncio, os, threading, time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from loguru import logger
+
+import circuit_breaker
+import priority_scheduler
+import retry_policy
+from circuit_breaker import CircuitOpenError
+from tools import lw_client
+
+
+class TokenBucket:
+    """rate: 1秒あたりの補充数 / burst: 最大保持数"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """1トークン取る。足りなければ取れるまでの待ち秒数を返す（その分は前借り）。"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class RetryableSendError(Exception):
+    """再送すべき失敗。status / headers があれば retry_policy が Retry-After を見る。"""
+    retryable = True
+
+    def __init__(self, message: str, status: Optional[int] = None, headers: Optional[dict] = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+async def post_webhook(url: str, text: str) -> None:
+    """共有クライアントで投稿。再送すべき失敗は RetryableSendError を投げる。"""
+    try:
+        r = await lw_client.get_client().post(url, json={"text": text})
+    except httpx.TransportError as e:
+        raise RetryableSendError(str(e)) from e
+    if r.status_code in retry_policy.RETRYABLE_STATUS:
+        raise RetryableSendError(f"status={r.status_code}", r.status_code, dict(r.headers))
+    if r.status_code // 100 != 2:
+        logger.warning(f"LINE WORKS webhook status={r.status_code} body={r.text}（再送しません）")
+
+
+class NotifyDispatcher:
+    def __init__(self,
+                 send: Callable[[str, str], Awaitable[None]] = post_webhook,
+                 queue_size: int = 1000,
+                 workers: int = 4,
+                 rate_per_sec: float = 1.0,
+                 burst: float = 5.0,
+                 coalesce_window: float = 0.5,
+                 coalesce_max: int = 20,
+                 max_retries: int = 3,
+                 backoff_base: float = 0.5,
+                 backoff_max: float = 10.0,
+                 retry_budget: float = 60.0):
+        self._send = send
+        self._queue_size = queue_size
+        self._workers = workers
+        self._rate = rate_per_sec
+        self._burst = burst
+        self._window = coalesce_window
+        self._coalesce_max = coalesce_max
+        self._retry = retry_policy.RetryPolicy("lineworks", max_attempts=max_retries + 1,
+                                               base=backoff_base, cap=backoff_max, budget=retry_budget,
+                                               breaker=circuit_breaker.get("lineworks"))
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread_id: Optional[int] = None
+        self._pending: Dict[str, List[str]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self.dropped = 0
+        self.sent = 0
+
+    @property
+    def running(self) -> bool:
+        return self._queue is not None
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self._workers)]
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """まとめ待ちのメッセージも流し、送信が終わるまで最大 timeout 秒待つ。"""
+        if not self.running:
+            return
+        for url in list(self._pending):
+            self._flush(url)
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"LINE WORKS 通知の送信待ちを打ち切りました（残り {self._queue.qsize()} 件）")
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks, self._queue, self._loop = [], None, None
+
+    def enqueue(self, text: str, url: Optional[str] = None) -> bool:
+        """通知を積む（どのスレッドからでも可）。URL 未設定 / 停止中 / 満杯なら False。"""
+        url = url or os.getenv("LINEWORKS_WEBHOOK_URL")
+        if not url or not text or not self.running:
+            return False
+        if threading.get_ident() != self._thread_id:
+            self._loop.call_soon_threadsafe(self._add, url, text)
+            return True
+        return self._add(url, text)
+
+    # ---- 内部処理（イベントループのスレッドで動く） ----
+    def _add(self, url: str, text: str) -> bool:
+        pending = sum(len(v) for v in self._pending.values())
+        if self._queue is None or self._queue.qsize() + pending >= self._queue_size:
+            self.dropped += 1
+            logger.warning("LINE WORKS 通知キューが満杯のため破棄しました")
+            return False
+        buf = self._pending.setdefault(url, [])
+        buf.append(text)
+        if len(buf) >= self._coalesce_max:
+            self._flush(url)
+        elif url not in self._timers:
+            self._timers[url] = self._loop.call_later(self._window, self._flush, url)
+        return True
+
+    def _flush(self, url: str) -> None:
+        timer = self._timers.pop(url, None)
+        if timer is not None:
+            timer.cancel()
+        msgs = self._pending.pop(url, None)
+        if not msgs or self._queue is None:
+            return
+        try:
+            self._queue.put_nowait((url, "\n".join(msgs)))
+        except asyncio.QueueFull:
+            self.dropped += len(msgs)
+            logger.warning(f"LINE WORKS 通知キューが満杯のため {len(msgs)} 件破棄しました")
+
+    def _bucket(self, url: str) -> TokenBucket:
+        b = self._buckets.get(url)
+        if b is None:
+            b = self._buckets[url] = TokenBucket(self._rate, self._burst)
+        return b
+
+    async def _worker(self) -> None:
+        while True:
+            url, text = await self._queue.get()
+            try:
+                await self._deliver(url, text)
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, url: str, text: str) -> None:
+        @asynccontextmanager
+        async def guard():
+            # 再送もレート制限の内側で。待ちはサーキットブレーカの外（ブレーカは送信だけを測る）
+            wait = self._bucket(url).take()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            async with priority_scheduler.aslot():
+                yield
+        try:
+            await self._retry.acall_guarded(guard, self._send, url, text)
+            self.sent += 1
+        except CircuitOpenError as e:
+            self._defer(url, text, e.retry_after)
+        except RetryableSendError as e:
+            logger.warning(f"LINE WORKS notify gave up: {e}")
+        except Exception as e:
+            logger.warning(f"LINE WORKS notify failed: {e}")
+
+
+    def _defer(self, url: str, text: str, delay: float) -> None:
+        # 停止処理中なら諦める（stop() は積み直しを待たない）
+        if self._loop is None:
+            logger.warning("LINE WORKS 通知をサーキットブレーカ open のため破棄しました")
+            self.dropped += 1
+            return
+        logger.info(f"LINE WORKS circuit open; notify deferred {delay:.1f}s")
+        self._loop.call_later(max(delay, 0.1), self._add, url, text)
+
+
+def from_env() -> NotifyDispatcher:
+    return NotifyDispatcher(
+        queue_size=int(os.getenv("LW_NOTIFY_QUEUE_SIZE", "1000")),
+        workers=int(os.getenv("LW_NOTIFY_WORKERS", "4")),
+        rate_per_sec=float(os.getenv("LW_NOTIFY_RATE_PER_SEC", "1")),
+        burst=float(os.getenv("LW_NOTIFY_BURST", "5")),
+        coalesce_window=int(os.getenv("LW_NOTIFY_COALESCE_MS", "500")) / 1000,
+        max_retries=int(os.getenv("LW_NOTIFY_MAX_RETRIES", "3")),
+        retry_budget=float(os.getenv("LW_NOTIFY_RETRY_BUDGET_SEC", "60")),
+    )
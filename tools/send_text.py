@@ -5,6 +5,18 @@ LINE WORKS Incoming Webhook へテキストを送る最小ユーティリティ
 """
 import os, httpx
 from loguru import logger
+import priority_scheduler
+import retry_policy
+from tools import lw_client
+
+# 呼び出し元が応答を待っているので、再試行は短めに
+_RETRY = retry_policy.from_env("lineworks", max_attempts=3, budget=5.0)
+
+async def _post(url: str, text: str) -> httpx.Response:
+    r = await lw_client.get_client().post(url, json={"text": text})
+    if r.status_code in retry_policy.RETRYABLE_STATUS:
+        r.raise_for_status()  # 429/5xx は HTTPStatusError にして再試行させる
+    return r
 
 async def send_text_to_lineworks(text: str) -> bool:
     url = os.getenv("LINEWORKS_WEBHOOK_URL")
@@ -12,12 +24,13 @@ async def send_text_to_lineworks(text: str) -> bool:
         logger.info("LINEWORKS_WEBHOOK_URL 未設定のため送信スキップ")
         return False
     try:
-        async with httpx.AsyncClient(timeout=3.0) as cli:
-            r = await cli.post(url, json={"text": text})
-            if r.status_code // 100 == 2:
-                return True
-            logger.warning(f"LINE WORKS webhook status={r.status_code} body={r.text}")
-            return False
+        # 共有クライアント（keep-alive / HTTP/2）で送る
+        # 同時実行枠はブレーカの外で取る（枠待ちを遅い呼び出しに数えない）
+        r = await _RETRY.acall_guarded(priority_scheduler.aslot, _post, url, text)
+        if r.status_code // 100 == 2:
+            return True
+        logger.warning(f"LINE WORKS webhook status={r.status_code} body={r.text}")
+        return False
     except Exception as e:
         logger.warning(f"LINE WORKS webhook error: {e}")
         return False